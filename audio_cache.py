@@ -0,0 +1,190 @@
+import os
+import json
+import shutil
+import logging
+import threading
+from collections import OrderedDict
+
+from config import AUDIO_CACHE_DIR, AUDIO_CACHE_MAX_BYTES
+
+logger = logging.getLogger(__name__)
+
+class AudioCache:
+    """
+    Дисковый кэш аудиофайлов с ключом (video_id, профиль кодирования).
+
+    Каждая запись - это аудиофайл <video_id>.<профиль>.<ext> и файл метаданных
+    <video_id>.<профиль>.json рядом с ним. Файлы сначала пишутся во временную папку
+    внутри кэша, а затем переименовываются (атомарная публикация), поэтому
+    недокачанный файл никогда не попадет в выдачу. При превышении лимита по объему
+    удаляются давно не использованные записи (LRU), кроме тех, что сейчас отправляются.
+    """
+
+    TMP_DIRNAME = ".tmp"
+
+    def __init__(self, directory: str, max_bytes: int):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.tmp_dir = os.path.join(directory, self.TMP_DIRNAME)
+        self._entries = OrderedDict() # key -> {'path', 'size', 'title'} в порядке от старых к новым
+        self._pins = {} # key -> количество активных пользователей файла
+        self._total_bytes = 0
+        self._lock = threading.Lock()
+
+    def use_directory(self, directory: str):
+        """
+        Переносит кэш в другую папку; вызывается до sweep(). Каждому процессу worker.py
+        нужна своя папка, иначе sweep() одного процесса удалит недокачанные файлы другого.
+        """
+        self.directory = directory
+        self.tmp_dir = os.path.join(directory, self.TMP_DIRNAME)
+
+    @staticmethod
+    def make_key(video_id: str, profile: str) -> str:
+        return f"{video_id}.{profile}"
+
+    def _meta_path(self, key: str) -> str:
+        return os.path.join(self.directory, f"{key}.json")
+
+    def sweep(self):
+        """Очищает временные и осиротевшие файлы и заново строит индекс. Вызывается при запуске."""
+        os.makedirs(self.directory, exist_ok=True)
+        shutil.rmtree(self.tmp_dir, ignore_errors=True)
+        os.makedirs(self.tmp_dir, exist_ok=True)
+
+        entries = []
+        known_files = set()
+        for name in os.listdir(self.directory):
+            if not name.endswith(".json"):
+                continue
+            meta_path = os.path.join(self.directory, name)
+            try:
+                with open(meta_path, encoding="utf-8") as f:
+                    meta = json.load(f)
+                audio_path = os.path.join(self.directory, meta["file"])
+                size = os.path.getsize(audio_path)
+                if size < 1024:
+                    raise ValueError(f"слишком маленький файл: {size} байт")
+            except Exception as e:
+                logger.warning(f"Запись кэша {name} повреждена ({e}), удаляем.")
+                self._remove_file(meta_path)
+                continue
+            known_files.update((name, meta["file"]))
+            entries.append((os.path.getmtime(audio_path), name[:-len(".json")], audio_path, size, meta.get("title")))
+
+        # Все, что не описано метаданными, - остатки прерванных загрузок или старых версий бота
+        removed = 0
+        for name in os.listdir(self.directory):
+            path = os.path.join(self.directory, name)
+            if name not in known_files and os.path.isfile(path):
+                self._remove_file(path)
+                removed += 1
+
+        with self._lock:
+            self._entries.clear()
+            self._total_bytes = 0
+            for _, key, audio_path, size, title in sorted(entries):
+                self._entries[key] = {'path': audio_path, 'size': size, 'title': title}
+                self._total_bytes += size
+            self._evict_locked()
+        logger.info(f"Кэш аудио: {len(self._entries)} файлов, {self._total_bytes // (1024 * 1024)} МБ, удалено осиротевших файлов: {removed}")
+
+    def get(self, video_id: str, profile: str):
+        """
+        Возвращает (путь, название) из кэша или None.
+        Найденный файл закрепляется и не будет вытеснен до вызова release().
+        """
+        key = self.make_key(video_id, profile)
+        with self._lock:
+            entry = self._entries.get(key)
+            if not entry:
+                return None
+            if not os.path.exists(entry['path']):
+                self._drop_locked(key)
+                return None
+            self._entries.move_to_end(key)
+            self._pins[key] = self._pins.get(key, 0) + 1
+        try:
+            os.utime(entry['path']) # Чтобы порядок LRU сохранился после перезапуска
+        except OSError:
+            pass
+        return entry['path'], entry['title']
+
+    def has(self, video_id: str, profile: str) -> bool:
+        """Проверяет наличие трека в кэше без закрепления файла"""
+        with self._lock:
+            return self.make_key(video_id, profile) in self._entries
+
+    def publish(self, video_id: str, profile: str, src_path: str, title: str) -> str:
+        """
+        Переносит готовый файл из временной папки кэша в кэш и возвращает новый путь.
+        Опубликованный файл закрепляется так же, как в get().
+        """
+        # Файл вне временной папки кэша значит, что скачивание шло в чужую папку
+        # (например, дочерний процесс не получил папку из use_directory()),
+        # и sweep() другого процесса мог удалить его во время загрузки
+        if os.path.commonpath([os.path.abspath(src_path), os.path.abspath(self.tmp_dir)]) != os.path.abspath(self.tmp_dir):
+            self._remove_file(src_path)
+            raise ValueError(f"Файл {src_path} скачан вне временной папки кэша {self.tmp_dir}")
+        key = self.make_key(video_id, profile)
+        ext = os.path.splitext(src_path)[1]
+        dest_path = os.path.join(self.directory, f"{key}{ext}")
+        meta = {'video_id': video_id, 'profile': profile, 'title': title, 'file': os.path.basename(dest_path)}
+
+        # Сначала аудио, затем метаданные: запись без метаданных считается незавершенной
+        os.replace(src_path, dest_path)
+        tmp_meta_path = os.path.join(self.tmp_dir, f"{key}.json")
+        with open(tmp_meta_path, "w", encoding="utf-8") as f:
+            json.dump(meta, f, ensure_ascii=False)
+        os.replace(tmp_meta_path, self._meta_path(key))
+
+        size = os.path.getsize(dest_path)
+        with self._lock:
+            if key in self._entries:
+                self._total_bytes -= self._entries[key]['size']
+            self._entries[key] = {'path': dest_path, 'size': size, 'title': title}
+            self._entries.move_to_end(key)
+            self._total_bytes += size
+            self._pins[key] = self._pins.get(key, 0) + 1
+            self._evict_locked()
+        logger.info(f"Файл {key} добавлен в кэш ({size} байт)")
+        return dest_path
+
+    def release(self, path: str):
+        """Снимает закрепление с файла, полученного через get() или publish()."""
+        key = os.path.splitext(os.path.basename(path))[0]
+        with self._lock:
+            count = self._pins.get(key, 0)
+            if count <= 1:
+                self._pins.pop(key, None)
+            else:
+                self._pins[key] = count - 1
+            self._evict_locked()
+
+    def _evict_locked(self):
+        if self._total_bytes <= self.max_bytes:
+            return
+        for key in list(self._entries):
+            if self._total_bytes <= self.max_bytes:
+                break
+            if self._pins.get(key):
+                continue
+            logger.info(f"Файл {key} вытеснен из кэша")
+            self._drop_locked(key)
+
+    def _drop_locked(self, key: str):
+        entry = self._entries.pop(key)
+        self._total_bytes -= entry['size']
+        self._remove_file(self._meta_path(key))
+        self._remove_file(entry['path'])
+
+    @staticmethod
+    def _remove_file(path: str):
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+        except OSError as e:
+            logger.error(f"Ошибка при удалении файла кэша {path}: {e}")
+
+audio_cache = AudioCache(AUDIO_CACHE_DIR, AUDIO_CACHE_MAX_BYTES)
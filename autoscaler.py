@@ -0,0 +1,184 @@
+import os
+import math
+import time
+import asyncio
+import logging
+from dataclasses import dataclass
+
+from config import (
+    AUTOSCALE_INTERVAL, AUTOSCALE_WINDOW, AUTOSCALE_MIN_SAMPLES, AUTOSCALE_ERROR_RATE,
+    AUTOSCALE_THROTTLE_RATE, AUTOSCALE_CPU_LOAD, AUTOSCALE_LATENCY_FACTOR, AUTOSCALE_DECREASE_FACTOR,
+    AUTOSCALE_DOWNLOAD_UTILISATION,
+)
+import download_engine
+from download_engine import download_stats
+
+logger = logging.getLogger(__name__)
+
+@dataclass
+class WorkerSlot:
+    """Воркер под управлением WorkerSupervisor"""
+    name: str
+    task: asyncio.Task = None
+    busy: bool = False  # Выполняет задание; такой воркер не отменяется, а завершается после задания
+    retiring: bool = False  # Воркер должен завершиться, не беря новых заданий
+
+def cpu_load():
+    """Средняя загрузка за минуту на одно ядро или None, если система ее не сообщает"""
+    try:
+        return os.getloadavg()[0] / (os.cpu_count() or 1)
+    except (AttributeError, OSError):
+        return None
+
+class WorkerSupervisor:
+    """
+    Меняет число воркеров скачивания на ходу по правилу AIMD.
+
+    Раз в AUTOSCALE_INTERVAL секунд оцениваются очередь, загрузка CPU, занятость слотов
+    движка скачивания и статистика скачиваний за AUTOSCALE_WINDOW секунд. Признаки
+    перегрузки - троттлинг YouTube (429), рост доли временных сетевых ошибок (ошибки
+    недоступных видео не учитываются), загрузка CPU выше AUTOSCALE_CPU_LOAD и медианная
+    длительность скачивания выше базовой в AUTOSCALE_LATENCY_FACTOR раз - уменьшают число
+    воркеров в 1 / AUTOSCALE_DECREASE_FACTOR раз, после чего рост приостанавливается на
+    несколько интервалов. Без перегрузки воркер добавляется по одному, пока очередь длиннее
+    числа воркеров, а слоты скачивания заняты меньше AUTOSCALE_DOWNLOAD_UTILISATION времени:
+    значит, воркеры ждут сеть (отправку в Telegram), а не свободный процесс. Воркер
+    убирается по одному, когда очередь пуста и часть воркеров простаивает.
+
+    spawn(name, slot) должна возвращать корутину воркера, которая проверяет slot.retiring
+    между заданиями и выставляет slot.busy на время задания.
+    """
+
+    def __init__(self, spawn, queue, min_workers: int, max_workers: int, interval: float = AUTOSCALE_INTERVAL):
+        self.spawn = spawn
+        self.queue = queue
+        self.min_workers = max(1, min_workers)
+        self.max_workers = max(self.min_workers, max_workers)
+        self.interval = interval
+        self._slots = []
+        self._counter = 0
+        self._task = None
+        self._hold_until = 0.0
+        self._baseline_seconds = None
+        self._busy_seconds = download_stats.busy_seconds()
+        self._measured_at = time.monotonic()
+        self._utilisation = None
+
+    @property
+    def size(self) -> int:
+        return sum(1 for slot in self._slots if not slot.retiring)
+
+    def _spawn_one(self):
+        self._counter += 1
+        slot = WorkerSlot(f"DownloadWorker-{self._counter}")
+        slot.task = asyncio.create_task(self.spawn(slot.name, slot))
+        slot.task.add_done_callback(lambda _, slot=slot: self._slots.remove(slot) if slot in self._slots else None)
+        self._slots.append(slot)
+
+    def _retire_one(self):
+        # Сначала убираем простаивающие воркеры: их можно отменить сразу
+        active = [slot for slot in self._slots if not slot.retiring]
+        slot = next((slot for slot in reversed(active) if not slot.busy), active[-1])
+        slot.retiring = True
+        if not slot.busy:
+            slot.task.cancel()
+
+    def resize(self, target: int):
+        target = min(self.max_workers, max(self.min_workers, target))
+        while self.size < target:
+            self._spawn_one()
+        while self.size > target:
+            self._retire_one()
+        # Оценка ожидания в FairQueue зависит от числа воркеров
+        if hasattr(self.queue, 'workers'):
+            self.queue.workers = target
+
+    def _measure_utilisation(self):
+        """
+        Доля времени с прошлого замера, когда слоты движка скачивания были заняты,
+        или None, если число слотов не ограничено
+        """
+        busy_seconds, now = download_stats.busy_seconds(), time.monotonic()
+        busy, elapsed = busy_seconds - self._busy_seconds, now - self._measured_at
+        self._busy_seconds, self._measured_at = busy_seconds, now
+        capacity = download_engine.backend.capacity
+        if not capacity or elapsed <= 0:
+            return None
+        return busy / (elapsed * capacity)
+
+    def decide(self, depth: int, stats: dict, load, utilisation=None) -> tuple:
+        """
+        Возвращает (новое число воркеров, причина) по длине очереди, статистике скачиваний
+        (download_stats.snapshot), загрузке CPU на ядро и занятости слотов скачивания
+        (None - слоты не ограничены).
+        """
+        current = self.size
+        enough = stats['count'] >= AUTOSCALE_MIN_SAMPLES
+        median = stats['median_seconds']
+        congestion = None
+        if enough and stats['throttle_rate'] >= AUTOSCALE_THROTTLE_RATE:
+            congestion = f"троттлинг YouTube: {stats['throttle_rate']:.0%} запросов"
+        elif enough and stats['transient_rate'] >= AUTOSCALE_ERROR_RATE:
+            congestion = f"сетевые ошибки скачивания: {stats['transient_rate']:.0%}"
+        elif load is not None and load >= AUTOSCALE_CPU_LOAD:
+            congestion = f"загрузка CPU {load:.2f} на ядро"
+        elif enough and median and self._baseline_seconds and median > self._baseline_seconds * AUTOSCALE_LATENCY_FACTOR:
+            congestion = f"медиана скачивания {median:.1f} с при обычной {self._baseline_seconds:.1f} с"
+
+        if congestion:
+            # После перегрузки не наращиваем воркеры, пока не накопится новая статистика
+            self._hold_until = time.monotonic() + AUTOSCALE_WINDOW
+            return math.floor(current * AUTOSCALE_DECREASE_FACTOR), congestion
+        if enough and median:
+            # Базовая длительность - скользящее среднее медиан в спокойные периоды
+            self._baseline_seconds = median if self._baseline_seconds is None else 0.9 * self._baseline_seconds + 0.1 * median
+        if depth > current and time.monotonic() >= self._hold_until:
+            # Когда слоты скачивания заняты почти все время, новый воркер только ждал бы процесс
+            if utilisation is None:
+                return current + 1, f"в очереди {depth} заданий"
+            if utilisation < AUTOSCALE_DOWNLOAD_UTILISATION:
+                return current + 1, f"в очереди {depth} заданий, слоты скачивания заняты {utilisation:.0%} времени"
+        busy = sum(1 for slot in self._slots if slot.busy and not slot.retiring)
+        if depth == 0 and busy < current - 1:
+            return current - 1, f"очередь пуста, заняты {busy} из {current}"
+        return current, None
+
+    async def _loop(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            current = self.size
+            self._utilisation = self._measure_utilisation()
+            target, reason = self.decide(self.queue.qsize(), download_stats.snapshot(AUTOSCALE_WINDOW), cpu_load(), self._utilisation)
+            target = min(self.max_workers, max(self.min_workers, target))
+            if target == current:
+                continue
+            logger.info(f"Автомасштабирование: {current} -> {target} воркеров ({reason})")
+            self.resize(target)
+
+    def start(self, initial: int):
+        self.resize(initial)
+        if self._task is None:
+            self._task = asyncio.create_task(self._loop())
+        logger.info(f"Автомасштабирование воркеров: {self.size} (от {self.min_workers} до {self.max_workers})")
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        tasks = [slot.task for slot in self._slots]
+        for task in tasks:
+            task.cancel()
+        results = await asyncio.gather(*tasks, return_exceptions=True)
+        for task, result in zip(tasks, results):
+            if isinstance(result, Exception) and not isinstance(result, asyncio.CancelledError):
+                logger.error(f"Воркер завершился с ошибкой: {result}")
+        logger.info("Все воркеры остановлены.")
+
+    def stats(self) -> dict:
+        return {
+            'workers': self.size,
+            'busy': sum(1 for slot in self._slots if slot.busy),
+            'baseline_seconds': round(self._baseline_seconds, 1) if self._baseline_seconds else None,
+            'download_utilisation': round(self._utilisation, 2) if self._utilisation is not None else None,
+        }
@@ -0,0 +1,292 @@
+import os
+import time
+import asyncio
+import logging
+from dataclasses import dataclass, field
+from aiogram.exceptions import TelegramBadRequest
+from aiogram.types import Message, FSInputFile, InputMediaAudio
+
+from audio_cache import audio_cache
+from config import (
+    AUDIO_PROFILE, DOWNLOAD_LIMIT_PER_DAY, BULK_RESOLVE_CONCURRENCY,
+    BULK_DOWNLOAD_CONCURRENCY, BULK_MEDIA_GROUP_SIZE,
+)
+from database import get_audio_file_id, save_audio_file_id, delete_audio_file_id
+from download_engine import download_audio, download_limit, prefetch_audio
+from quota import quota_cache
+from search_cache import search_cache
+from singleflight import SingleFlight
+from spotify_client import spotify
+from utils import FIT_PROFILE, extract_playlist_id, get_youtube_playlist, is_stale_file_id_error
+
+logger = logging.getLogger(__name__)
+
+# Не чаще одного редактирования сообщения о прогрессе за указанное число секунд
+PROGRESS_UPDATE_INTERVAL = 2.0
+
+@dataclass
+class BulkJob:
+    """
+    Групповое задание на скачивание плейлиста или альбома.
+
+    Занимает одно место в очереди скачивания. Треки - словари с ключами
+    title, performer и query (поиск на YouTube) или video_id (уже известное видео).
+    """
+    message: Message
+    user_id: int
+    title: str
+    tracks: list
+    progress_message: Message = None
+    resolved: int = 0
+    downloaded: int = 0
+    sent: int = 0
+    failed: int = 0
+    limited: int = 0
+    _last_progress_at: float = field(default=0.0, repr=False)
+
+    def progress_text(self) -> str:
+        total = len(self.tracks)
+        text = (
+            f"<b>📀 {self.title}</b>\n\n"
+            f"<b>Найдено на YouTube:</b> {self.resolved}/{total}\n"
+            f"<b>Скачано:</b> {self.downloaded}/{total}\n"
+            f"<b>Отправлено:</b> {self.sent}/{total}"
+        )
+        if self.failed:
+            text += f"\n<b>Не удалось:</b> {self.failed}"
+        if self.limited:
+            text += f"\n<b>Пропущено из-за дневного лимита:</b> {self.limited}"
+        return text
+
+    async def report_progress(self, force: bool = False):
+        if self.progress_message is None:
+            return
+        now = time.monotonic()
+        if not force and now - self._last_progress_at < PROGRESS_UPDATE_INTERVAL:
+            return
+        self._last_progress_at = now
+        try:
+            await self.progress_message.edit_text(self.progress_text(), parse_mode="HTML")
+        except TelegramBadRequest as e:
+            # "message is not modified" и удаленное сообщение не мешают скачиванию
+            logger.debug(f"Не удалось обновить прогресс '{self.title}': {e}")
+
+def is_collection_url(url: str) -> bool:
+    """Проверяет, что ссылка указывает на плейлист или альбом Spotify либо на плейлист YouTube"""
+    return bool(spotify.parse_collection(url) or extract_playlist_id(url))
+
+async def resolve_collection(url: str, limit: int):
+    """
+    Получает название и треки плейлиста или альбома.
+
+    Returns:
+        (str, list): Название и треки в формате BulkJob.tracks
+    """
+    collection = spotify.parse_collection(url)
+    if collection:
+        name, tracks = await asyncio.to_thread(spotify.collection_tracks, *collection, limit)
+        return name, [
+            {'title': track['title'], 'performer': track['artist'], 'query': track['query'], 'video_id': None}
+            for track in tracks
+        ]
+
+    playlist_id = extract_playlist_id(url)
+    name, videos = await get_youtube_playlist(playlist_id, limit)
+    return name or "Плейлист YouTube", [
+        {'title': video['title'], 'performer': video['uploader'], 'query': None, 'video_id': video['id']}
+        for video in videos
+    ]
+
+@dataclass
+class _PreparedTrack:
+    """Трек, готовый к отправке: file_id из Telegram или закрепленный файл в кэше"""
+    video_id: str
+    title: str
+    performer: str
+    file_id: str = None
+    file_path: str = None
+    download_title: str = None
+    profile: str = None
+
+    def as_media(self) -> InputMediaAudio:
+        if self.file_id:
+            media = self.file_id
+        else:
+            media = FSInputFile(path=self.file_path, filename=f"{self.title[:60]}{os.path.splitext(self.file_path)[1]}")
+        return InputMediaAudio(media=media, title=self.title[:64], performer=self.performer[:64])
+
+async def _download_track(track: _PreparedTrack, flights: SingleFlight,
+                          job_download_limit: asyncio.Semaphore, profile_name: str):
+    """
+    Скачивает трек в кэш; закрепленный файл освобождает run_bulk_job после отправки.
+    Сначала берется место задания, затем общий download_limit, поэтому пакеты
+    скачивают в том же бюджете, что и одиночные треки.
+    """
+    video_url = f"https://www.youtube.com/watch?v={track.video_id}"
+    async with job_download_limit, download_limit:
+        await flights.run(f"{track.video_id}:{profile_name}", prefetch_audio, video_url, profile_name)
+        track.file_path, track.download_title, track.profile = await download_audio(video_url, profile_name)
+
+async def _prepare_track(job: BulkJob, track: dict, flights: SingleFlight,
+                         resolve_limit: asyncio.Semaphore, job_download_limit: asyncio.Semaphore,
+                         profile_name: str, quota):
+    """Находит трек на YouTube, резервирует лимит и получает file_id или файл. Возвращает None при неудаче"""
+    video_id = track['video_id']
+    if video_id is None:
+        async with resolve_limit:
+            results = await search_cache.search(track['query'], 1)
+        if not results:
+            logger.warning(f"Пакет '{job.title}': не найдено на YouTube '{track['query']}'")
+            job.failed += 1
+            await job.report_progress()
+            return None
+        video_id = results[0]['id']
+    job.resolved += 1
+    await job.report_progress()
+
+    if not await quota.reserve(job.user_id, DOWNLOAD_LIMIT_PER_DAY):
+        job.limited += 1
+        return None
+
+    prepared = _PreparedTrack(video_id, track['title'], track['performer'])
+    try:
+        cached = await get_audio_file_id(video_id, (profile_name, FIT_PROFILE))
+        if cached:
+            prepared.file_id, prepared.download_title = cached
+        else:
+            await _download_track(prepared, flights, job_download_limit, profile_name)
+        job.downloaded += 1
+        await job.report_progress()
+    except asyncio.CancelledError:
+        quota.release(job.user_id)
+        if prepared.file_path:
+            audio_cache.release(prepared.file_path)
+        raise
+    except Exception as e:
+        logger.error(f"Пакет '{job.title}': ошибка при скачивании {video_id}: {e}")
+        quota.release(job.user_id)
+        job.failed += 1
+        await job.report_progress()
+        return None
+    return prepared
+
+async def _send_one(job: BulkJob, track: _PreparedTrack, reply_to: int):
+    """Отправляет трек отдельным сообщением"""
+    media = track.as_media()
+    return await job.message.bot.send_audio(
+        chat_id=job.message.chat.id, audio=media.media, title=media.title,
+        performer=media.performer, reply_to_message_id=reply_to,
+    )
+
+async def _resend_track(job: BulkJob, track: _PreparedTrack, reply_to: int, flights: SingleFlight,
+                        job_download_limit: asyncio.Semaphore, profile_name: str):
+    """
+    Отправляет трек отдельным сообщением. Если Telegram отклонил сохраненный file_id,
+    удаляет его из индекса, скачивает трек заново и повторяет отправку.
+
+    Returns:
+        Message: Отправленное сообщение или None, если трек отправить не удалось
+    """
+    try:
+        return await _send_one(job, track, reply_to)
+    except Exception as e:
+        if not (track.file_id and isinstance(e, TelegramBadRequest) and is_stale_file_id_error(e)):
+            logger.error(f"Пакет '{job.title}': не удалось отправить {track.video_id}: {e}")
+            return None
+        logger.warning(f"Пакет '{job.title}': Telegram отклонил сохраненный file_id для {track.video_id}: {e}. Скачиваем заново.")
+        await delete_audio_file_id(track.video_id)
+
+    track.file_id = None
+    try:
+        await _download_track(track, flights, job_download_limit, profile_name)
+        return await _send_one(job, track, reply_to)
+    except Exception as e:
+        logger.error(f"Пакет '{job.title}': не удалось заново скачать и отправить {track.video_id}: {e}")
+        return None
+
+async def _send_group(job: BulkJob, prepared: list, quota, flights: SingleFlight,
+                      job_download_limit: asyncio.Semaphore, profile_name: str):
+    """
+    Отправляет пачку треков одной медиагруппой и сохраняет file_id загруженных файлов.
+    Если группа не отправилась, треки отправляются по одному, чтобы ошибка одного
+    трека (устаревший file_id, слишком большой файл) не отменяла остальные.
+    """
+    is_group = job.message.chat.type != "private"
+    reply_to = job.message.message_id if is_group else None
+    messages = None
+    # Медиагруппа должна содержать от 2 до 10 элементов
+    if len(prepared) > 1:
+        try:
+            messages = await job.message.bot.send_media_group(
+                chat_id=job.message.chat.id,
+                media=[track.as_media() for track in prepared],
+                reply_to_message_id=reply_to,
+            )
+        except Exception as e:
+            logger.warning(f"Пакет '{job.title}': не удалось отправить медиагруппу, отправляем треки по одному: {e}")
+    if messages is None:
+        messages = [
+            await _resend_track(job, track, reply_to, flights, job_download_limit, profile_name)
+            for track in prepared
+        ]
+
+    for track, sent_message in zip(prepared, messages):
+        if sent_message is None:
+            quota.release(job.user_id)
+            job.failed += 1
+            continue
+        job.sent += 1
+        if track.file_path and sent_message.audio:
+            await save_audio_file_id(track.video_id, sent_message.audio.file_id, track.download_title or track.title, track.profile)
+
+async def run_bulk_job(job: BulkJob, flights: SingleFlight, profile_name: str = AUDIO_PROFILE, quota=quota_cache) -> int:
+    """
+    Выполняет групповое задание конвейером: поиск на YouTube и скачивание идут
+    параллельно с ограничениями BULK_RESOLVE_CONCURRENCY и BULK_DOWNLOAD_CONCURRENCY
+    (скачивания также занимают общий download_limit процесса), а готовые треки отправляются медиагруппами по порядку, пока следующие еще скачиваются.
+    Лимит списывается за каждый трек отдельно и возвращается за неотправленные;
+    quota - QuotaCache или PrepaidQuota (лимит, зарезервированный заранее процессом бота).
+
+    Returns:
+        int: Количество отправленных треков
+    """
+    resolve_limit = asyncio.Semaphore(BULK_RESOLVE_CONCURRENCY)
+    job_download_limit = asyncio.Semaphore(BULK_DOWNLOAD_CONCURRENCY)
+    tasks = [
+        asyncio.create_task(_prepare_track(job, track, flights, resolve_limit, job_download_limit, profile_name, quota))
+        for track in job.tracks
+    ]
+    logger.info(f"Пакет '{job.title}' для user_id={job.user_id}: {len(tasks)} треков")
+    await job.report_progress(force=True)
+
+    sent_until = 0
+    try:
+        for start in range(0, len(tasks), BULK_MEDIA_GROUP_SIZE):
+            chunk = tasks[start:start + BULK_MEDIA_GROUP_SIZE]
+            prepared = [track for track in await asyncio.gather(*chunk) if track]
+            try:
+                if prepared:
+                    await _send_group(job, prepared, quota, flights, job_download_limit, profile_name)
+            finally:
+                for track in prepared:
+                    if track.file_path:
+                        audio_cache.release(track.file_path)
+                sent_until = start + len(chunk)
+            await job.report_progress(force=True)
+    finally:
+        # При отмене задания освобождаем то, что успели подготовить, но не отправили
+        for task in tasks[sent_until:]:
+            if not task.done():
+                task.cancel()
+        for task in tasks[sent_until:]:
+            try:
+                track = await task
+            except (asyncio.CancelledError, Exception):
+                continue
+            if track:
+                quota.release(job.user_id)
+                if track.file_path:
+                    audio_cache.release(track.file_path)
+
+    logger.info(f"Пакет '{job.title}' завершен: отправлено {job.sent}, ошибок {job.failed}, пропущено по лимиту {job.limited}")
+    return job.sent
@@ -12,12 +12,103 @@ GENIUS_ACCESS_TOKEN = os.getenv("GENIUS_ACCESS_TOKEN")
 DOWNLOADS_DIR = "downloads"
 os.makedirs(DOWNLOADS_DIR, exist_ok=True)
 
+# Дисковый кэш скачанных треков (хранится в папке загрузок)
+AUDIO_CACHE_DIR = DOWNLOADS_DIR
+# Максимальный объем кэша (2 ГБ). Лимит действует на процесс: бот и каждый процесс worker.py
+# ведут свой кэш в отдельной папке, поэтому на диске может занимать до (1 + число worker.py) x лимит
+AUDIO_CACHE_MAX_BYTES = 2 * 1024 * 1024 * 1024
+
+# Профиль выдачи аудио по умолчанию (см. AUDIO_PROFILES в utils.py):
+# "m4a" - исходная дорожка без перекодирования, "mp3-192" - MP3 192 кбит/с,
+# "mp3-fast" - MP3 с быстрым кодированием, "mp3-fit" - MP3 с битрейтом под лимит Telegram
+AUDIO_PROFILE = "m4a"
+TELEGRAM_MAX_AUDIO_BYTES = 50 * 1024 * 1024  # Лимит Telegram на отправку файлов ботом
+
 # Настройки пагинации
 RESULTS_PER_PAGE = 5
 
+# Общий кэш результатов поиска
+SEARCH_CACHE_TTL = 1800  # Время жизни результатов (30 минут)
+SEARCH_CACHE_SIZE = 5000  # Максимальное количество запросов в памяти
+SEARCH_CACHE_PERSISTENT = True  # Дублировать кэш в БД, чтобы он сохранялся после перезапуска
+SEARCH_HEDGE_DELAY = 1.5  # Через сколько секунд без ответа основного поиска запускать запасные стратегии
+
+# Инлайн-режим
+INLINE_RESULTS = 5  # Сколько результатов показывать
+INLINE_FETCH_LIMIT = 20  # Сколько результатов запрашивать и кэшировать, чтобы уточнения запроса находились среди них
+INLINE_DEBOUNCE = 0.35  # Пауза перед поиском: запросы, набранные быстрее, отменяются следующим символом
+
+# Кэш метаданных видео для прямых ссылок
+VIDEO_INFO_CACHE_TTL = 6 * 3600  # Время жизни метаданных (6 часов)
+VIDEO_INFO_CACHE_SIZE = 10000  # Максимальное количество видео в памяти
+
+# Кэш треков Spotify (track_id -> "артисты - название")
+SPOTIFY_CACHE_TTL = 24 * 3600  # Время жизни (сутки)
+SPOTIFY_CACHE_SIZE = 20000  # Максимальное количество треков в памяти
+
+# Кэш текстов песен
+LYRICS_CACHE_TTL = 30 * 24 * 3600  # Найденные тексты хранятся 30 дней
+LYRICS_NEGATIVE_TTL = 24 * 3600  # Повторный поиск ненайденного текста - не раньше чем через сутки
+LYRICS_PREFETCH = True  # Искать текст в фоне сразу после отправки трека, до нажатия кнопки
+LYRICS_PREFETCH_WORKERS = 1  # Сколько текстов ищется в фоне одновременно
+LYRICS_PREFETCH_QUEUE_SIZE = 200  # Максимальная длина очереди фонового поиска
+LYRICS_PREFETCH_MAX_AGE = 180  # Фоновый поиск бесполезен после истечения кнопки (3 минуты)
+LYRICS_PREFETCH_BUSY_QUEUE = 5  # Фоновый поиск ждет, пока в очереди скачивания столько треков или больше
+
+# Пакетный режим (плейлисты и альбомы Spotify, плейлисты YouTube)
+BULK_MAX_TRACKS = 50  # Максимальное количество треков из одной ссылки
+BULK_RESOLVE_CONCURRENCY = 4  # Сколько треков одновременно ищется на YouTube
+BULK_DOWNLOAD_CONCURRENCY = 2  # Сколько треков одной пачки скачивается одновременно (в пределах общего PIPELINE_DOWNLOAD_CONCURRENCY)
+BULK_MEDIA_GROUP_SIZE = 10  # Треков в одной медиагруппе (ограничение Telegram - 10)
+
 # Дневной лимит скачиваний на пользователя
 DOWNLOAD_LIMIT_PER_DAY = 5
+# Как часто (в секундах) счетчики скачиваний из памяти записываются в БД.
+# Счетчики ведет только процесс бота; второй процесс бота с той же БД нарушит дневной лимит
+QUOTA_FLUSH_INTERVAL = 5
 
 # Настройки очереди скачивания
 MAX_QUEUE_SIZE = 100  # Максимальное количество треков в очереди (0 - безлимитно)
-DOWNLOAD_WORKERS = 1   # Количество одновременных скачиваний 
\ No newline at end of file
+QUEUE_MAX_PER_USER = 5  # Сколько заданий один пользователь может держать в очереди (0 - без ограничения)
+QUEUE_MAX_WAIT = 900  # Не принимать задание, если ожидание превысит столько секунд (0 - без ограничения)
+
+# Хранилище очереди: "memory" - в памяти процесса бота, "sqlite" - в файле JOB_QUEUE_PATH,
+# общем для бота и отдельных процессов скачивания (python worker.py)
+JOB_QUEUE_BACKEND = "memory"
+JOB_QUEUE_PATH = "jobs.db"
+JOB_LEASE_SECONDS = 120  # Задание без heartbeat дольше этого времени выдается другому воркеру
+JOB_HEARTBEAT_INTERVAL = 30  # Как часто воркер продлевает аренду задания
+JOB_MAX_ATTEMPTS = 3  # Попыток выполнения, после чего задание помечается failed
+JOB_RETRY_DELAY = 10  # Задержка перед повтором в секундах, удваивается с каждой попыткой
+JOB_POLL_INTERVAL = 1.0  # Пауза воркера, когда очередь пуста
+JOB_MAINTAIN_INTERVAL = 5  # Как часто бот возвращает неиспользованный лимит и обновляет счетчики очереди
+JOB_RETENTION = 24 * 3600  # Сколько хранятся завершенные задания
+
+# Движок скачивания: "process" - пул дочерних процессов, "thread" - потоки внутри процесса бота
+DOWNLOAD_BACKEND = "process"
+DOWNLOAD_PROCESSES = os.cpu_count() or 1  # Размер пула процессов (по умолчанию - число ядер)
+DOWNLOAD_PROCESS_MAX_TASKS = 50  # Процесс перезапускается после указанного числа скачиваний (0 - никогда)
+DOWNLOAD_WORKERS = DOWNLOAD_PROCESSES   # Количество одновременных скачиваний 
+
+# Автомасштабирование воркеров скачивания (AIMD): DOWNLOAD_WORKERS - начальное число воркеров
+AUTOSCALE_WORKERS = True  # False - всегда DOWNLOAD_WORKERS воркеров
+AUTOSCALE_MIN_WORKERS = 1
+AUTOSCALE_MAX_WORKERS = DOWNLOAD_PROCESSES * 2  # Сверх пула процессов воркеры заняты отправкой в Telegram
+AUTOSCALE_INTERVAL = 15  # Как часто (в секундах) пересматривается число воркеров
+AUTOSCALE_WINDOW = 120  # За сколько последних секунд учитывается статистика скачиваний
+AUTOSCALE_MIN_SAMPLES = 5  # Меньше скачиваний за окно - доли ошибок и задержка не учитываются
+AUTOSCALE_ERROR_RATE = 0.3  # Доля сетевых ошибок (таймауты, обрывы, HTTP 5xx), при которой число воркеров уменьшается
+AUTOSCALE_THROTTLE_RATE = 0.05  # Доля ответов 429 / "подтвердите, что вы не бот", при которой число воркеров уменьшается
+AUTOSCALE_CPU_LOAD = 0.9  # Загрузка CPU (load average на ядро), при которой число воркеров уменьшается
+AUTOSCALE_LATENCY_FACTOR = 2.0  # Во сколько раз медиана скачивания должна превысить обычную, чтобы уменьшить число воркеров
+AUTOSCALE_DECREASE_FACTOR = 0.5  # Множитель числа воркеров при перегрузке
+AUTOSCALE_DOWNLOAD_UTILISATION = 0.85  # Воркеры добавляются, только пока слоты скачивания заняты меньше этой доли времени
+
+# Конвейер трека: поиск file_id -> скачивание с перекодированием -> отправка в Telegram.
+# Воркер передает трек в конвейер и сразу берет следующий, отправка одного трека идет параллельно со скачиванием другого
+TRACK_PIPELINE = True  # False - каждый воркер выполняет стадии трека по очереди
+PIPELINE_RESOLVE_CONCURRENCY = 4  # Одновременных проверок file_id
+PIPELINE_DOWNLOAD_CONCURRENCY = DOWNLOAD_PROCESSES  # Одновременных скачиваний с YouTube в процессе, включая повторные при устаревшем file_id и пакеты (не больше пула процессов)
+PIPELINE_UPLOAD_CONCURRENCY = 4  # Одновременных отправок в Telegram
+PIPELINE_QUEUE_SIZE = 10  # Максимум треков, ожидающих каждой стадии
+PIPELINE_STATS_INTERVAL = 300  # Как часто глубина очередей стадий пишется в лог (0 - только при остановке)
@@ -1,3 +1,4 @@
+import time
 import aiosqlite
 import logging
 from datetime import datetime, timedelta
@@ -6,64 +7,229 @@ DATABASE_PATH = 'user_data.db'
 
 logger = logging.getLogger(__name__)
 
+# Долгоживущее соединение с БД, открывается в init_db() и закрывается в close_db()
+_db = None
+
+async def get_db() -> aiosqlite.Connection:
+    """Возвращает общее соединение с БД, открывая его при первом обращении."""
+    global _db
+    if _db is None:
+        # Кэш подготовленных запросов sqlite3: одни и те же запросы не компилируются повторно
+        db = await aiosqlite.connect(DATABASE_PATH, cached_statements=256)
+        # WAL позволяет читать во время записи, а synchronous=NORMAL не ждет fsync на каждый commit
+        await db.execute("PRAGMA journal_mode=WAL")
+        await db.execute("PRAGMA synchronous=NORMAL")
+        await db.execute("PRAGMA busy_timeout=5000")
+        _db = db
+        logger.info("Соединение с БД открыто.")
+    return _db
+
+async def close_db():
+    """Закрывает общее соединение с БД."""
+    global _db
+    if _db is not None:
+        db, _db = _db, None
+        try:
+            await db.close()
+            logger.info("Соединение с БД закрыто.")
+        except Exception as e:
+            logger.error(f"Ошибка при закрытии соединения с БД: {e}")
+
 async def init_db():
-    """Инициализирует базу данных и создает таблицу, если она не существует."""
+    """Открывает соединение с базой данных и создает таблицы, если они не существуют."""
     try:
-        async with aiosqlite.connect(DATABASE_PATH) as db:
-            await db.execute('''
-                CREATE TABLE IF NOT EXISTS user_limits (
-                    user_id INTEGER PRIMARY KEY,
-                    downloads_today INTEGER DEFAULT 0,
-                    last_download_date TEXT
-                )
-            ''')
-            await db.commit()
+        db = await get_db()
+        await db.execute('''
+            CREATE TABLE IF NOT EXISTS user_limits (
+                user_id INTEGER PRIMARY KEY,
+                downloads_today INTEGER DEFAULT 0,
+                last_download_date TEXT
+            )
+        ''')
+        # Индекс уже загруженных в Telegram треков: video_id -> file_id
+        await db.execute('''
+            CREATE TABLE IF NOT EXISTS audio_file_ids (
+                video_id TEXT PRIMARY KEY,
+                file_id TEXT NOT NULL,
+                title TEXT,
+                profile TEXT,
+                created_at TEXT
+            )
+        ''')
+        # Базы, созданные до появления профилей выдачи, не содержат колонку profile
+        async with db.execute("PRAGMA table_info(audio_file_ids)") as cursor:
+            columns = [row[1] for row in await cursor.fetchall()]
+        if 'profile' not in columns:
+            await db.execute("ALTER TABLE audio_file_ids ADD COLUMN profile TEXT")
+        # Второй уровень общего кэша результатов поиска
+        await db.execute('''
+            CREATE TABLE IF NOT EXISTS search_cache (
+                query TEXT PRIMARY KEY,
+                results TEXT NOT NULL,
+                result_limit INTEGER NOT NULL,
+                created_at REAL NOT NULL
+            )
+        ''')
+        # Кэш текстов песен, включая отрицательные результаты (found = 0)
+        await db.execute('''
+            CREATE TABLE IF NOT EXISTS lyrics_cache (
+                song_key TEXT PRIMARY KEY,
+                result TEXT NOT NULL,
+                found INTEGER NOT NULL,
+                created_at REAL NOT NULL
+            )
+        ''')
+        await db.commit()
         logger.info("База данных успешно инициализирована.")
     except Exception as e:
         logger.error(f"Ошибка при инициализации БД: {e}")
 
-async def get_user_downloads(user_id: int):
-    """Получает количество скачиваний пользователя за сегодня и дату последнего сброса."""
+async def load_user_downloads(user_id: int):
+    """Возвращает (downloads_today, last_download_date) пользователя без сброса по дате или None."""
     try:
-        async with aiosqlite.connect(DATABASE_PATH) as db:
-            async with db.execute("SELECT downloads_today, last_download_date FROM user_limits WHERE user_id = ?", (user_id,)) as cursor:
-                row = await cursor.fetchone()
-                if row:
-                    downloads_today, last_download_str = row
-                    if last_download_str:
-                        last_download_date = datetime.strptime(last_download_str, '%Y-%m-%d').date()
-                        if last_download_date < datetime.now().date():
-                            await db.execute("UPDATE user_limits SET downloads_today = 0, last_download_date = ? WHERE user_id = ?", (datetime.now().strftime('%Y-%m-%d'), user_id))
-                            await db.commit()
-                            return 0
-                    return downloads_today
-                else:
-                    await db.execute("INSERT INTO user_limits (user_id, downloads_today, last_download_date) VALUES (?, 0, ?)", (user_id, datetime.now().strftime('%Y-%m-%d')))
-                    await db.commit()
-                    return 0
+        db = await get_db()
+        async with db.execute("SELECT downloads_today, last_download_date FROM user_limits WHERE user_id = ?", (user_id,)) as cursor:
+            row = await cursor.fetchone()
+            return (row[0], row[1]) if row else None
     except Exception as e:
         logger.error(f"Ошибка при получении данных пользователя {user_id} из БД: {e}")
+        raise
+
+async def save_user_downloads_batch(rows):
+    """Записывает счетчики скачиваний одной транзакцией. rows - список (user_id, downloads_today, last_download_date)."""
+    db = await get_db()
+    await db.executemany('''
+        INSERT INTO user_limits (user_id, downloads_today, last_download_date) VALUES (?, ?, ?)
+        ON CONFLICT(user_id) DO UPDATE SET
+            downloads_today = excluded.downloads_today,
+            last_download_date = excluded.last_download_date
+    ''', rows)
+    await db.commit()
+
+async def get_audio_file_id(video_id: str, profiles):
+    """
+    Возвращает (file_id, title) ранее загруженного в Telegram трека или None.
+    Подходит только файл, полученный одним из профилей выдачи profiles; записи,
+    сделанные до появления профилей, получены в MP3 192 кбит/с (профиль mp3-192).
+    """
+    try:
+        db = await get_db()
+        profiles = tuple(profiles)
+        placeholders = ", ".join("?" * len(profiles))
+        async with db.execute(
+            f"SELECT file_id, title FROM audio_file_ids WHERE video_id = ? AND COALESCE(profile, 'mp3-192') IN ({placeholders})",
+            (video_id, *profiles)
+        ) as cursor:
+            row = await cursor.fetchone()
+            return (row[0], row[1]) if row else None
+    except Exception as e:
+        logger.error(f"Ошибка при получении file_id для видео {video_id}: {e}")
         return None
 
-async def increment_user_downloads(user_id: int):
-    """Увеличивает счетчик скачиваний пользователя."""
+async def save_audio_file_id(video_id: str, file_id: str, title: str, profile: str = None):
+    """Сохраняет file_id загруженного в Telegram трека и профиль выдачи, которым получен файл."""
     try:
-        async with aiosqlite.connect(DATABASE_PATH) as db:
-            current_downloads = await get_user_downloads(user_id)
-            if current_downloads is None:
-                return False
-
-            await db.execute("UPDATE user_limits SET downloads_today = downloads_today + 1, last_download_date = ? WHERE user_id = ?", (datetime.now().strftime('%Y-%m-%d'), user_id))
-            await db.commit()
-            logger.info(f"Счетчик скачиваний для пользователя {user_id} увеличен.")
-            return True
+        db = await get_db()
+        await db.execute(
+            "INSERT OR REPLACE INTO audio_file_ids (video_id, file_id, title, profile, created_at) VALUES (?, ?, ?, ?, ?)",
+            (video_id, file_id, title, profile, datetime.now().strftime('%Y-%m-%d %H:%M:%S'))
+        )
+        await db.commit()
+        logger.info(f"file_id для видео {video_id} сохранен.")
+        return True
     except Exception as e:
-        logger.error(f"Ошибка при увеличении счетчика для пользователя {user_id}: {e}")
+        logger.error(f"Ошибка при сохранении file_id для видео {video_id}: {e}")
         return False
 
-async def can_user_download(user_id: int, limit: int = 5) -> bool:
-    """Проверяет, может ли пользователь скачать еще один трек."""
-    downloads_today = await get_user_downloads(user_id)
-    if downloads_today is None:
+async def delete_audio_file_id(video_id: str):
+    """Удаляет устаревший file_id (например, если Telegram его больше не принимает)."""
+    try:
+        db = await get_db()
+        await db.execute("DELETE FROM audio_file_ids WHERE video_id = ?", (video_id,))
+        await db.commit()
+        logger.info(f"file_id для видео {video_id} удален из индекса.")
+        return True
+    except Exception as e:
+        logger.error(f"Ошибка при удалении file_id для видео {video_id}: {e}")
         return False
-    return downloads_today < limit
\ No newline at end of file
+
+async def load_cached_search(query: str, max_age: float):
+    """Возвращает (results_json, result_limit) для нормализованного запроса, если запись не старше max_age секунд."""
+    try:
+        db = await get_db()
+        async with db.execute(
+            "SELECT results, result_limit FROM search_cache WHERE query = ? AND created_at >= ?",
+            (query, time.time() - max_age)
+        ) as cursor:
+            row = await cursor.fetchone()
+            return (row[0], row[1]) if row else None
+    except Exception as e:
+        logger.error(f"Ошибка при чтении кэша поиска для '{query}': {e}")
+        return None
+
+async def save_cached_search(query: str, results_json: str, result_limit: int):
+    """Сохраняет результаты поиска для нормализованного запроса."""
+    try:
+        db = await get_db()
+        await db.execute(
+            "INSERT OR REPLACE INTO search_cache (query, results, result_limit, created_at) VALUES (?, ?, ?, ?)",
+            (query, results_json, result_limit, time.time())
+        )
+        await db.commit()
+    except Exception as e:
+        logger.error(f"Ошибка при сохранении кэша поиска для '{query}': {e}")
+
+async def purge_cached_searches(max_age: float):
+    """Удаляет записи кэша поиска старше max_age секунд."""
+    try:
+        db = await get_db()
+        cursor = await db.execute("DELETE FROM search_cache WHERE created_at < ?", (time.time() - max_age,))
+        deleted = cursor.rowcount
+        await cursor.close()
+        await db.commit()
+        logger.info(f"Из кэша поиска удалено устаревших записей: {deleted}")
+    except Exception as e:
+        logger.error(f"Ошибка при очистке кэша поиска: {e}")
+
+async def load_cached_lyrics(song_key: str, found_ttl: float, missing_ttl: float):
+    """Возвращает result_json для песни, если запись не устарела (для ненайденных текстов действует missing_ttl)."""
+    try:
+        db = await get_db()
+        now = time.time()
+        async with db.execute(
+            "SELECT result FROM lyrics_cache WHERE song_key = ? AND created_at >= CASE found WHEN 1 THEN ? ELSE ? END",
+            (song_key, now - found_ttl, now - missing_ttl)
+        ) as cursor:
+            row = await cursor.fetchone()
+            return row[0] if row else None
+    except Exception as e:
+        logger.error(f"Ошибка при чтении кэша текстов для '{song_key}': {e}")
+        return None
+
+async def save_cached_lyrics(song_key: str, result_json: str, found: bool):
+    """Сохраняет результат поиска текста песни."""
+    try:
+        db = await get_db()
+        await db.execute(
+            "INSERT OR REPLACE INTO lyrics_cache (song_key, result, found, created_at) VALUES (?, ?, ?, ?)",
+            (song_key, result_json, int(found), time.time())
+        )
+        await db.commit()
+    except Exception as e:
+        logger.error(f"Ошибка при сохранении кэша текстов для '{song_key}': {e}")
+
+async def purge_cached_lyrics(found_ttl: float, missing_ttl: float):
+    """Удаляет устаревшие записи кэша текстов песен."""
+    try:
+        db = await get_db()
+        now = time.time()
+        cursor = await db.execute(
+            "DELETE FROM lyrics_cache WHERE created_at < CASE found WHEN 1 THEN ? ELSE ? END",
+            (now - found_ttl, now - missing_ttl)
+        )
+        deleted = cursor.rowcount
+        await cursor.close()
+        await db.commit()
+        logger.info(f"Из кэша текстов песен удалено устаревших записей: {deleted}")
+    except Exception as e:
+        logger.error(f"Ошибка при очистке кэша текстов песен: {e}")
@@ -0,0 +1,226 @@
+import time
+import asyncio
+import logging
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from collections import deque
+from concurrent.futures.process import BrokenProcessPool
+
+from audio_cache import audio_cache
+from config import DOWNLOAD_BACKEND, DOWNLOAD_PROCESSES, DOWNLOAD_PROCESS_MAX_TASKS, AUDIO_PROFILE, PIPELINE_DOWNLOAD_CONCURRENCY
+from utils import FIT_PROFILE, DownloadError, extract_video_id, fetch_audio
+
+logger = logging.getLogger(__name__)
+
+def _init_worker_process():
+    """Настраивает логирование в дочернем процессе скачивания"""
+    logging.basicConfig(
+        level=logging.INFO,
+        format="%(asctime)s - %(levelname)s - %(processName)s - %(name)s - %(message)s",
+    )
+
+class ThreadBackend:
+    """Выполняет скачивание в потоках внутри процесса бота"""
+
+    name = "thread"
+    capacity = None # Потоков столько, сколько задач: занятость слотов не ограничивает воркеры
+
+    async def run(self, func, *args):
+        return await asyncio.to_thread(func, *args)
+
+    def shutdown(self):
+        pass
+
+class ProcessBackend:
+    """
+    Выполняет скачивание в пуле дочерних процессов, чтобы yt-dlp и ffmpeg
+    не конкурировали с циклом событий бота за GIL.
+
+    Пул целиком заменяется новым после max_tasks_per_child задач на процесс
+    (в среднем), а при падении дочернего процесса пул пересоздается и задача
+    повторяется один раз.
+    """
+
+    name = "process"
+
+    def __init__(self, size: int, max_tasks_per_child: int):
+        self.size = size
+        self.capacity = size
+        self.max_tasks_per_child = max_tasks_per_child
+        self._executor = None
+        self._executor_jobs = 0
+
+    def _get_executor(self):
+        # Штатный max_tasks_per_child в Python 3.11 может зависнуть при замене процесса,
+        # поэтому обновляем пул сами: старый дорабатывает свои задачи и завершается
+        if self._executor is not None and self.max_tasks_per_child and self._executor_jobs >= self.size * self.max_tasks_per_child:
+            logger.info(f"Пул процессов скачивания выполнил {self._executor_jobs} задач, запускаем новый")
+            self._executor.shutdown(wait=False)
+            self._executor = None
+        if self._executor is None:
+            self._executor = ProcessPoolExecutor(
+                max_workers=self.size,
+                mp_context=multiprocessing.get_context("spawn"),
+                initializer=_init_worker_process,
+            )
+            self._executor_jobs = 0
+            logger.info(f"Запущен пул процессов скачивания: {self.size} процессов")
+        self._executor_jobs += 1
+        return self._executor
+
+    def _reset_executor(self, broken_executor):
+        # Несколько задач могут обнаружить сломанный пул одновременно, пересоздаем его один раз
+        if self._executor is broken_executor:
+            broken_executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+    async def run(self, func, *args):
+        loop = asyncio.get_running_loop()
+        for attempt in (1, 2):
+            executor = self._get_executor()
+            try:
+                return await loop.run_in_executor(executor, func, *args)
+            except BrokenProcessPool as e:
+                logger.error(f"Процесс скачивания аварийно завершился (попытка {attempt}): {e}")
+                self._reset_executor(executor)
+        raise DownloadError("Процесс скачивания аварийно завершился")
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+# Признаки того, что YouTube ограничивает частоту запросов
+THROTTLE_MARKERS = ("429", "too many requests", "sign in to confirm")
+# Временные сетевые ошибки и ошибки HTTP: признак перегрузки сети, в отличие от
+# приватных, удаленных и недоступных в регионе видео
+TRANSIENT_MARKERS = (
+    "timed out", "timeout", "connection", "temporary failure", "network is unreachable",
+    "name or service not known", "remote end closed", "incomplete read", "unable to download webpage",
+    "http error 403", "http error 5", "ssl",
+)
+
+class DownloadStats:
+    """
+    Исходы и длительность скачиваний (без попаданий в кэш) за последние max_age секунд
+    и суммарное время, в течение которого слоты движка были заняты. Используется
+    автомасштабированием воркеров.
+    """
+
+    def __init__(self, max_age: float = 600):
+        self.max_age = max_age
+        self._samples = deque() # (время завершения, длительность, 'ok' | 'throttled' | 'transient' | 'error')
+        self.active = 0
+        self._busy_seconds = 0.0
+        self._busy_since = time.monotonic()
+
+    def _advance(self):
+        now = time.monotonic()
+        self._busy_seconds += self.active * (now - self._busy_since)
+        self._busy_since = now
+
+    def begin(self):
+        self._advance()
+        self.active += 1
+
+    def end(self):
+        self._advance()
+        self.active -= 1
+
+    def busy_seconds(self) -> float:
+        """Сумма длительностей всех скачиваний с момента запуска, включая выполняющиеся"""
+        self._advance()
+        return self._busy_seconds
+
+    def record(self, duration: float, outcome: str):
+        now = time.monotonic()
+        self._samples.append((now, duration, outcome))
+        while self._samples and now - self._samples[0][0] > self.max_age:
+            self._samples.popleft()
+
+    @staticmethod
+    def classify(error: Exception) -> str:
+        text = str(error).lower()
+        if any(marker in text for marker in THROTTLE_MARKERS):
+            return 'throttled'
+        if any(marker in text for marker in TRANSIENT_MARKERS):
+            return 'transient'
+        return 'error'
+
+    def snapshot(self, window: float) -> dict:
+        """
+        Доли троттлинга, временных сетевых ошибок и остальных ошибок (недоступные видео)
+        и медианная длительность успешных скачиваний за window секунд
+        """
+        since = time.monotonic() - window
+        samples = [sample for sample in self._samples if sample[0] >= since]
+        durations = sorted(duration for _, duration, outcome in samples if outcome == 'ok')
+        total = len(samples)
+        return {
+            'count': total,
+            'error_rate': sum(1 for sample in samples if sample[2] == 'error') / total if total else 0.0,
+            'transient_rate': sum(1 for sample in samples if sample[2] == 'transient') / total if total else 0.0,
+            'throttle_rate': sum(1 for sample in samples if sample[2] == 'throttled') / total if total else 0.0,
+            'median_seconds': durations[len(durations) // 2] if durations else None,
+        }
+
+download_stats = DownloadStats()
+
+def create_backend(kind: str):
+    if kind == "process":
+        return ProcessBackend(DOWNLOAD_PROCESSES, DOWNLOAD_PROCESS_MAX_TASKS)
+    if kind != "thread":
+        logger.warning(f"Неизвестный движок скачивания '{kind}', используются потоки")
+    return ThreadBackend()
+
+backend = create_backend(DOWNLOAD_BACKEND)
+
+# Общий предел одновременных скачиваний с YouTube в процессе: его берут стадия download
+# конвейера, повторное скачивание при устаревшем file_id и треки пакетных заданий
+download_limit = asyncio.Semaphore(PIPELINE_DOWNLOAD_CONCURRENCY)
+
+async def download_audio(video_url: str, profile_name: str = AUDIO_PROFILE):
+    """
+    Возвращает трек из дискового кэша или скачивает его через выбранный движок.
+
+    Args:
+        profile_name: Профиль выдачи из utils.AUDIO_PROFILES
+
+    Returns:
+        tuple: (путь к файлу в кэше, название трека, профиль, которым получен файл).
+        После отправки файл нужно освободить через audio_cache.release(путь)
+
+    Raises:
+        DownloadError: если произошла ошибка при скачивании
+    """
+    video_id = extract_video_id(video_url)
+    if video_id:
+        # Если трек не укладывался в лимит Telegram в запрошенном профиле, он лежит в кэше как FIT_PROFILE
+        for candidate in dict.fromkeys((profile_name, FIT_PROFILE)):
+            cached = audio_cache.get(video_id, candidate)
+            if cached:
+                logger.info(f"Аудио {video_id} ({candidate}) взято из кэша: {cached[0]}")
+                return cached[0], cached[1], candidate
+
+    started = time.monotonic()
+    download_stats.begin()
+    try:
+        downloaded_file, video_id, title, used_profile = await backend.run(fetch_audio, video_url, profile_name, audio_cache.tmp_dir)
+    except Exception as e:
+        download_stats.record(time.monotonic() - started, DownloadStats.classify(e))
+        raise
+    finally:
+        download_stats.end()
+    download_stats.record(time.monotonic() - started, 'ok')
+    # Рабочая папка лежит внутри кэша, поэтому перенос - это переименование без копирования.
+    # Папку передаем явно: дочерний процесс не видит audio_cache.use_directory() родителя
+    output_file = audio_cache.publish(video_id, used_profile, downloaded_file, title)
+    return output_file, title, used_profile
+
+async def prefetch_audio(video_url: str, profile_name: str = AUDIO_PROFILE):
+    """Скачивает трек в дисковый кэш, не удерживая закрепление файла"""
+    file_path, _, _ = await download_audio(video_url, profile_name)
+    audio_cache.release(file_path)
+
+def shutdown():
+    backend.shutdown()
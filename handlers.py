@@ -2,7 +2,6 @@ import os
 import asyncio
 import time
 import logging
-import re
 from concurrent.futures import ThreadPoolExecutor
 from aiogram import Router, F, Bot
 from aiogram.types import (
@@ -11,15 +10,26 @@ from aiogram.types import (
     InlineQueryResultAudio, InputMessageContent, InputFile
 )
 from aiogram.filters import Command
+from aiogram.exceptions import TelegramBadRequest
 from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import State, StatesGroup
 from aiogram.utils.keyboard import InlineKeyboardBuilder
 from aiogram.types import InlineKeyboardButton
 
+from audio_cache import audio_cache
+from singleflight import SingleFlight
 from keyboards import get_search_results_keyboard, get_video_id_by_key, get_track_keyboard
-from utils import search_youtube, download_audio, is_youtube_url, is_spotify_url, get_spotify_track_info, is_valid_youtube_id, get_lyrics_for_track
-from config import RESULTS_PER_PAGE, DOWNLOAD_LIMIT_PER_DAY, MAX_QUEUE_SIZE
-from database import can_user_download, increment_user_downloads, get_user_downloads
+from download_engine import download_audio, download_limit, prefetch_audio
+from utils import FIT_PROFILE, is_stale_file_id_error, search_youtube, is_youtube_url, is_spotify_url, get_spotify_track_info, is_valid_youtube_id
+from config import RESULTS_PER_PAGE, DOWNLOAD_LIMIT_PER_DAY, MAX_QUEUE_SIZE, QUEUE_MAX_PER_USER, AUDIO_PROFILE, BULK_MAX_TRACKS, INLINE_DEBOUNCE, INLINE_FETCH_LIMIT, INLINE_RESULTS
+from database import get_audio_file_id, save_audio_file_id, delete_audio_file_id
+from quota import quota_cache
+from search_cache import search_cache
+from scheduler import FairQueue, QueueRejected, format_eta
+from lyrics_cache import lyrics_cache
+from title_parser import parse_title, split_artist_title
+from bulk import BulkJob, is_collection_url, resolve_collection
+from pipeline import TrackJob
 
 # Настройка логирования
 logger = logging.getLogger(__name__)
@@ -32,60 +42,50 @@ class SearchStates(StatesGroup):
 # Словарь для хранения результатов поиска для каждого пользователя
 user_search_results = {}
 
-# Словарь для кэширования результатов поиска
-search_cache = {}
-# Время жизни кэша в секундах (30 минут)
+# Выполняющийся инлайн-поиск каждого пользователя: новый запрос отменяет старый
+inline_searches = {}
+
+# Время жизни результатов поиска пользователя в секундах (30 минут)
 CACHE_TTL = 1800
 
 # Добавляем ThreadPoolExecutor для выполнения тяжелых задач
 thread_pool = ThreadPoolExecutor(max_workers=4)
 
 async def clear_user_cache(user_id, delay=CACHE_TTL):
-    """Очистка кэша пользователя через указанное время"""
+    """Очистка результатов поиска пользователя через указанное время"""
     await asyncio.sleep(delay)
     if user_id in user_search_results:
         del user_search_results[user_id]
-    
-    # Очищаем кэш поиска для пользователя
-    keys_to_delete = []
-    for key in search_cache.keys():
-        if key.startswith(f"{user_id}_"):
-            keys_to_delete.append(key)
-    
-    for key in keys_to_delete:
-        if key in search_cache:
-            del search_cache[key]
 
 @router.message(Command("start"))
-async def cmd_start(message: Message, download_queue: asyncio.Queue, bot_instance: Bot):
+async def cmd_start(message: Message, download_queue: FairQueue, bot_username: str):
     if message.chat.type != "private": return
     command_args = message.text.split()
     if len(command_args) > 1 and command_args[1].startswith("download_"):
         video_id = command_args[1].replace("download_", "")
         user_id = message.from_user.id
         if is_valid_youtube_id(video_id):
-            if not await can_user_download(user_id, DOWNLOAD_LIMIT_PER_DAY):
-                limit_msg = f"⚠️ <b>Лимит исчерпан</b>\nВы достигли дневного лимита скачиваний ({await get_user_downloads(user_id)}/{DOWNLOAD_LIMIT_PER_DAY})."
+            if not await quota_cache.can_download(user_id, DOWNLOAD_LIMIT_PER_DAY):
+                limit_msg = f"⚠️ <b>Лимит исчерпан</b>\nВы достигли дневного лимита скачиваний ({await quota_cache.get_downloads(user_id)}/{DOWNLOAD_LIMIT_PER_DAY})."
                 await message.answer(limit_msg, parse_mode="HTML")
                 return
             try:
                 # Передаем message, а не callback.message, так как это прямой вызов
-                await download_queue.put((message, video_id, user_id))
-                await message.answer(f"▶️ <b>Трек добавлен в очередь</b>\nПозиция: {download_queue.qsize()}\nОжидайте загрузку...", parse_mode="HTML")
-            except asyncio.QueueFull:
-                await message.answer(f"😕 <b>Очередь переполнена</b>\nВ данный момент в очереди максимальное количество треков ({MAX_QUEUE_SIZE}).\nПопробуйте позже.", parse_mode="HTML")
+                position = await enqueue_track(download_queue, (message, video_id, user_id))
+                await message.answer(f"▶️ <b>Трек добавлен в очередь</b>\nПозиция: {position}\nОжидание: {format_eta(download_queue.eta(position))}", parse_mode="HTML")
+            except asyncio.QueueFull as e:
+                await message.answer(f"😕 <b>Трек не добавлен в очередь</b>\n{rejection_text(e)}", parse_mode="HTML")
             return
     
-    bot_info = await bot_instance.get_me()
-    bot_username = bot_info.username
     await message.answer(
         "<b>🎵 SpotifySaver Bot</b>\n\n"
         "Привет! Я помогу тебе скачать музыку из YouTube и Spotify.\n\n"
         "<b>Как использовать:</b>\n"
         "• Отправь мне <b>ссылку</b> YouTube/Spotify\n"
+        "• Плейлисты и альбомы Spotify/YouTube скачиваются целиком\n"
         "• Или просто напиши <b>название трека</b>\n"
         "• Используй инлайн-режим: <code>@" + bot_username + " название трека</code>\n\n"
-        "<b>Я найду и отправлю тебе трек в формате MP3!</b>",
+        "<b>Я найду и отправлю тебе трек в формате M4A или MP3!</b>",
         parse_mode="HTML"
     )
     
@@ -107,12 +107,9 @@ async def cmd_start(message: Message, download_queue: asyncio.Queue, bot_instanc
 
 # Добавляем отдельный обработчик для команды /start в группах
 @router.message(Command("start"), F.chat.type != "private")
-async def cmd_start_group(message: Message, bot_instance: Bot):
+async def cmd_start_group(message: Message, bot_username: str):
     logger.info(f"Команда /start в группе {message.chat.id}")
     
-    bot_info = await bot_instance.get_me()
-    bot_username = bot_info.username
-    
     # Отправляем информацию о боте в группу
     await message.reply(
         f"<b>🎵 SpotifySaver Bot</b>\n\n"
@@ -124,9 +121,79 @@ async def cmd_start_group(message: Message, bot_instance: Bot):
         parse_mode="HTML"
     )
 
+async def is_cached_track(video_id: str) -> bool:
+    """Трек можно отправить без скачивания: он есть в дисковом кэше или уже загружен в Telegram"""
+    if audio_cache.has(video_id, AUDIO_PROFILE) or audio_cache.has(video_id, FIT_PROFILE):
+        return True
+    return await get_audio_file_id(video_id, (AUDIO_PROFILE, FIT_PROFILE)) is not None
+
+def rejection_text(error: asyncio.QueueFull) -> str:
+    """Причина отказа в постановке в очередь для сообщения пользователю"""
+    reason = error.reason if isinstance(error, QueueRejected) else 'full'
+    if reason == 'duplicate':
+        return "Этот трек уже ждет в очереди, он будет отправлен, как только подойдет очередь."
+    if reason == 'user_limit':
+        return f"У вас уже {QUEUE_MAX_PER_USER} заданий в очереди. Дождитесь их выполнения."
+    if reason == 'quota':
+        return f"Дневной лимит скачиваний ({DOWNLOAD_LIMIT_PER_DAY}) исчерпан."
+    if reason == 'overloaded':
+        return f"Сейчас бот сильно загружен: ожидание составило бы {format_eta(error.eta)}. Попробуйте позже."
+    return f"В данный момент в очереди максимальное количество заданий ({MAX_QUEUE_SIZE}). Попробуйте позже."
+
+async def enqueue_track(download_queue: FairQueue, item) -> int:
+    """
+    Ставит трек в очередь (кэшированные - в приоритетную полосу) и возвращает позицию.
+    Никогда не ждет свободного места: при отказе сразу выбрасывает QueueRejected.
+    """
+    _, video_id, _ = item
+    return await download_queue.put(item, priority=await is_cached_track(video_id))
+
+async def enqueue_collection(message: Message, query: str, user_id: int, download_queue: FairQueue):
+    """Получает треки плейлиста или альбома и ставит их в очередь одним групповым заданием"""
+    reply_func = message.reply if message.chat.type != "private" else message.answer
+
+    downloads_today = await quota_cache.get_downloads(user_id)
+    if downloads_today is None or downloads_today >= DOWNLOAD_LIMIT_PER_DAY:
+        await reply_func(f"<b>⚠️ Лимит исчерпан</b>\n\nВы достигли дневного лимита скачиваний ({downloads_today}/{DOWNLOAD_LIMIT_PER_DAY}).", parse_mode="HTML")
+        return
+    remaining = DOWNLOAD_LIMIT_PER_DAY - downloads_today
+    # Отказываем до запроса списка треков, а не после
+    try:
+        await download_queue.check(user_id)
+    except QueueRejected as e:
+        await reply_func(f"<b>😕 Плейлист не добавлен в очередь</b>\n\n{rejection_text(e)}", parse_mode="HTML")
+        return
+
+    progress_msg = await reply_func("<b>⏳ Получаю список треков...</b>", parse_mode="HTML")
+    try:
+        title, tracks = await resolve_collection(query, min(BULK_MAX_TRACKS, remaining))
+    except Exception as e:
+        logger.error(f"Ошибка при получении списка треков {query}: {e}")
+        await progress_msg.edit_text("<b>❌ Ошибка</b>\n\nНе удалось получить список треков по этой ссылке.", parse_mode="HTML")
+        return
+    if not tracks:
+        await progress_msg.edit_text("<b>❌ Ошибка</b>\n\nВ плейлисте не найдено доступных треков.", parse_mode="HTML")
+        return
+
+    job = BulkJob(message, user_id, title, tracks, progress_message=progress_msg)
+    try:
+        position = await download_queue.put(job)
+    except asyncio.QueueFull as e:
+        await progress_msg.edit_text(f"<b>😕 Плейлист не добавлен в очередь</b>\n\n{rejection_text(e)}", parse_mode="HTML")
+        return
+
+    limit_note = f"\n<i>Взято первых {len(tracks)}: больше не позволяет дневной лимит.</i>" if remaining < BULK_MAX_TRACKS and len(tracks) == remaining else ""
+    await progress_msg.edit_text(
+        f"<b>📀 {title}</b>\n\n"
+        f"<b>Треков:</b> {len(tracks)}{limit_note}\n"
+        f"<b>Позиция в очереди:</b> {position}\n"
+        f"<i>Треки будут отправлены альбомами по мере готовности...</i>",
+        parse_mode="HTML"
+    )
+
 # Этот обработчик теперь ТОЛЬКО для личных сообщений
 @router.message(F.text & ~F.text.startswith('/'), F.chat.type == "private")
-async def handle_text_or_link(message: Message, state: FSMContext, download_queue: asyncio.Queue):
+async def handle_text_or_link(message: Message, state: FSMContext, download_queue: FairQueue):
     user_id = message.from_user.id
     query = message.text.strip()
     
@@ -137,16 +204,20 @@ async def handle_text_or_link(message: Message, state: FSMContext, download_queu
     is_direct_download_link = False
     video_id_to_download = None
 
+    if is_collection_url(query):
+        await enqueue_collection(message, query, user_id, download_queue)
+        return
+
     if is_youtube_url(query) or is_spotify_url(query):
-        if not await can_user_download(user_id, DOWNLOAD_LIMIT_PER_DAY):
-            limit_msg = f"<b>⚠️ Лимит исчерпан</b>\n\nВы достигли дневного лимита скачиваний ({await get_user_downloads(user_id)}/{DOWNLOAD_LIMIT_PER_DAY})."
+        if not await quota_cache.can_download(user_id, DOWNLOAD_LIMIT_PER_DAY):
+            limit_msg = f"<b>⚠️ Лимит исчерпан</b>\n\nВы достигли дневного лимита скачиваний ({await quota_cache.get_downloads(user_id)}/{DOWNLOAD_LIMIT_PER_DAY})."
             await reply_func(limit_msg, parse_mode="HTML")
             return
         
         progress_msg = await reply_func("<b>⏳ Обрабатываю ссылку...</b>", parse_mode="HTML")
         try:
             if is_youtube_url(query):
-                results = await asyncio.to_thread(search_youtube, query, 1)
+                results = await search_youtube(query, 1)
                 if results and is_valid_youtube_id(results[0]['id']):
                     video_id_to_download = results[0]['id']
                     is_direct_download_link = True
@@ -170,20 +241,15 @@ async def handle_text_or_link(message: Message, state: FSMContext, download_queu
             if is_direct_download_link and video_id_to_download:
                  await progress_msg.delete()
                  try:
-                    await download_queue.put((message, video_id_to_download, user_id))
+                    position = await enqueue_track(download_queue, (message, video_id_to_download, user_id))
                     await reply_func(
                         f"<b>▶️ Трек добавлен в очередь</b>\n\n"
-                        f"<b>Позиция:</b> {download_queue.qsize()}\n"
-                        f"<i>Ожидайте загрузку...</i>",
-                        parse_mode="HTML"
-                    )
-                 except asyncio.QueueFull:
-                    await reply_func(
-                        f"<b>😕 Очередь переполнена</b>\n\n"
-                        f"В данный момент в очереди максимальное количество треков ({MAX_QUEUE_SIZE}).\n"
-                        f"Попробуйте повторить запрос позже.",
+                        f"<b>Позиция:</b> {position}\n"
+                        f"<b>Ожидание:</b> {format_eta(download_queue.eta(position))}",
                         parse_mode="HTML"
                     )
+                 except asyncio.QueueFull as e:
+                    await reply_func(f"<b>😕 Трек не добавлен в очередь</b>\n\n{rejection_text(e)}", parse_mode="HTML")
                  return
 
         except Exception as e:
@@ -199,16 +265,9 @@ async def handle_text_or_link(message: Message, state: FSMContext, download_queu
     else:
         progress_msg = await reply_func("<b>🔍 Поиск трека...</b>", parse_mode="HTML")
 
-    is_artist_track = bool(re.search(r'^(.+?)\s*[-–]\s*(.+)$', query))
-    cache_key = f"{user_id}_{query}"
-    if cache_key in search_cache and (time.time() - search_cache[cache_key]['timestamp'] < CACHE_TTL):
-        results = search_cache[cache_key]['results']
-        logger.info(f"Результаты для '{query}' взяты из кэша.")
-    else:
-        logger.info(f"Выполняю поиск на YouTube: {query}")
-        results_limit = 5 if is_artist_track else 20
-        results = await asyncio.to_thread(search_youtube, query, results_limit)
-        if results: search_cache[cache_key] = {'results': results, 'timestamp': time.time()}
+    is_artist_track = split_artist_title(query) is not None
+    results_limit = 5 if is_artist_track else 20
+    results = await search_cache.search(query, results_limit)
     
     if not results:
         await progress_msg.edit_text(
@@ -248,7 +307,7 @@ async def handle_pagination(callback: CallbackQuery):
     await callback.answer()
 
 @router.callback_query(F.data.startswith("download_"))
-async def handle_download_callback(callback: CallbackQuery, state: FSMContext, download_queue: asyncio.Queue):
+async def handle_download_callback(callback: CallbackQuery, state: FSMContext, download_queue: FairQueue):
     user_id = callback.from_user.id
     index_key = callback.data.replace("download_", "", 1)
     
@@ -264,22 +323,23 @@ async def handle_download_callback(callback: CallbackQuery, state: FSMContext, d
         )
         return
     
-    if not await can_user_download(user_id, DOWNLOAD_LIMIT_PER_DAY):
-        limit_msg = f"⚠️ Дневной лимит ({await get_user_downloads(user_id)}/{DOWNLOAD_LIMIT_PER_DAY}) исчерпан."
+    if not await quota_cache.can_download(user_id, DOWNLOAD_LIMIT_PER_DAY):
+        limit_msg = f"⚠️ Дневной лимит ({await quota_cache.get_downloads(user_id)}/{DOWNLOAD_LIMIT_PER_DAY}) исчерпан."
         await callback.answer(limit_msg, show_alert=True)
         return
     
     try:
-        await download_queue.put((callback.message, video_id, user_id))
-        await callback.answer(f"▶️ Трек добавлен в очередь (поз. {download_queue.qsize()}). Ожидайте.", show_alert=False)
+        position = await enqueue_track(download_queue, (callback.message, video_id, user_id))
+        eta_text = format_eta(download_queue.eta(position))
+        await callback.answer(f"▶️ Трек добавлен в очередь (поз. {position}, {eta_text}). Ожидайте.", show_alert=False)
         await callback.message.edit_text(
             "<b>🎶 Трек добавлен в очередь</b>\n\n"
-            f"<b>Позиция:</b> {download_queue.qsize()}\n"
-            "<i>Ожидайте загрузку...</i>",
+            f"<b>Позиция:</b> {position}\n"
+            f"<b>Ожидание:</b> {eta_text}",
             parse_mode="HTML"
         )
-    except asyncio.QueueFull:
-        await callback.answer(f"😕 Очередь скачивания переполнена ({MAX_QUEUE_SIZE} треков). Попробуйте позже.", show_alert=True)
+    except asyncio.QueueFull as e:
+        await callback.answer(f"😕 {rejection_text(e)}", show_alert=True)
     except Exception as e:
         logger.error(f"Ошибка при добавлении в очередь скачивания: {e}")
         await callback.answer("❌ Произошла ошибка при добавлении в очередь.", show_alert=True)
@@ -315,6 +375,100 @@ async def handle_back_to_results(callback: CallbackQuery, state: FSMContext):
     await state.set_state(SearchStates.searching)
     await callback.answer()
 
+def resolve_lyrics_target(user_id: int, callback_data: str, message: Message):
+    """
+    Определяет исполнителя и название трека для поиска текста по callback_data кнопки
+    "Текст песни", результатам поиска пользователя и метаданным аудиосообщения.
+
+    Returns:
+        (str, str): Исполнитель и название или None, если в callback_data недостаточно данных
+    """
+    parts = callback_data.split("_", 2)
+    if len(parts) < 3:
+        return None
+    
+    short_track_name_from_callback = parts[1]
+    short_artist_name_from_callback = parts[2]
+    
+    full_track_name = None
+    full_artist_name = None
+
+    if user_id in user_search_results:
+        for result in user_search_results[user_id]:
+            title_from_search = result.get('title', '')
+            uploader_from_search = result.get('uploader', '')
+
+            # Сначала пытаемся распарсить "Исполнитель - Трек" из title_from_search
+            artist_title_split = split_artist_title(title_from_search)
+            if artist_title_split:
+                potential_artist, potential_title = artist_title_split
+                # Сверяем с тем, что пришло из callback, чтобы найти нужный трек
+                if potential_title.lower().startswith(short_track_name_from_callback.lower()):
+                    full_track_name = potential_title
+                    full_artist_name = potential_artist
+                    logger.info(f"Трек найден в user_search_results (распарсен): '{full_track_name}' - '{full_artist_name}'")
+                    break
+            
+            # Если не распарсилось или не подошло, пробуем использовать uploader как исполнителя,
+            # но только если title_from_search совпадает с callback
+            if not full_track_name and title_from_search.lower().startswith(short_track_name_from_callback.lower()):
+                full_track_name = title_from_search
+                full_artist_name = uploader_from_search # Может быть названием канала
+                logger.info(f"Трек найден в user_search_results (title/uploader): '{full_track_name}' - '{full_artist_name}'")
+                break
+    
+    if not full_track_name and message.audio and message.audio.title:
+        full_track_name = message.audio.title
+        logger.info(f"Название трека взято из audio.title: '{full_track_name}'")
+    elif not full_track_name and message.caption:
+        caption_text = message.caption
+        if caption_text.startswith("🎧 "):
+            full_track_name = caption_text[2:].strip()
+            logger.info(f"Название трека взято из caption: '{full_track_name}'")
+    
+    if not full_artist_name and message.audio and message.audio.performer:
+        # audio.performer часто содержит "SpotifySaverBot", его нужно проверять
+        performer_candidate = message.audio.performer
+        if performer_candidate and performer_candidate.lower() != "spotifysaverbot":
+             full_artist_name = performer_candidate
+             logger.info(f"Исполнитель взят из audio.performer: '{full_artist_name}'")
+        else:
+            logger.info(f"audio.performer ('{performer_candidate}') не используется как исполнитель.")
+
+    if not full_track_name:
+        full_track_name = short_track_name_from_callback
+        logger.info(f"Название трека (short) используется: '{full_track_name}'")
+    if not full_artist_name or full_artist_name.lower() == "spotifysaverbot":
+        # Если исполнитель из callback это 'spotifysaverbot' или пустой, не используем его
+        if short_artist_name_from_callback and short_artist_name_from_callback.lower() != "spotifysaverbot":
+            full_artist_name = short_artist_name_from_callback
+            logger.info(f"Исполнитель (short) используется: '{full_artist_name}'")
+        else: # Если и в callback_data плохой исполнитель, оставляем None
+            full_artist_name = None 
+            logger.info(f"Исполнитель (short) из callback ('{short_artist_name_from_callback}') не используется.")
+
+
+    # Финальная попытка извлечь исполнителя из названия трека, если он все еще не определен или некорректен
+    if not full_artist_name or full_artist_name.lower() == "spotifysaverbot":
+        logger.info(f"Исполнитель '{full_artist_name}' некорректен или отсутствует, пытаемся извлечь из трека '{full_track_name}'")
+        artist_from_title = parse_title(full_track_name, min_artist_len=2, max_artist_words=4) # Более мягкое правило
+        if artist_from_title.artist:
+            full_artist_name = artist_from_title.artist
+            full_track_name = artist_from_title.title
+            logger.info(f"Исполнитель извлечен из названия: '{full_artist_name}', трек: '{full_track_name}'")
+        else:
+             logger.info(f"Не удалось извлечь исполнителя из '{full_track_name}'")
+
+
+    if not full_artist_name: # Крайний случай, если исполнителя так и не нашли
+        logger.warning(f"Не удалось определить исполнителя для трека '{full_track_name}'. Запрос на текст может быть неточным.")
+        # Можно установить исполнителя в "Unknown" или оставить None, 
+        # чтобы get_lyrics_for_track попробовал найти без него (если Genius так умеет)
+        # Для большей предсказуемости, лучше передать хоть что-то, даже если это callback data
+        full_artist_name = short_artist_name_from_callback if short_artist_name_from_callback.lower() != "spotifysaverbot" else "Unknown"
+
+    return full_artist_name, full_track_name
+
 @router.callback_query(F.data.startswith("lyrics_"))
 async def handle_lyrics_request(callback: CallbackQuery):
     # Проверка на время жизни сообщения
@@ -332,95 +486,12 @@ async def handle_lyrics_request(callback: CallbackQuery):
         return
 
     try:
-        parts = callback.data.split("_", 2)
-        if len(parts) < 3:
+        user_id = callback.from_user.id
+        target = resolve_lyrics_target(user_id, callback.data, callback.message)
+        if target is None:
             await callback.answer("❌ Недостаточно информации о треке", show_alert=True)
             return
-        
-        short_track_name_from_callback = parts[1]
-        short_artist_name_from_callback = parts[2]
-        
-        full_track_name = None
-        full_artist_name = None
-
-        user_id = callback.from_user.id
-        if user_id in user_search_results:
-            for result in user_search_results[user_id]:
-                title_from_search = result.get('title', '')
-                uploader_from_search = result.get('uploader', '')
-
-                # Сначала пытаемся распарсить "Исполнитель - Трек" из title_from_search
-                artist_title_match_search = re.match(r'^(.+?)\s*[-–—]\s*(.+)$', title_from_search)
-                if artist_title_match_search:
-                    potential_artist = artist_title_match_search.group(1).strip()
-                    potential_title = artist_title_match_search.group(2).strip()
-                    # Сверяем с тем, что пришло из callback, чтобы найти нужный трек
-                    if potential_title.lower().startswith(short_track_name_from_callback.lower()):
-                        full_track_name = potential_title
-                        full_artist_name = potential_artist
-                        logger.info(f"Трек найден в user_search_results (распарсен): '{full_track_name}' - '{full_artist_name}'")
-                        break
-                
-                # Если не распарсилось или не подошло, пробуем использовать uploader как исполнителя,
-                # но только если title_from_search совпадает с callback
-                if not full_track_name and title_from_search.lower().startswith(short_track_name_from_callback.lower()):
-                    full_track_name = title_from_search
-                    full_artist_name = uploader_from_search # Может быть названием канала
-                    logger.info(f"Трек найден в user_search_results (title/uploader): '{full_track_name}' - '{full_artist_name}'")
-                    break
-        
-        if not full_track_name and callback.message.audio and callback.message.audio.title:
-            full_track_name = callback.message.audio.title
-            logger.info(f"Название трека взято из audio.title: '{full_track_name}'")
-        elif not full_track_name and callback.message.caption:
-            caption_text = callback.message.caption
-            if caption_text.startswith("🎧 "):
-                full_track_name = caption_text[2:].strip()
-                logger.info(f"Название трека взято из caption: '{full_track_name}'")
-        
-        if not full_artist_name and callback.message.audio and callback.message.audio.performer:
-            # audio.performer часто содержит "SpotifySaverBot", его нужно проверять
-            performer_candidate = callback.message.audio.performer
-            if performer_candidate and performer_candidate.lower() != "spotifysaverbot":
-                 full_artist_name = performer_candidate
-                 logger.info(f"Исполнитель взят из audio.performer: '{full_artist_name}'")
-            else:
-                logger.info(f"audio.performer ('{performer_candidate}') не используется как исполнитель.")
-
-        if not full_track_name:
-            full_track_name = short_track_name_from_callback
-            logger.info(f"Название трека (short) используется: '{full_track_name}'")
-        if not full_artist_name or full_artist_name.lower() == "spotifysaverbot":
-            # Если исполнитель из callback это 'spotifysaverbot' или пустой, не используем его
-            if short_artist_name_from_callback and short_artist_name_from_callback.lower() != "spotifysaverbot":
-                full_artist_name = short_artist_name_from_callback
-                logger.info(f"Исполнитель (short) используется: '{full_artist_name}'")
-            else: # Если и в callback_data плохой исполнитель, оставляем None
-                full_artist_name = None 
-                logger.info(f"Исполнитель (short) из callback ('{short_artist_name_from_callback}') не используется.")
-
-
-        # Финальная попытка извлечь исполнителя из названия трека, если он все еще не определен или некорректен
-        if not full_artist_name or full_artist_name.lower() == "spotifysaverbot":
-            logger.info(f"Исполнитель '{full_artist_name}' некорректен или отсутствует, пытаемся извлечь из трека '{full_track_name}'")
-            artist_from_title_match = re.match(r'^(.+?)\s*[-–—]\s*(.+)$', full_track_name)
-            if artist_from_title_match:
-                potential_artist = artist_from_title_match.group(1).strip()
-                potential_title = artist_from_title_match.group(2).strip()
-                if len(potential_artist) > 1 and len(potential_artist.split()) < 5: # Более мягкое правило
-                    full_artist_name = potential_artist
-                    full_track_name = potential_title 
-                    logger.info(f"Исполнитель извлечен из названия: '{full_artist_name}', трек: '{full_track_name}'")
-            else:
-                 logger.info(f"Не удалось извлечь исполнителя из '{full_track_name}'")
-
-
-        if not full_artist_name: # Крайний случай, если исполнителя так и не нашли
-            logger.warning(f"Не удалось определить исполнителя для трека '{full_track_name}'. Запрос на текст может быть неточным.")
-            # Можно установить исполнителя в "Unknown" или оставить None, 
-            # чтобы get_lyrics_for_track попробовал найти без него (если Genius так умеет)
-            # Для большей предсказуемости, лучше передать хоть что-то, даже если это callback data
-            full_artist_name = short_artist_name_from_callback if short_artist_name_from_callback.lower() != "spotifysaverbot" else "Unknown"
+        full_artist_name, full_track_name = target
 
         await callback.answer("🔍 Ищем текст песни...", show_alert=False)
         
@@ -431,7 +502,7 @@ async def handle_lyrics_request(callback: CallbackQuery):
             parse_mode="HTML"
         )
         
-        lyrics_data = await asyncio.to_thread(get_lyrics_for_track, full_artist_name, full_track_name)
+        lyrics_data = await lyrics_cache.get(full_artist_name, full_track_name)
         
         await loading_msg.delete()
         
@@ -494,118 +565,196 @@ async def handle_lyrics_request(callback: CallbackQuery):
             parse_mode="HTML"
         )
 
-async def download_and_send_audio(original_message: Message, video_id: str, user_id: int):
-    video_url = f"https://www.youtube.com/watch?v={video_id}"
+DOWNLOAD_PROGRESS_TEXT = (
+    "<b>📥 Скачивание трека</b>\n\n"
+    "⏳ Пожалуйста, подождите...\n"
+    "<i>Это может занять некоторое время в зависимости от размера файла</i>"
+)
+
+async def send_audio_to_chat(original_message: Message, audio, title: str, video_id: str, user_id: int):
+    """
+    Отправляет аудио в чат исходного сообщения с метаданными и клавиатурой трека.
+
+    Args:
+        audio: FSInputFile для новой загрузки или строковый file_id уже загруженного трека
+        title: Полное название трека
+
+    Returns:
+        Message: Отправленное сообщение с аудио
+    """
     is_group = original_message.chat.type != "private"
-    reply_func = original_message.reply if is_group else original_message.answer
     bot_instance = original_message.bot
 
-    progress_msg = await reply_func(
-        "<b>📥 Скачивание трека</b>\n\n"
-        "⏳ Пожалуйста, подождите...\n"
-        "<i>Это может занять некоторое время в зависимости от размера файла</i>",
-        parse_mode="HTML"
-    )
+    # Извлекаем исполнителя из названия, если возможно (для более точного track_info)
+    parsed_artist = "SpotifySaverBot" # Исполнитель по умолчанию
+    parsed_title = title # Название по умолчанию
+    display_title = title # Название для метаданных аудио
+    parsed = parse_title(title)
+    if parsed.artist:
+        # Для кнопки и поиска текста нужен основной исполнитель: с "feat. X" callback_data
+        # обрезается посреди фита и Genius получает искаженное имя. Фиты остаются в названии
+        parsed_artist = parsed.artist
+        parsed_title = parsed.title
+        display_title = f"{parsed.title} (feat. {', '.join(parsed.featured)})" if parsed.featured else parsed.title
+        logger.info(f"Распарсен исполнитель: '{parsed_artist}', трек: '{display_title}' из полного названия: '{title}'")
+    else:
+        logger.info(f"Не удалось надежно распарсить исполнителя из: '{title}'")
+
+    # Получаем информацию о треке для клавиатуры
+    track_info = {
+        'title': parsed_title, # Используем распарсенное название
+        'uploader': parsed_artist, # Используем распарсенного исполнителя
+        'id': video_id
+    }
+    
+    # Создаем клавиатуру с кнопками "Показать текст песни" и "К результатам"
+    # Проверяем, есть ли результаты поиска, чтобы решить, нужна ли кнопка "К результатам"
+    # Это важно, так как original_message может быть результатом прямого скачивания по ссылке,
+    # а не выбором из результатов поиска.
+    has_back_button = bool(user_id in user_search_results and user_search_results[user_id])
+    back_button_markup = get_track_keyboard(track_info, has_back_button=has_back_button)
+
+    # Для caption используем оригинальное полное название, которое скачал yt-dlp
+    caption = f"🎧 {title[:900]}"
+    # Для метаданных аудиофайла используем распарсенные title и artist
+    audio_title_meta = display_title[:64]
+    audio_performer_meta = parsed_artist[:64]
     
+    target_chat_id = original_message.chat.id
+    sent_message = await bot_instance.send_audio(
+        chat_id=target_chat_id,
+        audio=audio, 
+        title=audio_title_meta, 
+        performer=audio_performer_meta,
+        caption=caption, 
+        reply_markup=back_button_markup,
+        reply_to_message_id=original_message.message_id if is_group else None
+    )
+    logger.info(f"Аудио '{title}' отправлено в чат {target_chat_id} с мета: title='{audio_title_meta}', performer='{audio_performer_meta}'")
+    return sent_message
+
+def prefetch_lyrics(sent_message: Message, user_id: int):
+    """Запускает фоновый поиск текста для отправленного трека по тем же данным, что и кнопка «Текст песни»"""
+    try:
+        callback_data = sent_message.reply_markup.inline_keyboard[0][0].callback_data
+        target = resolve_lyrics_target(user_id, callback_data, sent_message)
+    except (AttributeError, IndexError) as e:
+        logger.debug(f"Не удалось подготовить фоновый поиск текста: {e}")
+        return
+    if target:
+        lyrics_cache.prefetch(*target)
+
+async def resolve_track(job: TrackJob):
+    """Стадия resolve: уже загруженный в Telegram трек отправляется по file_id без скачивания"""
+    # Трек, не уложившийся в лимит Telegram, выдается в FIT_PROFILE при любом запрошенном профиле
+    cached = await get_audio_file_id(job.video_id, (job.profile_name, FIT_PROFILE))
+    if cached:
+        job.file_id, cached_title = cached
+        job.title = cached_title or "Unknown Title"
+        return 'upload'
+    job.progress_message = await job.reply(DOWNLOAD_PROGRESS_TEXT, parse_mode="HTML")
+    return 'download'
+
+async def download_track(job: TrackJob):
+    """Стадия download: скачивание и перекодирование в дисковый кэш, файл закрепляется за заданием"""
+    video_url = f"https://www.youtube.com/watch?v={job.video_id}"
     try:
-        file_path, title = await asyncio.to_thread(download_audio, video_url)
+        async with download_limit:
+            if job.flights is not None:
+                await job.flights.run(f"{job.video_id}:{job.profile_name}", prefetch_audio, video_url, job.profile_name)
+            # После общего скачивания файл уже лежит в кэше, каждый запрос закрепляет его для себя
+            job.file_path, job.title, job.used_profile = await download_audio(video_url, job.profile_name)
+        file_path = job.file_path
         if not file_path or not os.path.exists(file_path) or os.path.getsize(file_path) < 1024:
             logger.error(f"Ошибка файла: path={file_path}, exists={os.path.exists(file_path) if file_path else False}, size={os.path.getsize(file_path) if file_path and os.path.exists(file_path) else 0}")
-            await progress_msg.edit_text(
+            await job.progress_message.edit_text(
                 "<b>❌ Ошибка загрузки</b>\n\n"
                 "Не удалось скачать трек или файл поврежден.\n"
                 "Попробуйте выбрать другой трек.",
                 parse_mode="HTML"
             )
             return False
-        
-        await progress_msg.edit_text(
+
+        await job.progress_message.edit_text(
             "<b>⏳ Почти готово</b>\n\n"
             "Файл скачан, отправляю в чат...",
             parse_mode="HTML"
         )
-        
-        # Извлекаем исполнителя из названия, если возможно (для более точного track_info)
-        parsed_artist = "SpotifySaverBot" # Исполнитель по умолчанию
-        parsed_title = title # Название по умолчанию
-        artist_title_match = re.match(r'^(.+?)\s*[-–—]\s*(.+)$', title)
-        if artist_title_match:
-            potential_artist = artist_title_match.group(1).strip()
-            potential_title = artist_title_match.group(2).strip()
-            # Простое эвристическое правило, чтобы не принять часть названия за исполнителя
-            if len(potential_artist) > 2 and len(potential_artist.split()) < 4: 
-                parsed_artist = potential_artist
-                parsed_title = potential_title
-                logger.info(f"Распарсен исполнитель: '{parsed_artist}', трек: '{parsed_title}' из полного названия: '{title}'")
-            else:
-                logger.info(f"Не удалось надежно распарсить исполнителя из: '{title}'")
-        else:
-            logger.info(f"Формат 'Исполнитель - Трек' не найден в: '{title}'")
-
-        # Получаем информацию о треке для клавиатуры
-        track_info = {
-            'title': parsed_title, # Используем распарсенное название
-            'uploader': parsed_artist, # Используем распарсенного исполнителя
-            'id': video_id
-        }
-        
-        # Создаем клавиатуру с кнопками "Показать текст песни" и "К результатам"
-        back_button_markup = None
-        # Проверяем, есть ли результаты поиска, чтобы решить, нужна ли кнопка "К результатам"
-        # Это важно, так как original_message может быть результатом прямого скачивания по ссылке,
-        # а не выбором из результатов поиска.
-        if user_id in user_search_results and user_search_results[user_id]:
-            back_button_markup = get_track_keyboard(track_info, has_back_button=True)
-        else:
-            # Если нет результатов поиска (например, прямая ссылка), то кнопка "К результатам" не нужна
-            back_button_markup = get_track_keyboard(track_info, has_back_button=False)
-
-        audio_file = FSInputFile(path=file_path, filename=f"{title[:60]}.mp3")
-        # Для caption используем оригинальное полное название, которое скачал yt-dlp
-        caption = f"🎧 {title[:900]}"
-        # Для метаданных аудиофайла используем распарсенные title и artist
-        audio_title_meta = parsed_title[:64]
-        audio_performer_meta = parsed_artist[:64]
-        
-        target_chat_id = original_message.chat.id
+    except Exception as e:
+        logger.error(f"Общая ошибка при скачивании/обработке {video_url}: {e}", exc_info=True)
+        await job.progress_message.edit_text("❌ Ошибка при скачивании. Попробуйте другой трек.")
+        return False
+    return 'upload'
+
+async def upload_track(job: TrackJob):
+    """Стадия upload: отправка в чат и сохранение file_id"""
+    if job.file_id:
         try:
-            if is_group:
-                await bot_instance.send_audio(
-                    chat_id=target_chat_id,
-                    audio=audio_file, 
-                    title=audio_title_meta, 
-                    performer=audio_performer_meta,
-                    caption=caption, 
-                    reply_markup=back_button_markup,
-                    reply_to_message_id=original_message.message_id
-                )
-            else:
-                await bot_instance.send_audio(
-                    chat_id=target_chat_id,
-                    audio=audio_file, 
-                    title=audio_title_meta, 
-                    performer=audio_performer_meta,
-                    caption=caption, 
-                    reply_markup=back_button_markup
-                )
-            logger.info(f"Аудио '{title}' отправлено в чат {target_chat_id} с мета: title='{audio_title_meta}', performer='{audio_performer_meta}'")
-            await progress_msg.delete()
+            sent_message = await send_audio_to_chat(job.message, job.file_id, job.title, job.video_id, job.user_id)
+            logger.info(f"Трек {job.video_id} отправлен по сохраненному file_id.")
+            prefetch_lyrics(sent_message, job.user_id)
             return True
-        except Exception as send_err:
-            logger.error(f"Ошибка при отправке аудио в чат {target_chat_id}: {send_err}", exc_info=True)
-            await progress_msg.edit_text(f"❌ Ошибка при отправке аудио. Возможно, файл слишком большой или проблема с Telegram.")
+        except TelegramBadRequest as send_err:
+            if not is_stale_file_id_error(send_err):
+                logger.error(f"Ошибка при отправке аудио по file_id в чат {job.message.chat.id}: {send_err}", exc_info=True)
+                await job.reply("❌ Ошибка при отправке аудио. Возможно, проблема с Telegram.")
+                return False
+            logger.warning(f"Telegram отклонил сохраненный file_id для {job.video_id}: {send_err}. Скачиваем заново.")
+            await delete_audio_file_id(job.video_id)
+        # Скачиваем здесь же, а не возвращаем задание на стадию download:
+        # обратное ребро при заполненных очередях могло бы заблокировать конвейер.
+        # Число одновременных скачиваний все равно ограничивает download_limit в download_track
+        job.file_id = None
+        job.progress_message = await job.reply(DOWNLOAD_PROGRESS_TEXT, parse_mode="HTML")
+        if await download_track(job) != 'upload':
             return False
-    except Exception as e:
-        logger.error(f"Общая ошибка при скачивании/обработке {video_url}: {e}", exc_info=True)
-        await progress_msg.edit_text("❌ Ошибка при скачивании. Попробуйте другой трек.")
+
+    audio_file = FSInputFile(path=job.file_path, filename=f"{job.title[:60]}{os.path.splitext(job.file_path)[1]}")
+    try:
+        sent_message = await send_audio_to_chat(job.message, audio_file, job.title, job.video_id, job.user_id)
+        await job.progress_message.delete()
+    except Exception as send_err:
+        logger.error(f"Ошибка при отправке аудио в чат {job.message.chat.id}: {send_err}", exc_info=True)
+        await job.progress_message.edit_text(f"❌ Ошибка при отправке аудио. Возможно, файл слишком большой или проблема с Telegram.")
         return False
+
+    # Запоминаем file_id, чтобы следующие запросы этого трека обходились без скачивания
+    if sent_message and sent_message.audio:
+        await save_audio_file_id(job.video_id, sent_message.audio.file_id, job.title, job.used_profile)
+    prefetch_lyrics(sent_message, job.user_id)
+    return True
+
+# Стадии трека в порядке выполнения: (имя, обработчик); обработчик возвращает имя следующей стадии или результат
+TRACK_STAGES = (
+    ('resolve', resolve_track),
+    ('download', download_track),
+    ('upload', upload_track),
+)
+
+async def download_and_send_audio(original_message: Message, video_id: str, user_id: int, flights: SingleFlight = None, profile_name: str = AUDIO_PROFILE):
+    """
+    Скачивает трек и отправляет его в чат исходного сообщения, выполняя стадии
+    TRACK_STAGES по очереди (конвейер pipeline.Pipeline выполняет те же стадии параллельно).
+
+    Args:
+        flights: Реестр выполняющихся скачиваний воркеров. Если передан, одновременные
+            запросы одного video_id скачиваются один раз, а каждый запрос отправляется
+            в свой чат из общего кэша.
+        profile_name: Профиль выдачи аудио (см. AUDIO_PROFILES в utils.py)
+    """
+    job = TrackJob(original_message, video_id, user_id, profile_name, flights)
+    stages = dict(TRACK_STAGES)
+    try:
+        result = TRACK_STAGES[0][0]
+        while isinstance(result, str):
+            result = await stages[result](job)
+        return result
     finally:
-        if 'file_path' in locals() and file_path and os.path.exists(file_path):
-            try: os.remove(file_path); logger.info(f"Временный файл удален: {file_path}")
-            except Exception as e: logger.error(f"Ошибка при удалении временного файла {file_path}: {e}")
+        # Файл остается в дисковом кэше, снимаем только закрепление
+        job.close()
 
 @router.message(Command("search"))
-async def cmd_search(message: Message, state: FSMContext, download_queue: asyncio.Queue):
+async def cmd_search(message: Message, state: FSMContext, download_queue: FairQueue):
     user_id = message.from_user.id
     is_group = message.chat.type != "private"
     reply_func = message.reply if is_group else message.answer
@@ -629,16 +778,20 @@ async def cmd_search(message: Message, state: FSMContext, download_queue: asynci
     is_direct_download_link = False
     video_id_to_download = None
 
+    if is_collection_url(query):
+        await enqueue_collection(message, query, user_id, download_queue)
+        return
+
     if is_youtube_url(query) or is_spotify_url(query):
-        if not await can_user_download(user_id, DOWNLOAD_LIMIT_PER_DAY):
-            limit_msg = f"⚠️ Достигнут дневной лимит скачиваний ({await get_user_downloads(user_id)}/{DOWNLOAD_LIMIT_PER_DAY})."
+        if not await quota_cache.can_download(user_id, DOWNLOAD_LIMIT_PER_DAY):
+            limit_msg = f"⚠️ Достигнут дневной лимит скачиваний ({await quota_cache.get_downloads(user_id)}/{DOWNLOAD_LIMIT_PER_DAY})."
             await reply_func(limit_msg)
             return
         
         progress_msg = await reply_func("⏳ Обрабатываю ссылку...")
         try:
             if is_youtube_url(query):
-                results = await asyncio.to_thread(search_youtube, query, 1)
+                results = await search_youtube(query, 1)
                 if results and is_valid_youtube_id(results[0]['id']):
                     video_id_to_download = results[0]['id']
                     is_direct_download_link = True
@@ -657,10 +810,10 @@ async def cmd_search(message: Message, state: FSMContext, download_queue: asynci
             if is_direct_download_link and video_id_to_download:
                  await progress_msg.delete()
                  try:
-                    await download_queue.put((message, video_id_to_download, user_id))
-                    await reply_func(f"▶️ Ваш трек добавлен в очередь (поз. {download_queue.qsize()}). Ожидайте.")
-                 except asyncio.QueueFull:
-                    await reply_func(f"😕 Очередь на скачивание переполнена ({MAX_QUEUE_SIZE} треков). Попробуйте позже.")
+                    position = await enqueue_track(download_queue, (message, video_id_to_download, user_id))
+                    await reply_func(f"▶️ Ваш трек добавлен в очередь (поз. {position}, ожидание {format_eta(download_queue.eta(position))}).")
+                 except asyncio.QueueFull as e:
+                    await reply_func(f"😕 {rejection_text(e)}")
                  return
 
         except Exception as e:
@@ -676,14 +829,9 @@ async def cmd_search(message: Message, state: FSMContext, download_queue: asynci
     else: 
         progress_msg = await reply_func("🔍 Ищу трек...")
 
-    is_artist_track = bool(re.search(r'^(.+?)\s*[-–]\s*(.+)$', query))
-    cache_key = f"{user_id}_{query}"
-    if cache_key in search_cache and (time.time() - search_cache[cache_key]['timestamp'] < CACHE_TTL):
-        results = search_cache[cache_key]['results']
-    else:
-        results_limit = 5 if is_artist_track or is_group else 20
-        results = await asyncio.to_thread(search_youtube, query, results_limit)
-        if results: search_cache[cache_key] = {'results': results, 'timestamp': time.time()}
+    is_artist_track = split_artist_title(query) is not None
+    results_limit = 5 if is_artist_track or is_group else 20
+    results = await search_cache.search(query, results_limit)
     
     if not results:
         await progress_msg.edit_text(
@@ -705,19 +853,40 @@ async def cmd_search(message: Message, state: FSMContext, download_queue: asynci
     await state.set_state(SearchStates.searching)
     asyncio.create_task(clear_user_cache(user_id))
 
+async def _debounced_inline_search(search_text: str):
+    # Пока пользователь печатает, каждый следующий символ отменяет предыдущий поиск
+    await asyncio.sleep(INLINE_DEBOUNCE)
+    return await search_cache.search(search_text, INLINE_FETCH_LIMIT, prefix_limit=INLINE_RESULTS)
+
 @router.inline_query()
-async def inline_search(query: InlineQuery, bot_instance: Bot):
+async def inline_search(query: InlineQuery, bot_username: str):
     search_text = query.query.strip()
-    bot_username = (await bot_instance.get_me()).username
+    user_id = query.from_user.id
+    
+    previous = inline_searches.pop(user_id, None)
+    if previous is not None and not previous.done():
+        previous.cancel()
     
     if not search_text:
         return await query.answer([], switch_pm_text="Введите название песни или исполнителя", switch_pm_parameter="inline_help")
 
-    logger.info(f"Инлайн-запрос от {query.from_user.id}: {search_text}")
+    logger.info(f"Инлайн-запрос от {user_id}: {search_text}")
     
+    search_task = asyncio.create_task(_debounced_inline_search(search_text))
+    inline_searches[user_id] = search_task
     try:
-        results_limit = 5
-        search_results = await asyncio.to_thread(search_youtube, search_text, results_limit)
+        try:
+            search_results = await search_task
+        except asyncio.CancelledError:
+            if search_task.cancelled() and not asyncio.current_task().cancelling():
+                # Пришел более новый запрос этого пользователя, на устаревший не отвечаем
+                logger.debug(f"Инлайн-запрос от {user_id} '{search_text}' заменен более новым")
+                return
+            raise
+        finally:
+            if inline_searches.get(user_id) is search_task:
+                del inline_searches[user_id]
+        search_results = search_results[:INLINE_RESULTS]
 
         if not search_results:
             return await query.answer([], switch_pm_text="Ничего не найдено...", switch_pm_parameter="not_found")
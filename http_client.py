@@ -0,0 +1,54 @@
+import logging
+import httpx
+
+logger = logging.getLogger(__name__)
+
+# HTTP/2 и brotli включаются, только если установлены необязательные зависимости httpx
+try:
+    import h2  # noqa: F401
+    HTTP2_AVAILABLE = True
+except ImportError:
+    HTTP2_AVAILABLE = False
+
+try:
+    import brotli  # noqa: F401
+    ACCEPT_ENCODING = 'gzip, deflate, br'
+except ImportError:
+    ACCEPT_ENCODING = 'gzip, deflate'
+
+DEFAULT_HEADERS = {
+    'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36',
+    'Accept-Language': 'en-US,en;q=0.9',
+    'Accept-Encoding': ACCEPT_ENCODING,
+}
+
+# Значение по умолчанию; у каждого запроса может быть свой таймаут
+DEFAULT_TIMEOUT = 10.0
+
+_client = None
+
+def get_client() -> httpx.AsyncClient:
+    """
+    Возвращает общий асинхронный HTTP-клиент с пулом keep-alive соединений.
+    Соединения с youtube.com переиспользуются между запросами, поэтому TCP и TLS
+    рукопожатия выполняются один раз, а не на каждый поиск.
+    """
+    global _client
+    if _client is None or _client.is_closed:
+        _client = httpx.AsyncClient(
+            http2=HTTP2_AVAILABLE,
+            headers=DEFAULT_HEADERS,
+            timeout=DEFAULT_TIMEOUT,
+            follow_redirects=True,
+            limits=httpx.Limits(max_connections=50, max_keepalive_connections=20, keepalive_expiry=60.0),
+        )
+        logger.info(f"HTTP-клиент создан (HTTP/2: {'да' if HTTP2_AVAILABLE else 'нет'}, сжатие: {ACCEPT_ENCODING})")
+    return _client
+
+async def close_client():
+    """Закрывает общий HTTP-клиент и его соединения."""
+    global _client
+    if _client is not None:
+        client, _client = _client, None
+        await client.aclose()
+        logger.info("HTTP-клиент закрыт.")
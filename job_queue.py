@@ -0,0 +1,393 @@
+import json
+import math
+import time
+import logging
+import aiosqlite
+from aiogram.types import Message
+
+from bulk import BulkJob
+from config import DOWNLOAD_LIMIT_PER_DAY, JOB_MAX_ATTEMPTS, JOB_RETRY_DELAY, JOB_RETENTION
+from quota import quota_cache
+from scheduler import QueueRejected
+
+logger = logging.getLogger(__name__)
+
+# Сколько последних выполненных заданий учитывается в средней длительности для оценки ожидания
+AVG_WINDOW = 50
+
+# Порядок выдачи: сначала приоритетная полоса (треки из кэша), затем по кругу между
+# пользователями - user_seq равен числу заданий пользователя, ждавших в очереди при постановке
+CLAIM_ORDER = "priority DESC, user_seq, id"
+
+def encode_job(item):
+    """
+    Сериализует задание очереди скачивания для хранения в таблице jobs.
+
+    Returns:
+        (str, int, str, str, int): Вид задания, user_id, video_id, JSON задания и сколько
+        скачиваний нужно зарезервировать
+    """
+    if isinstance(item, BulkJob):
+        payload = {
+            'message': item.message.model_dump_json(exclude_none=True),
+            'progress_message': item.progress_message.model_dump_json(exclude_none=True) if item.progress_message else None,
+            'title': item.title,
+            'tracks': item.tracks,
+        }
+        return 'bulk', item.user_id, None, json.dumps(payload, ensure_ascii=False), len(item.tracks)
+    message, video_id, user_id = item
+    payload = {'message': message.model_dump_json(exclude_none=True)}
+    return 'track', user_id, video_id, json.dumps(payload, ensure_ascii=False), 1
+
+def decode_job(kind: str, user_id: int, video_id: str, payload: str, bot):
+    """Восстанавливает задание из таблицы jobs; сообщения привязываются к bot текущего процесса"""
+    data = json.loads(payload)
+    message = Message.model_validate_json(data['message'], context={'bot': bot})
+    if kind == 'bulk':
+        progress = data.get('progress_message')
+        return BulkJob(
+            message, user_id, data['title'], data['tracks'],
+            progress_message=Message.model_validate_json(progress, context={'bot': bot}) if progress else None,
+        )
+    return message, video_id, user_id
+
+class LeaseLost(Exception):
+    """Аренда задания истекла, и его забрал другой воркер: выполнять его дальше нельзя"""
+
+class JobStore:
+    """
+    Очередь заданий скачивания в SQLite, общая для процесса бота и процессов worker.py.
+
+    Бот только ставит задания (put) и сразу резервирует за них дневной лимит, так как
+    счетчики лимитов живут в памяти его процесса. Воркеры забирают задания атомарным
+    UPDATE ... RETURNING (claim) с арендой на lease_seconds и продлевают ее (heartbeat),
+    пока задание выполняется. Задание упавшего воркера после истечения аренды снова
+    выдается другому. Ошибка выполнения возвращает задание в очередь с экспоненциальной
+    задержкой, после max_attempts попыток оно помечается failed. Сколько скачиваний
+    не состоялось, воркер записывает в refund, а бот возвращает их пользователю в maintain().
+
+    Интерфейс постановки совпадает с FairQueue: put/check/eta/qsize, отказ - QueueRejected.
+    """
+
+    def __init__(self, path: str, lease_seconds: float, maxsize: int = 0, user_limit: int = 0,
+                 max_wait: float = 0, initial_job_seconds: float = 20.0):
+        self.path = path
+        self.lease_seconds = lease_seconds
+        self.maxsize = maxsize
+        self.user_limit = user_limit
+        self.max_wait = max_wait
+        self._db = None
+        self._queued = 0
+        self._running = 0
+        self._workers = 1
+        self._avg_job_seconds = initial_job_seconds
+        self.rejected = {}
+        self.refunded = 0
+
+    async def open(self):
+        """Открывает соединение и создает таблицы, если их нет."""
+        if self._db is not None:
+            return
+        db = await aiosqlite.connect(self.path)
+        # Несколько процессов пишут в один файл: WAL и ожидание блокировки вместо ошибки "database is locked"
+        await db.execute("PRAGMA journal_mode=WAL")
+        await db.execute("PRAGMA synchronous=NORMAL")
+        await db.execute("PRAGMA busy_timeout=10000")
+        await db.execute('''
+            CREATE TABLE IF NOT EXISTS jobs (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                kind TEXT NOT NULL,
+                user_id INTEGER NOT NULL,
+                video_id TEXT,
+                payload TEXT NOT NULL,
+                priority INTEGER NOT NULL DEFAULT 0,
+                user_seq INTEGER NOT NULL DEFAULT 0,
+                status TEXT NOT NULL DEFAULT 'queued',
+                attempts INTEGER NOT NULL DEFAULT 0,
+                available_at REAL NOT NULL,
+                lease_owner TEXT,
+                lease_until REAL,
+                quota INTEGER NOT NULL DEFAULT 0,
+                refund INTEGER NOT NULL DEFAULT 0,
+                refunded INTEGER NOT NULL DEFAULT 0,
+                error TEXT,
+                created_at REAL NOT NULL,
+                started_at REAL,
+                finished_at REAL
+            )
+        ''')
+        await db.execute("CREATE INDEX IF NOT EXISTS idx_jobs_claim ON jobs (status, priority, user_seq, id)")
+        await db.execute("CREATE INDEX IF NOT EXISTS idx_jobs_user ON jobs (user_id, status)")
+        # Живые воркеры для оценки времени ожидания
+        await db.execute('''
+            CREATE TABLE IF NOT EXISTS job_workers (
+                name TEXT PRIMARY KEY,
+                seen_at REAL NOT NULL
+            )
+        ''')
+        await db.commit()
+        self._db = db
+        await self.refresh()
+        logger.info(f"Очередь заданий {self.path}: в очереди {self._queued}, выполняется {self._running}")
+
+    async def close(self):
+        if self._db is not None:
+            db, self._db = self._db, None
+            await db.close()
+
+    async def _fetchone(self, query: str, params=()):
+        async with self._db.execute(query, params) as cursor:
+            return await cursor.fetchone()
+
+    # --- Постановка (процесс бота) ---
+
+    def _reject(self, reason: str, eta: float = 0.0):
+        self.rejected[reason] = self.rejected.get(reason, 0) + 1
+        raise QueueRejected(reason, eta)
+
+    async def _position(self, priority: int, user_seq: int, job_id: int = None) -> int:
+        """Позиция задания с указанными ключами сортировки среди ожидающих (с 1)"""
+        row = await self._fetchone(
+            "SELECT COUNT(*) FROM jobs WHERE status = 'queued' AND (priority > ? OR (priority = ? AND "
+            "(user_seq < ? OR (user_seq = ? AND id < ?))))",
+            (priority, priority, user_seq, user_seq, job_id if job_id is not None else 2 ** 62),
+        )
+        return row[0] + 1
+
+    async def _user_queued(self, user_id: int) -> int:
+        row = await self._fetchone("SELECT COUNT(*) FROM jobs WHERE user_id = ? AND status = 'queued'", (user_id,))
+        return row[0]
+
+    async def check(self, user_id, key=None, priority: bool = False):
+        """
+        Проверяет, будет ли принято задание пользователя, ничего не добавляя в очередь.
+
+        Raises:
+            QueueRejected: Если задание не прошло бы проверки
+        """
+        user_queued = await self._user_queued(user_id)
+        if key is not None:
+            row = await self._fetchone(
+                "SELECT 1 FROM jobs WHERE user_id = ? AND video_id = ? AND status = 'queued'", key,
+            )
+            if row:
+                self._reject('duplicate', self.eta(await self._position(0, 0)))
+        if self.user_limit and user_queued >= self.user_limit:
+            self._reject('user_limit', self.eta(await self._position(0, 0)))
+        if self.maxsize:
+            row = await self._fetchone("SELECT COUNT(*) FROM jobs WHERE status = 'queued'")
+            if row[0] >= self.maxsize:
+                self._reject('full', self.eta(row[0] + 1))
+        if self.max_wait and not priority:
+            eta = self.eta(await self._position(0, user_queued))
+            if eta > self.max_wait:
+                self._reject('overloaded', eta)
+
+    async def put(self, item, priority: bool = False) -> int:
+        """
+        Проверяет и добавляет задание, резервируя за него дневной лимит
+        (групповое задание урезается до числа зарезервированных треков).
+
+        Returns:
+            int: Позиция задания в очереди
+        """
+        kind, user_id, video_id, payload, slots = encode_job(item)
+        await self.check(user_id, (user_id, video_id) if video_id else None, priority)
+
+        reserved = 0
+        while reserved < slots and await quota_cache.reserve(user_id, DOWNLOAD_LIMIT_PER_DAY):
+            reserved += 1
+        if reserved == 0:
+            self._reject('quota')
+        if kind == 'bulk' and reserved < slots:
+            item.tracks = item.tracks[:reserved]
+            kind, user_id, video_id, payload, slots = encode_job(item)
+
+        # Проверки check() и вставка выполняются одним INSERT ... SELECT: между ними ждали бы
+        # await, и одновременные put() одного пользователя прошли бы проверки оба
+        now = time.time()
+        try:
+            row = await self._fetchone(
+                "INSERT INTO jobs (kind, user_id, video_id, payload, priority, user_seq, available_at, quota, created_at) "
+                "SELECT ?, ?, ?, ?, ?, (SELECT COUNT(*) FROM jobs WHERE user_id = ? AND status = 'queued'), ?, ?, ? "
+                "WHERE (? IS NULL OR NOT EXISTS (SELECT 1 FROM jobs WHERE user_id = ? AND video_id = ? AND status = 'queued')) "
+                "AND (? = 0 OR (SELECT COUNT(*) FROM jobs WHERE user_id = ? AND status = 'queued') < ?) "
+                "AND (? = 0 OR (SELECT COUNT(*) FROM jobs WHERE status = 'queued') < ?) "
+                "RETURNING id, user_seq",
+                (kind, user_id, video_id, payload, int(priority), user_id, now, reserved, now,
+                 video_id, user_id, video_id,
+                 self.user_limit, user_id, self.user_limit,
+                 self.maxsize, self.maxsize),
+            )
+            await self._db.commit()
+        except Exception:
+            for _ in range(reserved):
+                quota_cache.release(user_id)
+            raise
+        if row is None:
+            # Другое задание заняло место после предварительной проверки: check() назовет причину
+            for _ in range(reserved):
+                quota_cache.release(user_id)
+            await self.check(user_id, (user_id, video_id) if video_id else None, priority=True)
+            self._reject('full', self.eta(self._queued + 1))
+        job_id, user_seq = row
+        self._queued += 1
+        return await self._position(int(priority), user_seq, job_id)
+
+    def eta(self, position: int) -> float:
+        """Примерное время (в секундах) до готовности задания на указанной позиции"""
+        return math.ceil(position / self._workers) * self._avg_job_seconds
+
+    def qsize(self) -> int:
+        """Число ожидающих заданий на момент последнего обновления (put или maintain)"""
+        return self._queued
+
+    async def refresh(self):
+        """Обновляет счетчики, число живых воркеров и среднюю длительность задания"""
+        now = time.time()
+        async with self._db.execute("SELECT status, COUNT(*) FROM jobs WHERE status IN ('queued', 'running') GROUP BY status") as cursor:
+            counts = dict(await cursor.fetchall())
+        self._queued, self._running = counts.get('queued', 0), counts.get('running', 0)
+        row = await self._fetchone("SELECT COUNT(*) FROM job_workers WHERE seen_at >= ?", (now - self.lease_seconds,))
+        self._workers = max(1, row[0])
+        row = await self._fetchone(
+            "SELECT AVG(finished_at - started_at) FROM (SELECT started_at, finished_at FROM jobs "
+            "WHERE status = 'done' AND kind = 'track' AND started_at IS NOT NULL ORDER BY id DESC LIMIT ?)",
+            (AVG_WINDOW,),
+        )
+        if row[0] is not None:
+            self._avg_job_seconds = row[0]
+
+    async def maintain(self):
+        """
+        Обслуживание очереди в процессе бота: задания с истекшей арендой и исчерпанными
+        попытками помечаются failed, неиспользованный лимит возвращается пользователям,
+        старые завершенные задания удаляются.
+        """
+        now = time.time()
+        await self._db.execute(
+            "UPDATE jobs SET status = 'failed', refund = quota, finished_at = ?, error = 'lease expired' "
+            "WHERE status = 'running' AND lease_until < ? AND attempts >= ?",
+            (now, now, JOB_MAX_ATTEMPTS),
+        )
+        async with self._db.execute(
+            "SELECT id, user_id, refund FROM jobs WHERE status IN ('done', 'failed') AND refund > 0 AND refunded = 0"
+        ) as cursor:
+            refunds = await cursor.fetchall()
+        for _, user_id, refund in refunds:
+            for _ in range(refund):
+                quota_cache.release(user_id)
+            self.refunded += refund
+        if refunds:
+            await self._db.executemany("UPDATE jobs SET refunded = 1 WHERE id = ?", [(job_id,) for job_id, _, _ in refunds])
+        await self._db.execute(
+            "DELETE FROM jobs WHERE status IN ('done', 'failed') AND finished_at < ? AND (refund = 0 OR refunded = 1)",
+            (now - JOB_RETENTION,),
+        )
+        await self._db.execute("DELETE FROM job_workers WHERE seen_at < ?", (now - JOB_RETENTION,))
+        await self._db.commit()
+        await self.refresh()
+
+    # --- Выполнение (воркеры) ---
+
+    async def register_worker(self, name: str):
+        """Отмечает воркер живым; вызывается при запуске и с каждым heartbeat"""
+        await self._db.execute(
+            "INSERT INTO job_workers (name, seen_at) VALUES (?, ?) ON CONFLICT(name) DO UPDATE SET seen_at = excluded.seen_at",
+            (name, time.time()),
+        )
+        await self._db.commit()
+
+    async def unregister_worker(self, name: str):
+        await self._db.execute("DELETE FROM job_workers WHERE name = ?", (name,))
+        await self._db.commit()
+
+    async def claim(self, worker: str):
+        """
+        Атомарно забирает следующее задание: ожидающее, у которого подошло время повтора,
+        или выполняющееся, чья аренда истекла (воркер упал), если попытки не исчерпаны.
+
+        Returns:
+            tuple | None: (id, kind, user_id, video_id, payload, attempts, quota) или None
+        """
+        now = time.time()
+        row = await self._fetchone(
+            "UPDATE jobs SET status = 'running', lease_owner = ?, lease_until = ?, attempts = attempts + 1, started_at = ? "
+            "WHERE id = (SELECT id FROM jobs WHERE (status = 'queued' AND available_at <= ?) "
+            f"OR (status = 'running' AND lease_until < ? AND attempts < ?) ORDER BY {CLAIM_ORDER} LIMIT 1) "
+            "RETURNING id, kind, user_id, video_id, payload, attempts, quota",
+            (worker, now + self.lease_seconds, now, now, now, JOB_MAX_ATTEMPTS),
+        )
+        await self._db.commit()
+        return row
+
+    async def heartbeat(self, job_id: int, worker: str) -> bool:
+        """Продлевает аренду. Возвращает False, если задание уже забрал другой воркер"""
+        cursor = await self._db.execute(
+            "UPDATE jobs SET lease_until = ? WHERE id = ? AND lease_owner = ? AND status = 'running'",
+            (time.time() + self.lease_seconds, job_id, worker),
+        )
+        await self._db.commit()
+        return cursor.rowcount > 0
+
+    def _check_owned(self, cursor, job_id: int, worker: str, action: str) -> int:
+        if cursor.rowcount == 0:
+            logger.warning(f"Задание {job_id}: воркер {worker} больше не владеет арендой, {action} не записано")
+        return cursor.rowcount
+
+    async def complete(self, job_id: int, worker: str, refund: int = 0) -> int:
+        """
+        Завершает задание; refund - сколько зарезервированных скачиваний не состоялось.
+        Возвращает число измененных строк: 0, если аренду уже забрал другой воркер
+        """
+        cursor = await self._db.execute(
+            "UPDATE jobs SET status = 'done', refund = ?, finished_at = ?, lease_owner = NULL "
+            "WHERE id = ? AND lease_owner = ?",
+            (refund, time.time(), job_id, worker),
+        )
+        await self._db.commit()
+        return self._check_owned(cursor, job_id, worker, "завершение")
+
+    async def fail(self, job_id: int, worker: str, attempts: int, error: str) -> int:
+        """
+        Возвращает задание в очередь с экспоненциальной задержкой или помечает failed после последней попытки.
+        Возвращает число измененных строк: 0, если аренду уже забрал другой воркер
+        """
+        now = time.time()
+        if attempts < JOB_MAX_ATTEMPTS:
+            delay = JOB_RETRY_DELAY * 2 ** (attempts - 1)
+            cursor = await self._db.execute(
+                "UPDATE jobs SET status = 'queued', available_at = ?, lease_owner = NULL, lease_until = NULL, error = ? "
+                "WHERE id = ? AND lease_owner = ?",
+                (now + delay, error, job_id, worker),
+            )
+            logger.warning(f"Задание {job_id}: попытка {attempts}/{JOB_MAX_ATTEMPTS} не удалась ({error}), повтор через {delay:.0f} сек.")
+        else:
+            cursor = await self._db.execute(
+                "UPDATE jobs SET status = 'failed', refund = quota, finished_at = ?, lease_owner = NULL, error = ? "
+                "WHERE id = ? AND lease_owner = ?",
+                (now, error, job_id, worker),
+            )
+            logger.error(f"Задание {job_id}: все {JOB_MAX_ATTEMPTS} попытки не удались ({error})")
+        await self._db.commit()
+        return self._check_owned(cursor, job_id, worker, "ошибка")
+
+    async def release(self, job_id: int, worker: str) -> int:
+        """Возвращает задание в очередь без штрафа, например при остановке воркера. Возвращает число измененных строк"""
+        cursor = await self._db.execute(
+            "UPDATE jobs SET status = 'queued', attempts = attempts - 1, lease_owner = NULL, lease_until = NULL "
+            "WHERE id = ? AND lease_owner = ?",
+            (job_id, worker),
+        )
+        await self._db.commit()
+        return cursor.rowcount
+
+    def stats(self) -> dict:
+        return {
+            'queued': self._queued,
+            'running': self._running,
+            'workers': self._workers,
+            'avg_job_seconds': round(self._avg_job_seconds, 1),
+            'rejected': dict(self.rejected),
+            'refunded': self.refunded,
+        }
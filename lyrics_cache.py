@@ -0,0 +1,117 @@
+import json
+import time
+import asyncio
+import logging
+
+from config import LYRICS_CACHE_TTL, LYRICS_NEGATIVE_TTL, LYRICS_PREFETCH_QUEUE_SIZE, LYRICS_PREFETCH_MAX_AGE
+from database import load_cached_lyrics, save_cached_lyrics, purge_cached_lyrics
+from search_cache import SearchCache
+from singleflight import SingleFlight
+from title_parser import clean_track_name
+import utils
+from utils import get_lyrics_for_track
+
+logger = logging.getLogger(__name__)
+
+# Пауза фоновой загрузки текстов, пока очередь скачивания занята
+PREFETCH_BACKOFF = 5.0
+
+class LyricsCache:
+    """
+    Кэш результатов get_lyrics_for_track в таблице lyrics_cache.
+
+    Ключ - нормализованные исполнитель и название без уточнений в скобках.
+    Найденные тексты хранятся found_ttl секунд, ответ "не найдено" - missing_ttl,
+    ошибки Genius API не кэшируются. Одновременные запросы одной песни
+    объединяются в один поход в Genius.
+    """
+
+    def __init__(self, found_ttl: float, missing_ttl: float):
+        self.found_ttl = found_ttl
+        self.missing_ttl = missing_ttl
+        self._flights = SingleFlight("lyrics")
+        self.hits = 0
+        self.misses = 0
+        self.prefetched = 0
+        self._prefetch_queue = None
+        self._prefetch_tasks = []
+        self._busy = lambda: False
+
+    @staticmethod
+    def make_key(artist_name: str, track_name: str) -> str:
+        return f"{SearchCache.normalize(artist_name or '')}\x1f{SearchCache.normalize(clean_track_name(track_name))}"
+
+    async def get(self, artist_name: str, track_name: str) -> dict:
+        """Возвращает результат в формате get_lyrics_for_track из кэша или с Genius"""
+        key = self.make_key(artist_name, track_name)
+        cached = await load_cached_lyrics(key, self.found_ttl, self.missing_ttl)
+        if cached is not None:
+            self.hits += 1
+            logger.info(f"Текст песни '{artist_name} - {track_name}' взят из кэша.")
+            return json.loads(cached)
+        self.misses += 1
+        return await self._flights.run(key, self._fetch, key, artist_name, track_name)
+
+    async def _fetch(self, key: str, artist_name: str, track_name: str) -> dict:
+        result = await asyncio.to_thread(get_lyrics_for_track, artist_name, track_name)
+        if result["success"] or result.get("not_found"):
+            await save_cached_lyrics(key, json.dumps(result, ensure_ascii=False), result["success"])
+        return result
+
+    def prefetch(self, artist_name: str, track_name: str):
+        """
+        Ставит поиск текста в фоновую очередь, не дожидаясь результата. Если фоновая
+        загрузка не запущена, не настроен Genius или очередь заполнена, запрос пропускается.
+        """
+        if self._prefetch_queue is None or utils.genius_api is None:
+            return
+        try:
+            self._prefetch_queue.put_nowait((time.monotonic(), artist_name, track_name))
+        except asyncio.QueueFull:
+            logger.debug(f"Очередь фоновой загрузки текстов заполнена, пропускаем '{artist_name} - {track_name}'")
+
+    async def _prefetch_loop(self):
+        while True:
+            queued_at, artist_name, track_name = await self._prefetch_queue.get()
+            try:
+                # Низкий приоритет: ждем, пока разгрузится очередь скачивания
+                while self._busy() and time.monotonic() - queued_at < LYRICS_PREFETCH_MAX_AGE:
+                    await asyncio.sleep(PREFETCH_BACKOFF)
+                # Кнопка "Текст песни" к этому времени уже не работает
+                if time.monotonic() - queued_at >= LYRICS_PREFETCH_MAX_AGE:
+                    continue
+                await self.get(artist_name, track_name)
+                self.prefetched += 1
+            except Exception as e:
+                logger.warning(f"Фоновая загрузка текста '{artist_name} - {track_name}' не удалась: {e}")
+            finally:
+                self._prefetch_queue.task_done()
+
+    def start_prefetch(self, workers: int, busy=None):
+        """
+        Запускает фоновую загрузку текстов.
+
+        Args:
+            workers: Сколько текстов загружается одновременно
+            busy: Функция без аргументов; пока она возвращает True, загрузка приостановлена
+        """
+        if self._prefetch_queue is not None:
+            return
+        self._prefetch_queue = asyncio.Queue(maxsize=LYRICS_PREFETCH_QUEUE_SIZE)
+        self._busy = busy or (lambda: False)
+        self._prefetch_tasks = [asyncio.create_task(self._prefetch_loop()) for _ in range(workers)]
+
+    async def stop_prefetch(self):
+        for task in self._prefetch_tasks:
+            task.cancel()
+        await asyncio.gather(*self._prefetch_tasks, return_exceptions=True)
+        self._prefetch_tasks = []
+        self._prefetch_queue = None
+
+    async def purge_expired(self):
+        await purge_cached_lyrics(self.found_ttl, self.missing_ttl)
+
+    def stats(self) -> dict:
+        return {'hits': self.hits, 'misses': self.misses, 'prefetched': self.prefetched, 'in_flight': len(self._flights)}
+
+lyrics_cache = LyricsCache(LYRICS_CACHE_TTL, LYRICS_NEGATIVE_TTL)
@@ -8,10 +8,23 @@ from aiogram.enums import ParseMode
 from aiogram.fsm.storage.memory import MemoryStorage
 from aiogram.types import BotCommand, BotCommandScopeDefault, BotCommandScopeAllGroupChats, BotCommandScopeChat, Message
 
-from config import BOT_TOKEN, DOWNLOAD_WORKERS, MAX_QUEUE_SIZE, DOWNLOAD_LIMIT_PER_DAY
-from handlers import router # Убрали download_and_send_audio, increment_user_downloads, они будут вызываться из воркера
-from database import init_db, can_user_download, get_user_downloads
+from config import BOT_TOKEN, DOWNLOAD_WORKERS, MAX_QUEUE_SIZE, QUEUE_MAX_PER_USER, QUEUE_MAX_WAIT, JOB_QUEUE_BACKEND, JOB_QUEUE_PATH, JOB_LEASE_SECONDS, JOB_MAINTAIN_INTERVAL, AUTOSCALE_WORKERS, AUTOSCALE_MIN_WORKERS, AUTOSCALE_MAX_WORKERS, TRACK_PIPELINE, PIPELINE_STATS_INTERVAL, DOWNLOAD_LIMIT_PER_DAY, LYRICS_PREFETCH, LYRICS_PREFETCH_WORKERS, LYRICS_PREFETCH_BUSY_QUEUE
+from handlers import router, TRACK_STAGES # Убрали download_and_send_audio, increment_user_downloads, они будут вызываться из воркера
+from database import init_db, close_db
+from quota import quota_cache
+from search_cache import search_cache
+from lyrics_cache import lyrics_cache
 from middlewares import ThrottlingMiddleware # <--- Импортируем наш middleware
+from audio_cache import audio_cache
+import download_engine
+from http_client import close_client
+from singleflight import SingleFlight
+from scheduler import FairQueue
+from bulk import BulkJob, run_bulk_job
+from job_queue import JobStore
+from worker import run_worker
+from autoscaler import WorkerSlot, WorkerSupervisor
+from pipeline import TrackJob, create_track_pipeline
 
 # Настройка логирования
 logging.basicConfig(
@@ -26,33 +39,69 @@ logging.basicConfig(
 logger = logging.getLogger(__name__)
 
 # Очередь для скачивания
-download_queue = asyncio.Queue(maxsize=MAX_QUEUE_SIZE if MAX_QUEUE_SIZE > 0 else 0) # 0 для asyncio.Queue означает бесконечный размер
+# Пользователи обслуживаются по кругу, треки из кэша - вне очереди
+if JOB_QUEUE_BACKEND == "sqlite":
+    # Общая очередь в файле: задания выполняют воркеры бота и отдельные процессы worker.py
+    download_queue = JobStore(
+        JOB_QUEUE_PATH, JOB_LEASE_SECONDS,
+        maxsize=MAX_QUEUE_SIZE,
+        user_limit=QUEUE_MAX_PER_USER,
+        max_wait=QUEUE_MAX_WAIT,
+    )
+else:
+    download_queue = FairQueue(
+        maxsize=MAX_QUEUE_SIZE if MAX_QUEUE_SIZE > 0 else 0, # 0 означает бесконечный размер
+        workers=DOWNLOAD_WORKERS,
+        user_limit=QUEUE_MAX_PER_USER,
+        max_wait=QUEUE_MAX_WAIT,
+    )
+
+# Реестр выполняющихся скачиваний: одновременные задачи с одним video_id скачивают трек один раз
+download_flights = SingleFlight("download")
+
+# Конвейер стадий трека; None - каждый воркер выполняет стадии сам
+track_pipeline = create_track_pipeline(TRACK_STAGES) if TRACK_PIPELINE else None
 
 # --- Воркер для обработки очереди скачивания ---
 # Импортируем сюда, чтобы избежать циклических зависимостей и дать воркеру доступ
-async def download_worker_task(name: str, queue: asyncio.Queue, bot_instance: Bot):
-    from handlers import download_and_send_audio, increment_user_downloads
-    # can_user_download, get_user_downloads уже импортированы глобально в main.py
-    # DOWNLOAD_LIMIT_PER_DAY также доступен глобально в этом модуле
+async def download_worker_task(name: str, queue: FairQueue, bot_instance: Bot, slot: WorkerSlot = None):
+    from handlers import download_and_send_audio
+    # DOWNLOAD_LIMIT_PER_DAY доступен глобально в этом модуле
 
     logger.info(f"Воркер {name} запущен")
     while True:
+        if slot is not None:
+            slot.busy = False
+            if slot.retiring:
+                logger.info(f"Воркер {name} остановлен автомасштабированием.")
+                break
         task_item = None
         original_message, video_id, user_id = None, None, None # Инициализация для блока finally
+        slot_reserved = False
         try:
             task_item = await queue.get()
+            if slot is not None:
+                slot.busy = True
             if task_item is None:
                 queue.task_done()
                 logger.info(f"Воркер {name} получил сигнал завершения.")
                 break
             
+            if isinstance(task_item, BulkJob):
+                original_message = task_item.message
+                # Лимит списывается внутри группового задания за каждый трек
+                await run_bulk_job(task_item, download_flights)
+                queue.task_done()
+                continue
+
             original_message, video_id, user_id = task_item
             logger.info(f"Воркер {name} взял из очереди user_id={user_id}, video_id={video_id}")
 
-            # --- Повторная проверка лимита непосредственно перед скачиванием ---
-            if not await can_user_download(user_id, DOWNLOAD_LIMIT_PER_DAY):
-                current_downloads = await get_user_downloads(user_id)
-                logger.warning(f"Воркер {name}: Лимит для user_id={user_id} уже исчерпан ({current_downloads}/{DOWNLOAD_LIMIT_PER_DAY}) перед началом скачивания video_id={video_id}. Задача отменена.")
+            # --- Резервирование слота из лимита непосредственно перед скачиванием ---
+            # Проверка и списание выполняются одним запросом, поэтому параллельные задачи не превысят лимит
+            slot_reserved = await quota_cache.reserve(user_id, DOWNLOAD_LIMIT_PER_DAY)
+            if not slot_reserved:
+                logger.warning(f"Воркер {name}: Лимит для user_id={user_id} уже исчерпан ({DOWNLOAD_LIMIT_PER_DAY}/{DOWNLOAD_LIMIT_PER_DAY}) перед началом скачивания video_id={video_id}. Задача отменена.")
                 # Пытаемся уведомить пользователя, если это возможно и не слишком спамно
                 try:
                     await bot_instance.send_message(original_message.chat.id, f"❗️Не удалось начать скачивание трека (ID {video_id[:7]}...): дневной лимит исчерпан.")
@@ -60,27 +109,38 @@ async def download_worker_task(name: str, queue: asyncio.Queue, bot_instance: Bo
                     logger.error(f"Воркер {name}: не удалось уведомить user_id={user_id} об отмене из-за лимита: {notify_e}")
                 queue.task_done()
                 continue # Переходим к следующей задаче в очереди
-            # --- Конец повторной проверки лимита ---
+            # --- Конец резервирования ---
             
-            success = await download_and_send_audio(original_message, video_id, user_id)
+            if track_pipeline is not None:
+                # Воркер ждет результата: число воркеров ограничивает задания в работе, а очередь
+                # учитывает полное время задания в оценке ожидания. Стадии разных воркеров
+                # выполняются параллельно: один трек отправляется, пока следующий скачивается
+                success = await track_pipeline.run(TrackJob(original_message, video_id, user_id, flights=download_flights))
+            else:
+                success = await download_and_send_audio(original_message, video_id, user_id, flights=download_flights)
+            slot_reserved = False
             if success:
-                await increment_user_downloads(user_id) # Инкремент только после УСПЕШНОГО скачивания и отправки
-                logger.info(f"Воркер {name}: user_id={user_id}, video_id={video_id} - успех, счетчик обновлен.")
+                logger.info(f"Воркер {name}: user_id={user_id}, video_id={video_id} - успех, скачивание засчитано.")
             else:
-                logger.warning(f"Воркер {name}: user_id={user_id}, video_id={video_id} - ошибка обработки download_and_send_audio.")
+                quota_cache.release(user_id) # Засчитываем только УСПЕШНО скачанные и отправленные треки
+                logger.warning(f"Воркер {name}: user_id={user_id}, video_id={video_id} - трек не отправлен, резерв возвращен.")
             
             queue.task_done()
             await asyncio.sleep(0.1)
         except asyncio.CancelledError:
             logger.info(f"Воркер {name} отменен.")
+            if slot_reserved:
+                quota_cache.release(user_id)
             # Если воркер был отменен во время ожидания queue.get(), задача может остаться в очереди.
             # В идеале, при отмене нужно вернуть задачу в очередь или обработать ее.
             # Но для простоты пока просто выходим.
             if task_item: # Если задача была взята, но не завершена
-                queue.put_nowait(task_item) # Попытка вернуть в очередь (может вызвать ошибку если очередь полна)
+                queue.put_nowait(task_item, force=True) # Возвращаем в очередь в обход ограничений на постановку
             break
         except Exception as e:
             logger.error(f"Ошибка в воркере {name} при обработке задачи ({task_item}): {e}", exc_info=True)
+            if slot_reserved:
+                quota_cache.release(user_id)
             if task_item: 
                  # Важно: Если original_message существует, можно попытаться уведомить об ошибке
                  if original_message and hasattr(original_message, 'chat') and hasattr(original_message.chat, 'id'):
@@ -91,6 +151,15 @@ async def download_worker_task(name: str, queue: asyncio.Queue, bot_instance: Bo
                  queue.task_done()
             await asyncio.sleep(5) # Пауза перед следующей попыткой, если ошибка не связана с отменой
 
+async def maintain_job_queue(store: JobStore):
+    """Возвращает неиспользованный лимит за завершенные задания общей очереди и обновляет ее счетчики"""
+    while True:
+        await asyncio.sleep(JOB_MAINTAIN_INTERVAL)
+        try:
+            await store.maintain()
+        except Exception as e:
+            logger.error(f"Ошибка при обслуживании очереди заданий: {e}")
+
 async def main():
     if not BOT_TOKEN:
         print("Ошибка: Токен бота не найден. Проверьте .env файл.")
@@ -100,7 +169,18 @@ async def main():
         os.makedirs("downloads")
         logger.info("Создана папка для загрузок")
     
+    # Удаляем недокачанные и осиротевшие файлы, восстанавливаем индекс кэша
+    audio_cache.sweep()
     await init_db()
+    # Счетчики лимитов хранятся в памяти и периодически записываются в БД
+    quota_cache.start()
+    await search_cache.purge_expired()
+    await lyrics_cache.purge_expired()
+    durable_queue = isinstance(download_queue, JobStore)
+    if durable_queue:
+        await download_queue.open()
+        # Возвращаем лимит за задания, завершившиеся, пока бот был остановлен
+        await download_queue.maintain()
     
     bot = Bot(token=BOT_TOKEN, default_bot_properties=DefaultBotProperties(parse_mode=ParseMode.HTML))
     dp = Dispatcher()
@@ -113,19 +193,41 @@ async def main():
 
     dp["download_queue"] = download_queue
     dp["bot_instance"] = bot
+    # Имя бота не меняется, запрашиваем его один раз, а не в каждом обработчике
+    dp["bot_username"] = (await bot.get_me()).username
 
     await setup_bot_commands(bot)
     dp.include_router(router)
     
     worker_tasks = []
+    supervisor = None
+    maintain_task = None
     try:
         logger.info("Бот запускается...")
         await bot.delete_webhook(drop_pending_updates=True)
         
-        for i in range(DOWNLOAD_WORKERS):
-            task = asyncio.create_task(download_worker_task(f"DownloadWorker-{i+1}", download_queue, bot))
-            worker_tasks.append(task)
-        logger.info(f"Запущено {DOWNLOAD_WORKERS} воркеров для скачивания.")
+        if track_pipeline is not None:
+            track_pipeline.start(PIPELINE_STATS_INTERVAL)
+
+        def spawn_worker(name: str, slot: WorkerSlot = None):
+            if durable_queue:
+                return run_worker(name, download_queue, bot, download_flights, slot, track_pipeline)
+            return download_worker_task(name, download_queue, bot, slot)
+
+        if AUTOSCALE_WORKERS:
+            # Число воркеров меняется на ходу по длине очереди, ошибкам, загрузке CPU и задержке скачивания
+            supervisor = WorkerSupervisor(spawn_worker, download_queue, AUTOSCALE_MIN_WORKERS, AUTOSCALE_MAX_WORKERS)
+            supervisor.start(DOWNLOAD_WORKERS)
+        else:
+            for i in range(DOWNLOAD_WORKERS):
+                worker_tasks.append(asyncio.create_task(spawn_worker(f"DownloadWorker-{i+1}")))
+            logger.info(f"Запущено {DOWNLOAD_WORKERS} воркеров для скачивания.")
+        if durable_queue:
+            maintain_task = asyncio.create_task(maintain_job_queue(download_queue))
+        
+        # Фоновый поиск текстов уступает скачиванию, когда очередь занята
+        if LYRICS_PREFETCH:
+            lyrics_cache.start_prefetch(LYRICS_PREFETCH_WORKERS, busy=lambda: download_queue.qsize() + (track_pipeline.in_flight() if track_pipeline else 0) >= LYRICS_PREFETCH_BUSY_QUEUE)
         
         # Запуск поллинга
         await dp.start_polling(bot, allowed_updates=[
@@ -136,6 +238,9 @@ async def main():
         logger.critical(f"Критическая ошибка в main loop: {e}", exc_info=True)
     finally:
         logger.info("Начинаем остановку бота...")
+        if supervisor:
+            logger.info(f"Статистика автомасштабирования: {supervisor.stats()}")
+            await supervisor.stop()
         if worker_tasks:
             logger.info("Отменяем задачи воркеров...")
             for task in worker_tasks:
@@ -151,6 +256,34 @@ async def main():
                     logger.info(f"Воркер {i+1} успешно завершен.")
             logger.info("Все воркеры остановлены.")
         
+        # Треки, еще не прошедшие конвейер, отменяются, резерв лимита за них возвращается
+        if track_pipeline is not None:
+            logger.info(f"Статистика конвейера треков: {track_pipeline.stats()}")
+            await track_pipeline.stop()
+        
+        await lyrics_cache.stop_prefetch()
+        
+        if maintain_task:
+            maintain_task.cancel()
+            await asyncio.gather(maintain_task, return_exceptions=True)
+        
+        # Останавливаем пул процессов скачивания
+        download_engine.shutdown()
+        
+        logger.info(f"Статистика кэша поиска: {search_cache.stats()}")
+        logger.info(f"Статистика кэша текстов песен: {lyrics_cache.stats()}")
+        logger.info(f"Статистика очереди скачивания: {download_queue.stats()}")
+        
+        # Закрываем соединения общего HTTP-клиента
+        await close_client()
+        
+        # Записываем несохраненные счетчики лимитов и закрываем соединение с БД
+        if durable_queue:
+            await download_queue.maintain()
+            await download_queue.close()
+        await quota_cache.stop()
+        await close_db()
+        
         # Закрываем сессию бота
         if bot and bot.session:
             logger.info("Закрываем сессию бота...")
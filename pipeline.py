@@ -0,0 +1,208 @@
+import time
+import asyncio
+import logging
+from dataclasses import dataclass
+from aiogram.types import Message
+
+from audio_cache import audio_cache
+from config import (
+    AUDIO_PROFILE, PIPELINE_RESOLVE_CONCURRENCY, PIPELINE_DOWNLOAD_CONCURRENCY,
+    PIPELINE_UPLOAD_CONCURRENCY, PIPELINE_QUEUE_SIZE,
+)
+from singleflight import SingleFlight
+
+logger = logging.getLogger(__name__)
+
+@dataclass
+class TrackJob:
+    """
+    Трек, проходящий стадии resolve -> download -> upload (см. TRACK_STAGES в handlers.py).
+    Стадия заполняет поля для следующей: file_id уже загруженного трека или закрепленный
+    файл в кэше.
+    """
+    message: Message
+    video_id: str
+    user_id: int
+    profile_name: str = AUDIO_PROFILE
+    flights: SingleFlight = None
+    progress_message: Message = None
+    file_id: str = None
+    file_path: str = None
+    title: str = None
+    used_profile: str = None
+
+    @property
+    def reply(self):
+        return self.message.reply if self.message.chat.type != "private" else self.message.answer
+
+    def close(self):
+        """Снимает закрепление файла в кэше; вызывается после последней стадии"""
+        if self.file_path:
+            audio_cache.release(self.file_path)
+            self.file_path = None
+
+class Stage:
+    """Стадия конвейера: ограниченная очередь и concurrency задач, выполняющих handler"""
+
+    def __init__(self, name: str, handler, concurrency: int, maxsize: int):
+        self.name = name
+        self.handler = handler
+        self.concurrency = max(1, concurrency)
+        self.queue = asyncio.Queue(maxsize=maxsize)
+        self.active = 0
+        self.processed = 0
+        self.busy_seconds = 0.0
+
+class Pipeline:
+    """
+    Граф стадий, связанных ограниченными очередями.
+
+    Обработчик стадии - корутина handler(job), которая возвращает имя следующей стадии
+    или результат задания (True/False). Каждая стадия выполняет не больше concurrency
+    заданий одновременно, поэтому отправка одного трека идет параллельно со скачиванием
+    следующего, а скачиваний одновременно не больше, чем позволяет стадия download.
+    Когда очередь следующей стадии заполнена, стадия ждет (обратное давление), а submit()
+    ждет места в первой очереди. Отмена future задания (например, отмена run()) прерывает
+    его обработчик, а следующие стадии задание пропускают.
+    """
+
+    def __init__(self, stages, queue_size: int):
+        """
+        Args:
+            stages: Список (имя, handler, concurrency); задания начинают с первой стадии
+            queue_size: Максимум заданий, ожидающих каждой стадии
+        """
+        self._stages = {name: Stage(name, handler, concurrency, queue_size) for name, handler, concurrency in stages}
+        self._first = stages[0][0]
+        self._futures = {}
+        self._handlers = {} # id(job) -> задача обработчика, выполняющего задание
+        self._tasks = []
+        self._stats_task = None
+
+    async def submit(self, job) -> asyncio.Future:
+        """Ставит задание на первую стадию. Возвращает future с результатом задания"""
+        future = asyncio.get_running_loop().create_future()
+        future.add_done_callback(lambda f, key=id(job): self._cancel_handler(key) if f.cancelled() else None)
+        self._futures[id(job)] = future
+        try:
+            await self._stages[self._first].queue.put(job)
+        except BaseException:
+            self._futures.pop(id(job), None)
+            raise
+        return future
+
+    async def run(self, job) -> bool:
+        """Выполняет задание через конвейер и дожидается результата"""
+        return await (await self.submit(job))
+
+    def _cancel_handler(self, key):
+        handler = self._handlers.get(key)
+        if handler is not None:
+            handler.cancel()
+
+    def _finish(self, job, result, cancelled: bool = False):
+        job.close()
+        future = self._futures.pop(id(job), None)
+        if future is None or future.done():
+            return
+        if cancelled:
+            future.cancel()
+        else:
+            future.set_result(result)
+
+    async def _stage_worker(self, stage: Stage):
+        while True:
+            job = await stage.queue.get()
+            future = self._futures.get(id(job))
+            if future is None or future.done():
+                # Задание отменено, пока ждало стадии
+                self._finish(job, False, cancelled=True)
+                stage.queue.task_done()
+                continue
+            stage.active += 1
+            started = time.monotonic()
+            handler = asyncio.create_task(stage.handler(job))
+            self._handlers[id(job)] = handler
+            try:
+                try:
+                    await asyncio.wait((handler,))
+                finally:
+                    self._handlers.pop(id(job), None)
+                    if not handler.done():
+                        # Конвейер останавливается
+                        handler.cancel()
+                        await asyncio.gather(handler, return_exceptions=True)
+                if handler.cancelled():
+                    self._finish(job, False, cancelled=True)
+                    continue
+                result = handler.result()
+                if isinstance(result, str):
+                    await self._stages[result].queue.put(job)
+                else:
+                    self._finish(job, bool(result))
+            except asyncio.CancelledError:
+                self._finish(job, False, cancelled=True)
+                raise
+            except Exception as e:
+                logger.error(f"Стадия {stage.name}: ошибка при обработке {job.video_id}: {e}", exc_info=True)
+                self._finish(job, False)
+            finally:
+                stage.active -= 1
+                stage.processed += 1
+                stage.busy_seconds += time.monotonic() - started
+                stage.queue.task_done()
+
+    async def _stats_loop(self, interval: float):
+        while True:
+            await asyncio.sleep(interval)
+            if self._futures:
+                logger.info(f"Конвейер треков: в работе {len(self._futures)}, стадии {self.depths()}")
+
+    def start(self, stats_interval: float = 0):
+        """Запускает обработчики стадий; stats_interval > 0 - периодически писать глубину очередей в лог"""
+        if self._tasks:
+            return
+        for stage in self._stages.values():
+            self._tasks.extend(asyncio.create_task(self._stage_worker(stage)) for _ in range(stage.concurrency))
+        if stats_interval > 0:
+            self._stats_task = asyncio.create_task(self._stats_loop(stats_interval))
+        logger.info("Конвейер треков запущен: " + ", ".join(f"{stage.name} x{stage.concurrency}" for stage in self._stages.values()))
+
+    async def stop(self):
+        tasks = self._tasks + ([self._stats_task] if self._stats_task else [])
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self._tasks = []
+        self._stats_task = None
+        # Задания, не дошедшие до обработчиков, завершаются отменой
+        for stage in self._stages.values():
+            while not stage.queue.empty():
+                self._finish(stage.queue.get_nowait(), False, cancelled=True)
+
+    def depths(self) -> dict:
+        """Для каждой стадии: сколько заданий ждет в очереди и сколько выполняется"""
+        return {name: {'queued': stage.queue.qsize(), 'active': stage.active} for name, stage in self._stages.items()}
+
+    def in_flight(self) -> int:
+        return len(self._futures)
+
+    def stats(self) -> dict:
+        return {
+            name: {
+                'queued': stage.queue.qsize(),
+                'active': stage.active,
+                'processed': stage.processed,
+                'avg_seconds': round(stage.busy_seconds / stage.processed, 2) if stage.processed else None,
+            }
+            for name, stage in self._stages.items()
+        }
+
+def create_track_pipeline(stages) -> Pipeline:
+    """Конвейер трека из стадий handlers.TRACK_STAGES с ограничениями из config.py"""
+    concurrency = {
+        'resolve': PIPELINE_RESOLVE_CONCURRENCY,
+        'download': PIPELINE_DOWNLOAD_CONCURRENCY,
+        'upload': PIPELINE_UPLOAD_CONCURRENCY,
+    }
+    return Pipeline([(name, handler, concurrency[name]) for name, handler in stages], PIPELINE_QUEUE_SIZE)
@@ -0,0 +1,155 @@
+import time
+import asyncio
+import logging
+from datetime import datetime, timedelta
+
+from config import QUOTA_FLUSH_INTERVAL
+from database import load_user_downloads, save_user_downloads_batch
+
+logger = logging.getLogger(__name__)
+
+class QuotaCache:
+    """
+    Дневные счетчики скачиваний в памяти перед таблицей user_limits.
+
+    Проверки и резервирование лимита выполняются без обращения к БД: строка
+    пользователя читается один раз, а измененные счетчики записываются пачкой
+    раз в flush_interval секунд и при остановке бота. Смена дня определяется
+    сравнением строки даты, которая пересчитывается раз в сутки.
+
+    Атомарность reserve() гарантирована только внутри одного процесса: в БД
+    записываются абсолютные значения счетчиков, и два процесса с общей БД
+    пропустили бы лишние скачивания и перезаписали счетчики друг друга. Поэтому
+    лимит резервирует только процесс бота (Telegram отдает обновления одному
+    получателю getUpdates), а worker.py расходует заранее выданный PrepaidQuota.
+    """
+
+    def __init__(self, flush_interval: float = QUOTA_FLUSH_INTERVAL):
+        self.flush_interval = flush_interval
+        self._counters = {} # user_id -> [дата 'YYYY-MM-DD', скачиваний за эту дату]
+        self._dirty = set()
+        self._today = None
+        self._next_day_at = 0.0
+        self._flush_task = None
+
+    def _current_day(self) -> str:
+        now = time.time()
+        if now >= self._next_day_at:
+            today = datetime.now()
+            self._today = today.strftime('%Y-%m-%d')
+            tomorrow = (today + timedelta(days=1)).replace(hour=0, minute=0, second=0, microsecond=0)
+            self._next_day_at = tomorrow.timestamp()
+        return self._today
+
+    async def _get_entry(self, user_id: int):
+        entry = self._counters.get(user_id)
+        if entry is None:
+            row = await load_user_downloads(user_id)
+            # Пока шел запрос к БД, запись могла появиться из параллельного вызова
+            entry = self._counters.get(user_id)
+            if entry is None:
+                downloads, day = row if row else (0, None)
+                entry = self._counters[user_id] = [day, downloads or 0]
+        today = self._current_day()
+        if entry[0] != today:
+            entry[0], entry[1] = today, 0
+        return entry
+
+    async def get_downloads(self, user_id: int):
+        """Возвращает количество скачиваний пользователя за сегодня или None при ошибке БД."""
+        try:
+            return (await self._get_entry(user_id))[1]
+        except Exception as e:
+            logger.error(f"Ошибка при получении счетчика пользователя {user_id}: {e}")
+            return None
+
+    async def can_download(self, user_id: int, limit: int = 5) -> bool:
+        """Проверяет, может ли пользователь скачать еще один трек."""
+        downloads_today = await self.get_downloads(user_id)
+        if downloads_today is None:
+            return False
+        return downloads_today < limit
+
+    async def reserve(self, user_id: int, limit: int = 5) -> bool:
+        """
+        Резервирует одно скачивание из дневного лимита. Проверка и увеличение счетчика
+        выполняются без переключения цикла событий, поэтому параллельные задачи не превысят лимит.
+        """
+        try:
+            entry = await self._get_entry(user_id)
+        except Exception as e:
+            logger.error(f"Ошибка при резервировании скачивания для пользователя {user_id}: {e}")
+            return False
+        if entry[1] >= limit:
+            return False
+        entry[1] += 1
+        self._dirty.add(user_id)
+        logger.info(f"Для пользователя {user_id} зарезервировано скачивание ({entry[1]}/{limit}).")
+        return True
+
+    def release(self, user_id: int):
+        """Возвращает зарезервированное скачивание, если оно не состоялось."""
+        entry = self._counters.get(user_id)
+        if entry and entry[0] == self._current_day() and entry[1] > 0:
+            entry[1] -= 1
+            self._dirty.add(user_id)
+            logger.info(f"Резерв скачивания для пользователя {user_id} возвращен.")
+
+    async def flush(self):
+        """Записывает измененные счетчики в БД одной транзакцией."""
+        if not self._dirty:
+            return
+        dirty, self._dirty = self._dirty, set()
+        rows = [(user_id, self._counters[user_id][1], self._counters[user_id][0]) for user_id in dirty]
+        try:
+            await save_user_downloads_batch(rows)
+            logger.debug(f"Счетчики скачиваний записаны в БД: {len(rows)} пользователей")
+        except Exception as e:
+            logger.error(f"Ошибка при записи счетчиков скачиваний в БД: {e}")
+            self._dirty |= dirty
+            return
+        # Записи за прошедшие дни больше не нужны в памяти
+        today = self._current_day()
+        for user_id in [uid for uid, entry in self._counters.items() if entry[0] != today and uid not in self._dirty]:
+            del self._counters[user_id]
+
+    async def _flush_loop(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            await self.flush()
+
+    def start(self):
+        if self._flush_task is None:
+            self._flush_task = asyncio.create_task(self._flush_loop())
+
+    async def stop(self):
+        if self._flush_task is not None:
+            self._flush_task.cancel()
+            try:
+                await self._flush_task
+            except asyncio.CancelledError:
+                pass
+            self._flush_task = None
+        await self.flush()
+
+class PrepaidQuota:
+    """
+    Лимит, заранее зарезервированный процессом бота для одного задания из общей очереди
+    (job_queue). Используется вместо quota_cache там, где задание выполняет другой процесс:
+    reserve/release только расходуют и возвращают предоплаченные слоты, а то, что осталось
+    в slots после выполнения, процесс бота возвращает пользователю.
+    """
+
+    def __init__(self, slots: int):
+        self.slots = slots
+
+    async def reserve(self, user_id: int, limit: int = 5) -> bool:
+        if self.slots <= 0:
+            return False
+        self.slots -= 1
+        return True
+
+    def release(self, user_id: int):
+        self.slots += 1
+
+quota_cache = QuotaCache()
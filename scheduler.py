@@ -0,0 +1,224 @@
+import math
+import time
+import asyncio
+import logging
+from collections import OrderedDict, deque
+
+logger = logging.getLogger(__name__)
+
+class QueueRejected(asyncio.QueueFull):
+    """
+    Задача не принята в очередь.
+
+    reason: 'full' - очередь заполнена, 'user_limit' - у пользователя слишком много задач
+    в очереди, 'duplicate' - этот трек пользователя уже ждет в очереди, 'overloaded' -
+    ожидание превысило бы max_wait, 'quota' - не удалось зарезервировать дневной лимит
+    (только JobStore). eta - оценка ожидания в секундах на момент отказа.
+    """
+
+    def __init__(self, reason: str, eta: float = 0.0):
+        super().__init__(reason)
+        self.reason = reason
+        self.eta = eta
+
+class FairQueue:
+    """
+    Очередь скачивания со справедливым обслуживанием пользователей.
+
+    Вместо общего FIFO у каждого пользователя своя подочередь, а воркеры берут задачи
+    по кругу: по одной от каждого пользователя, у которого что-то ждет. Дешевые задачи
+    (трек уже есть в кэше) идут вне очереди через приоритетную полосу. Интерфейс совместим
+    с asyncio.Queue: put/put_nowait/get/task_done/qsize.
+
+    Постановка в очередь никогда не ждет: задача либо принимается, либо сразу отклоняется
+    с QueueRejected (подкласс asyncio.QueueFull) - при переполнении, при user_limit задачах
+    пользователя в очереди, при повторе того же video_id от того же пользователя и когда
+    оценка ожидания больше max_wait секунд (0 - без ограничения).
+    """
+
+    def __init__(self, maxsize: int = 0, workers: int = 1, initial_job_seconds: float = 20.0,
+                 user_limit: int = 0, max_wait: float = 0):
+        self.maxsize = maxsize
+        self.workers = max(1, workers)
+        self.user_limit = user_limit
+        self.max_wait = max_wait
+        self._priority = deque()
+        self._users = OrderedDict() # user_id -> deque задач; первый ключ обслуживается следующим
+        self._size = 0
+        self._user_counts = {} # user_id -> задач в очереди, включая приоритетную полосу
+        self._keys = set() # (user_id, video_id) ожидающих треков
+        self.rejected = {}
+        self._available = asyncio.Semaphore(0)
+        self._started = {} # задача воркера -> время, когда она взяла задание
+        self._avg_job_seconds = initial_job_seconds
+        self._unfinished = 0
+        self._all_done = asyncio.Event()
+        self._all_done.set()
+
+    @staticmethod
+    def _user_of(item):
+        user_id = getattr(item, 'user_id', None)
+        if user_id is None and isinstance(item, tuple):
+            user_id = item[-1]
+        return user_id
+
+    @staticmethod
+    def _key_of(item):
+        """(user_id, video_id) для задач-кортежей (message, video_id, user_id), иначе None"""
+        if isinstance(item, tuple) and len(item) >= 3:
+            return item[-1], item[1]
+        return None
+
+    def qsize(self) -> int:
+        return self._size
+
+    def empty(self) -> bool:
+        return self._size == 0
+
+    def full(self) -> bool:
+        return 0 < self.maxsize <= self._size
+
+    def _reject(self, reason: str, eta: float = 0.0):
+        self.rejected[reason] = self.rejected.get(reason, 0) + 1
+        raise QueueRejected(reason, eta)
+
+    async def check(self, user_id, key=None, priority: bool = False):
+        """
+        Проверяет, будет ли принята задача пользователя, ничего не добавляя в очередь.
+        Позволяет отказать до дорогой подготовки задачи.
+
+        Raises:
+            QueueRejected: Если задача не прошла бы проверки
+        """
+        self._check(user_id, key, priority)
+
+    def _check(self, user_id, key, priority: bool):
+        if key is not None and key in self._keys:
+            self._reject('duplicate', self.eta(self.user_position(user_id) or 1))
+        if self.user_limit and self._user_counts.get(user_id, 0) >= self.user_limit:
+            self._reject('user_limit', self.eta(self.user_position(user_id) or 1))
+        if self.full():
+            self._reject('full', self.eta(self._size + 1))
+        if self.max_wait and not priority:
+            # Задачи из кэша выполняются почти мгновенно и под ограничение ожидания не попадают
+            user_queue = self._users.get(user_id)
+            eta = self.eta(self._position(user_id, len(user_queue) if user_queue else 0))
+            if eta > self.max_wait:
+                self._reject('overloaded', eta)
+
+    def put_nowait(self, item, priority: bool = False, force: bool = False) -> int:
+        """
+        Добавляет задачу и возвращает ее позицию (с 1) в порядке выдачи воркерам.
+        При force проверки не выполняются (возврат задачи в очередь при остановке воркера).
+
+        Raises:
+            QueueRejected: Если задача не прошла проверки
+        """
+        user_id, key = self._user_of(item), self._key_of(item)
+        if not force:
+            self._check(user_id, key, priority)
+        if priority:
+            self._priority.append(item)
+            position = len(self._priority)
+        else:
+            user_queue = self._users.setdefault(user_id, deque())
+            user_queue.append(item)
+            position = self._position(user_id, len(user_queue) - 1)
+        self._user_counts[user_id] = self._user_counts.get(user_id, 0) + 1
+        if key is not None:
+            self._keys.add(key)
+        self._size += 1
+        self._unfinished += 1
+        self._all_done.clear()
+        self._available.release()
+        return position
+
+    async def put(self, item, priority: bool = False) -> int:
+        return self.put_nowait(item, priority)
+
+    def _forget(self, item):
+        user_id = self._user_of(item)
+        count = self._user_counts.get(user_id, 0) - 1
+        if count > 0:
+            self._user_counts[user_id] = count
+        else:
+            self._user_counts.pop(user_id, None)
+        self._keys.discard(self._key_of(item))
+
+    def get_nowait(self):
+        if self._size == 0:
+            raise asyncio.QueueEmpty
+        if self._priority:
+            item = self._priority.popleft()
+        else:
+            user_id, user_queue = next(iter(self._users.items()))
+            item = user_queue.popleft()
+            if user_queue:
+                self._users.move_to_end(user_id) # Следующая задача пользователя - в следующем круге
+            else:
+                del self._users[user_id]
+        self._size -= 1
+        self._forget(item)
+        return item
+
+    async def get(self):
+        await self._available.acquire()
+        item = self.get_nowait()
+        task = asyncio.current_task()
+        if task is not None:
+            self._started[task] = time.monotonic()
+        return item
+
+    def task_done(self):
+        started = self._started.pop(asyncio.current_task(), None)
+        if started is not None:
+            # Скользящее среднее длительности задания для оценки времени ожидания
+            self._avg_job_seconds = 0.8 * self._avg_job_seconds + 0.2 * (time.monotonic() - started)
+        if self._unfinished <= 0:
+            raise ValueError("task_done() called too many times")
+        self._unfinished -= 1
+        if self._unfinished == 0:
+            self._all_done.set()
+
+    async def join(self):
+        await self._all_done.wait()
+
+    def _position(self, user_id, index: int) -> int:
+        """
+        Позиция задачи с номером index в подочереди пользователя: сначала вся приоритетная
+        полоса, затем index полных кругов, затем пользователи перед ним в текущем круге.
+        """
+        position = len(self._priority)
+        before = True
+        for other_id, other_queue in self._users.items():
+            if other_id == user_id:
+                position += index
+                before = False
+                continue
+            position += min(len(other_queue), index)
+            if before and len(other_queue) > index:
+                position += 1
+        return position + 1
+
+    def user_position(self, user_id) -> int:
+        """Позиция ближайшей задачи пользователя или 0, если у него ничего не ждет"""
+        return self._position(user_id, 0) if self._users.get(user_id) else 0
+
+    def eta(self, position: int) -> float:
+        """Примерное время (в секундах) до готовности задачи на указанной позиции"""
+        return math.ceil(position / self.workers) * self._avg_job_seconds
+
+    def stats(self) -> dict:
+        return {
+            'size': self._size,
+            'priority': len(self._priority),
+            'users': len(self._users),
+            'avg_job_seconds': round(self._avg_job_seconds, 1),
+            'rejected': dict(self.rejected),
+        }
+
+def format_eta(seconds: float) -> str:
+    """Форматирует оценку ожидания для сообщений пользователю"""
+    if seconds < 60:
+        return f"~{max(1, int(seconds))} сек."
+    return f"~{math.ceil(seconds / 60)} мин."
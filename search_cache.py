@@ -0,0 +1,135 @@
+import re
+import json
+import logging
+from cachetools import TTLCache
+
+from config import SEARCH_CACHE_SIZE, SEARCH_CACHE_TTL, SEARCH_CACHE_PERSISTENT
+from database import load_cached_search, save_cached_search, purge_cached_searches
+from utils import search_youtube
+
+logger = logging.getLogger(__name__)
+
+_DASHES_RE = re.compile(r'\s*[-–—]\s*')
+_SPACES_RE = re.compile(r'\s+')
+
+class SearchCache:
+    """
+    Общий для всех пользователей кэш результатов поиска YouTube.
+
+    Ключ - нормализованный запрос без ID пользователя. Первый уровень - TTLCache
+    в памяти (срок жизни + вытеснение давно не использованных записей), второй
+    уровень - таблица search_cache в SQLite, чтобы кэш оставался теплым после перезапуска.
+    """
+
+    def __init__(self, maxsize: int, ttl: float, persistent: bool = True):
+        self.ttl = ttl
+        self.persistent = persistent
+        self._memory = TTLCache(maxsize=maxsize, ttl=ttl)
+        self.hits = 0
+        self.persistent_hits = 0
+        self.prefix_hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def normalize(query: str) -> str:
+        """Приводит запрос к единому виду: регистр, пробелы и разные тире не влияют на ключ"""
+        query = _DASHES_RE.sub(' - ', query.strip().casefold())
+        return _SPACES_RE.sub(' ', query)
+
+    async def get(self, query: str, limit: int):
+        """
+        Возвращает не более limit закэшированных результатов или None.
+        Промах не засчитывается: search() сначала пробует еще и get_by_prefix()
+        """
+        key = self.normalize(query)
+        entry = self._memory.get(key)
+        from_db = False
+        if entry is None and self.persistent:
+            row = await load_cached_search(key, self.ttl)
+            if row:
+                results_json, fetched_limit = row
+                entry = (json.loads(results_json), fetched_limit)
+                self._memory[key] = entry
+                from_db = True
+        # Результаты, полученные с меньшим лимитом, подходят, только если YouTube больше ничего не вернул
+        if entry is not None:
+            results, fetched_limit = entry
+            if fetched_limit >= limit or len(results) < fetched_limit:
+                self.hits += 1
+                if from_db:
+                    self.persistent_hits += 1
+                return results[:limit]
+        return None
+
+    def get_by_prefix(self, query: str, limit: int, min_prefix: int = 3):
+        """
+        Ищет в памяти результаты более короткого запроса, с которого начинается query
+        (пользователь продолжает набирать текст), и оставляет из них те, где встречаются
+        все слова query. Возвращает список, только если набралось limit результатов.
+        """
+        key = self.normalize(query)
+        words = key.split()
+        if not words:
+            return None
+        for end in range(len(key) - 1, min_prefix - 1, -1):
+            entry = self._memory.get(key[:end].rstrip())
+            if entry is None:
+                continue
+            matched = [
+                result for result in entry[0]
+                if all(word in f"{result.get('title', '')} {result.get('uploader', '')}".casefold() for word in words)
+            ]
+            if len(matched) >= limit:
+                self.prefix_hits += 1
+                return matched[:limit]
+            # Более короткие префиксы дадут еще менее точные результаты
+            return None
+        return None
+
+    async def put(self, query: str, limit: int, results: list):
+        key = self.normalize(query)
+        self._memory[key] = (results, limit)
+        if self.persistent:
+            await save_cached_search(key, json.dumps(results, ensure_ascii=False), limit)
+
+    async def search(self, query: str, limit: int = 5, prefix_limit: int = 0):
+        """
+        Ищет на YouTube с использованием кэша. Пустые результаты не кэшируются.
+
+        Args:
+            prefix_limit: Если больше 0, при промахе подходят и результаты более короткого
+                запроса-префикса, если среди них есть prefix_limit совпадений (инлайн-режим)
+        """
+        results = await self.get(query, limit)
+        if results is not None:
+            logger.info(f"Результаты для '{query}' взяты из кэша.")
+            return results
+        if prefix_limit:
+            results = self.get_by_prefix(query, prefix_limit)
+            if results is not None:
+                logger.info(f"Результаты для '{query}' взяты из кэша более короткого запроса.")
+                return results
+        self.misses += 1
+        logger.info(f"Выполняю поиск на YouTube: {query}")
+        results = await search_youtube(query, limit)
+        if results:
+            await self.put(query, limit, results)
+        return results
+
+    async def purge_expired(self):
+        """Удаляет устаревшие записи второго уровня"""
+        if self.persistent:
+            await purge_cached_searches(self.ttl)
+
+    def stats(self) -> dict:
+        total = self.hits + self.prefix_hits + self.misses
+        return {
+            'size': len(self._memory),
+            'hits': self.hits,
+            'persistent_hits': self.persistent_hits,
+            'prefix_hits': self.prefix_hits,
+            'misses': self.misses,
+            'hit_rate': round((self.hits + self.prefix_hits) / total, 3) if total else 0.0,
+        }
+
+search_cache = SearchCache(SEARCH_CACHE_SIZE, SEARCH_CACHE_TTL, SEARCH_CACHE_PERSISTENT)
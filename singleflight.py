@@ -0,0 +1,41 @@
+import asyncio
+import logging
+
+logger = logging.getLogger(__name__)
+
+class SingleFlight:
+    """
+    Объединяет одновременные вызовы с одинаковым ключом в одно выполнение.
+
+    Первый вызов запускает задачу, остальные присоединяются к ней и получают
+    тот же результат (или то же исключение). Задача выполняется отдельно от
+    вызывающих, поэтому отмена одного из них не прерывает работу для остальных.
+    """
+
+    def __init__(self, name: str = "singleflight"):
+        self.name = name
+        self._flights = {}
+
+    def __contains__(self, key) -> bool:
+        return key in self._flights
+
+    def __len__(self) -> int:
+        return len(self._flights)
+
+    async def run(self, key, func, *args):
+        """Выполняет await func(*args) или присоединяется к уже идущему выполнению с тем же ключом."""
+        task = self._flights.get(key)
+        if task is None:
+            task = asyncio.create_task(func(*args))
+            self._flights[key] = task
+            task.add_done_callback(lambda t: self._on_done(key, t))
+        else:
+            logger.info(f"{self.name}: запрос {key} присоединен к уже выполняющейся задаче")
+        return await asyncio.shield(task)
+
+    def _on_done(self, key, task: asyncio.Task):
+        if self._flights.get(key) is task:
+            del self._flights[key]
+        # Помечаем исключение как полученное, даже если все ожидающие были отменены
+        if not task.cancelled():
+            task.exception()
@@ -0,0 +1,159 @@
+import re
+import logging
+import threading
+import spotipy
+from cachetools import TTLCache
+from spotipy.cache_handler import MemoryCacheHandler
+from spotipy.oauth2 import SpotifyClientCredentials
+
+from config import SPOTIFY_CLIENT_ID, SPOTIFY_CLIENT_SECRET, SPOTIFY_CACHE_SIZE, SPOTIFY_CACHE_TTL
+
+logger = logging.getLogger(__name__)
+
+# Spotify отдает не больше 50 треков за один запрос /tracks
+TRACKS_BATCH_SIZE = 50
+
+# open.spotify.com/track/<id>, open.spotify.com/intl-de/track/<id>?si=... и spotify:track:<id>
+_TRACK_ID_RE = re.compile(r'(?:spotify\.com/(?:intl-[\w-]+/)?track/|spotify:track:)([0-9A-Za-z]{22})')
+# То же для плейлистов и альбомов
+_COLLECTION_RE = re.compile(r'(?:spotify\.com/(?:intl-[\w-]+/)?|spotify:)(playlist|album)[/:]([0-9A-Za-z]{22})')
+
+class SpotifyError(Exception):
+    """Ошибка при работе с Spotify API"""
+    pass
+
+class SpotifyResolver:
+    """
+    Преобразует треки Spotify в поисковые запросы вида "артисты - название".
+
+    Клиент создается один раз: токен client credentials хранится в памяти и
+    обновляется spotipy незадолго до истечения, а не запрашивается на каждую ссылку.
+    Запросы по нескольким трекам выполняются пачками по TRACKS_BATCH_SIZE,
+    готовые строки хранятся в TTLCache. Методы синхронные и вызываются через asyncio.to_thread.
+    """
+
+    def __init__(self, maxsize: int, ttl: float):
+        self._client = None
+        self._memory = TTLCache(maxsize=maxsize, ttl=ttl)
+        self._lock = threading.Lock()
+
+    def _get_client(self):
+        if not SPOTIFY_CLIENT_ID or not SPOTIFY_CLIENT_SECRET:
+            raise SpotifyError("Не настроены ключи Spotify API. Проверьте .env файл.")
+        with self._lock:
+            if self._client is None:
+                self._client = spotipy.Spotify(auth_manager=SpotifyClientCredentials(
+                    client_id=SPOTIFY_CLIENT_ID,
+                    client_secret=SPOTIFY_CLIENT_SECRET,
+                    cache_handler=MemoryCacheHandler(),
+                ))
+            return self._client
+
+    @staticmethod
+    def parse_track_id(url: str):
+        """Извлекает ID трека из ссылки Spotify или None"""
+        match = _TRACK_ID_RE.search(url)
+        return match.group(1) if match else None
+
+    @staticmethod
+    def parse_collection(url: str):
+        """Возвращает ('playlist' | 'album', ID) для ссылки на плейлист или альбом или None"""
+        match = _COLLECTION_RE.search(url)
+        return (match.group(1), match.group(2)) if match else None
+
+    @staticmethod
+    def format_track(track: dict) -> str:
+        artists = ", ".join(artist['name'] for artist in track['artists'])
+        return f"{artists} - {track['name']}"
+
+    def tracks(self, track_ids):
+        """
+        Возвращает словарь track_id -> "артисты - название".
+        Треки, которых нет в кэше, запрашиваются пачками по TRACKS_BATCH_SIZE;
+        несуществующие треки в результат не попадают.
+        """
+        result = {}
+        missing = []
+        with self._lock:
+            for track_id in dict.fromkeys(track_ids):
+                query = self._memory.get(track_id)
+                if query is None:
+                    missing.append(track_id)
+                else:
+                    result[track_id] = query
+        cached = len(result)
+
+        if missing:
+            client = self._get_client()
+            for start in range(0, len(missing), TRACKS_BATCH_SIZE):
+                batch = missing[start:start + TRACKS_BATCH_SIZE]
+                try:
+                    response = client.tracks(batch)
+                except Exception as e:
+                    logger.error(f"Ошибка при получении информации из Spotify: {e}")
+                    raise SpotifyError(f"Ошибка при получении данных из Spotify: {str(e)}")
+                # Ответ идет в порядке запроса, на месте несуществующих треков - None
+                with self._lock:
+                    for track_id, track in zip(batch, response.get('tracks', [])):
+                        if track:
+                            result[track_id] = self._memory[track_id] = self.format_track(track)
+            logger.info(f"Spotify: запрошено треков {len(missing)}, взято из кэша {cached}")
+        return result
+
+    def track_query(self, track_url: str) -> str:
+        """Возвращает поисковый запрос для ссылки на трек Spotify"""
+        track_id = self.parse_track_id(track_url)
+        if not track_id:
+            raise SpotifyError("Ссылка Spotify не указывает на трек.")
+        query = self.tracks([track_id]).get(track_id)
+        if query is None:
+            raise SpotifyError("Трек не найден в Spotify.")
+        return query
+
+    def collection_tracks(self, kind: str, collection_id: str, limit: int):
+        """
+        Возвращает название плейлиста или альбома и до limit треков в виде словарей
+        с ключами id, artist, title, query. Страницы запрашиваются по 100 (плейлист)
+        или 50 (альбом) треков, попутно заполняется кэш track_id -> запрос.
+        """
+        client = self._get_client()
+        try:
+            if kind == 'album':
+                album = client.album(collection_id)
+                name, page = album['name'], album['tracks']
+            else:
+                name = client.playlist(collection_id, fields='name')['name']
+                page = client.playlist_items(
+                    collection_id, limit=100, additional_types=('track',),
+                    fields='items(track(id,name,artists(name))),next',
+                )
+
+            tracks = []
+            while page and len(tracks) < limit:
+                for item in page['items']:
+                    # Элементы плейлиста обернуты в {'track': ...}, локальные файлы и удаленные треки пропускаем
+                    track = item.get('track', item) if kind == 'playlist' else item
+                    if not track or not track.get('id'):
+                        continue
+                    query = self.format_track(track)
+                    tracks.append({
+                        'id': track['id'],
+                        'artist': ", ".join(artist['name'] for artist in track['artists']),
+                        'title': track['name'],
+                        'query': query,
+                    })
+                    with self._lock:
+                        self._memory[track['id']] = query
+                    if len(tracks) >= limit:
+                        break
+                page = client.next(page) if page.get('next') and len(tracks) < limit else None
+        except SpotifyError:
+            raise
+        except Exception as e:
+            logger.error(f"Ошибка при получении {kind} {collection_id} из Spotify: {e}")
+            raise SpotifyError(f"Ошибка при получении данных из Spotify: {str(e)}")
+
+        logger.info(f"Spotify: {kind} '{name}' - получено треков {len(tracks)}")
+        return name, tracks
+
+spotify = SpotifyResolver(SPOTIFY_CACHE_SIZE, SPOTIFY_CACHE_TTL)
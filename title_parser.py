@@ -0,0 +1,177 @@
+import re
+import logging
+from functools import lru_cache
+from typing import NamedTuple, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Сравнение имени с написанием в скобках выполняется по расстоянию Левенштейна, если пакет установлен
+try:
+    from Levenshtein import distance as levenshtein_distance
+except ImportError:
+    levenshtein_distance = None
+
+# "Исполнитель - Трек" с любым из тире: -, – или —. Дефис без пробела хотя бы с одной
+# стороны считается частью имени (Jay-Z, a-ha)
+ARTIST_TITLE_RE = re.compile(r'^(.+?)\s*(?:(?<=\s)-|-(?=\s)|[–—])\s*(.+)$')
+# (feat. ...), [ft. ...], featuring ... и "Artist1 with Artist2"
+FEAT_PATTERNS = (
+    re.compile(r'(?:\(|\[)?\b(?:feat|ft|featuring)\b\.?\s+([^)\]]+)(?:\)|\])?', re.IGNORECASE),
+    re.compile(r'(?:\s+|\()with\s+([^)\]]+)', re.IGNORECASE),
+)
+ARTIST_SEPARATORS_RE = re.compile(r',\s*|\s+&\s+')
+PARENTHESES_RE = re.compile(r'\([^)]*\)')
+ARTIST_ALIAS_RE = re.compile(r'^([^(]+)\s*\([^)]*\)$')
+
+class ParsedTitle(NamedTuple):
+    """Результат разбора строки "Исполнитель - Трек" """
+    artist: Optional[str]  # Основной исполнитель без фитов или None, если не удалось выделить
+    title: str
+    featured: Tuple[str, ...] = ()
+
+    @property
+    def performer(self) -> Optional[str]:
+        """Исполнитель вместе с приглашенными артистами"""
+        if not self.artist or not self.featured:
+            return self.artist
+        return f"{self.artist} feat. {', '.join(self.featured)}"
+
+@lru_cache(maxsize=8192)
+def split_artist_title(text: str):
+    """Делит строку по первому тире. Возвращает (исполнитель, трек) или None"""
+    match = ARTIST_TITLE_RE.match(text or '')
+    if not match:
+        return None
+    return match.group(1).strip(), match.group(2).strip()
+
+def clean_track_name(track_name: str) -> str:
+    """Убирает уточнения в круглых скобках: (Official Video), (feat. ...) и т.п."""
+    return PARENTHESES_RE.sub('', track_name or '').strip()
+
+def _featured_from(match) -> list:
+    return [artist.strip() for artist in ARTIST_SEPARATORS_RE.split(match.group(1).strip()) if artist.strip()]
+
+@lru_cache(maxsize=8192)
+def split_featured(artist_string: str, title_string: str = '') -> Tuple[str, Tuple[str, ...]]:
+    """
+    Выделяет основного исполнителя и приглашенных артистов.
+    Фиты ищутся сначала в строке исполнителя, затем в названии трека.
+
+    Returns:
+        (str, tuple): Основной исполнитель и кортеж приглашенных артистов
+    """
+    main_artist = artist_string
+    featured = []
+
+    for pattern in FEAT_PATTERNS:
+        match = pattern.search(artist_string)
+        if match:
+            main_artist = artist_string[:match.start()].strip()
+            featured = _featured_from(match)
+            break
+
+    if not featured:
+        for pattern in FEAT_PATTERNS:
+            match = pattern.search(title_string)
+            if match:
+                main_artist = artist_string.strip()
+                featured = _featured_from(match)
+                break
+
+    # "Artist (ARTIST)" -> "Artist", если в скобках то же имя в похожем написании
+    # (транслитерацию вроде "МУККА (MUKKA)" так не распознать)
+    alias_match = ARTIST_ALIAS_RE.match(main_artist)
+    if alias_match and not any(kw in main_artist.lower() for kw in ('band', 'official', 'feat', 'ft')):
+        name = alias_match.group(1).strip()
+        alias = main_artist[alias_match.end(1):].strip().strip('()')
+        if levenshtein_distance is not None:
+            if levenshtein_distance(name.lower(), alias.lower()) < len(name) * 0.5:
+                main_artist = name
+        elif name.lower() in alias.lower():
+            main_artist = name
+
+    main_lower = main_artist.lower()
+    result = []
+    for artist in dict.fromkeys(featured):
+        artist_lower = artist.lower()
+        if artist_lower != main_lower and main_lower not in artist_lower and artist_lower not in main_lower:
+            result.append(artist)
+    return main_artist.strip(), tuple(result)
+
+@lru_cache(maxsize=8192)
+def parse_title(text: str, min_artist_len: int = 3, max_artist_words: int = 4) -> ParsedTitle:
+    """
+    Разбирает название видео или трека вида "Исполнитель feat. X - Трек (feat. Y)".
+
+    Часть до тире считается исполнителем, только если основной исполнитель (без фитов)
+    не короче min_artist_len символов и не длиннее max_artist_words слов, чтобы не принять
+    часть названия за исполнителя.
+    """
+    split = split_artist_title(text)
+    if split is None:
+        return ParsedTitle(None, text)
+    artist, title = split
+    main_artist, featured = split_featured(artist, title)
+    main_artist = main_artist or artist
+    if len(main_artist) < min_artist_len or len(main_artist.split()) > max_artist_words:
+        return ParsedTitle(None, text)
+    return ParsedTitle(main_artist, title, featured)
+
+def cache_info() -> dict:
+    return {
+        'split_artist_title': split_artist_title.cache_info()._asdict(),
+        'split_featured': split_featured.cache_info()._asdict(),
+        'parse_title': parse_title.cache_info()._asdict(),
+    }
+
+def _clear_caches():
+    split_artist_title.cache_clear()
+    split_featured.cache_clear()
+    parse_title.cache_clear()
+
+if __name__ == "__main__":
+    # Точность и скорость разбора на корпусе реальных названий:
+    # python title_parser.py [fixtures/titles.json]
+    import os
+    import sys
+    import json
+    import time
+
+    path = sys.argv[1] if len(sys.argv) > 1 else os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures', 'titles.json')
+    with open(path, encoding='utf-8') as f:
+        corpus = json.load(f)
+
+    # known_fail - известные неразобранные названия (например, транслитерация в скобках):
+    # они не считаются ошибкой, но о неожиданно верном разборе сообщается
+    errors = known = fixed = 0
+    for case in corpus:
+        parsed = parse_title(case['text'])
+        expected = ParsedTitle(case['artist'], case['title'], tuple(case.get('featured', ())))
+        if case.get('known_fail'):
+            known += 1
+            if parsed == expected:
+                fixed += 1
+                print(f"  ИСПРАВЛЕНО: {case['text']!r} разбирается верно, уберите known_fail")
+        elif parsed != expected:
+            errors += 1
+            print(f"  ОШИБКА: {case['text']!r}\n    ожидалось {tuple(expected)}\n    получено  {tuple(parsed)}")
+    checked = len(corpus) - known
+    print(f"{path}: {len(corpus)} названий, проверено {checked}, верно {checked - errors}, ошибок {errors}, известных промахов {known - fixed}")
+
+    texts = [case['text'] for case in corpus]
+    runs = 200
+    _clear_caches()
+    started = time.perf_counter()
+    for _ in range(runs):
+        _clear_caches()
+        for text in texts:
+            parse_title(text)
+    cold_us = (time.perf_counter() - started) / (runs * len(texts)) * 1e6
+    started = time.perf_counter()
+    for _ in range(runs):
+        for text in texts:
+            parse_title(text)
+    warm_us = (time.perf_counter() - started) / (runs * len(texts)) * 1e6
+    print(f"Без кэша: {cold_us:.2f} мкс/название, из кэша: {warm_us:.2f} мкс/название")
+    print(f"Levenshtein: {'да' if levenshtein_distance is not None else 'нет'}")
+    sys.exit(1 if errors else 0)
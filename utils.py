@@ -1,19 +1,20 @@
 import os
 import re
-import uuid
+import asyncio
 import yt_dlp
-import spotipy
 import tempfile
-import json
-import requests
-import concurrent.futures
-from spotipy.oauth2 import SpotifyClientCredentials
+import threading
 import time
-from config import SPOTIFY_CLIENT_ID, SPOTIFY_CLIENT_SECRET, DOWNLOADS_DIR, GENIUS_ACCESS_TOKEN
-import socket
+from config import GENIUS_ACCESS_TOKEN, AUDIO_PROFILE, TELEGRAM_MAX_AUDIO_BYTES, SEARCH_HEDGE_DELAY
 import urllib.parse
 import logging
 import lyricsgenius
+from audio_cache import audio_cache
+from http_client import get_client
+from spotify_client import spotify, SpotifyError
+from video_info import video_info
+from title_parser import clean_track_name, split_artist_title, split_featured
+from yt_parser import parse_search_results, parse_playlist
 
 logger = logging.getLogger(__name__)
 
@@ -28,10 +29,6 @@ class YouTubeError(Exception):
     """Ошибка при работе с YouTube API"""
     pass
 
-class SpotifyError(Exception):
-    """Ошибка при работе с Spotify API"""
-    pass
-
 class DownloadError(Exception):
     """Ошибка при скачивании аудио"""
     pass
@@ -54,14 +51,75 @@ def is_valid_youtube_id(video_id):
     valid_chars = re.match(r'^[A-Za-z0-9_-]+$', video_id)
     return bool(valid_chars)
 
-def search_youtube(query, limit=5):
+def is_stale_file_id_error(error: Exception) -> bool:
+    """Проверяет, что Telegram отклонил сохраненный file_id (файл удален или ссылка устарела)"""
+    text = str(error).lower()
+    return any(marker in text for marker in ("wrong file identifier", "wrong remote file", "file reference", "file_id"))
+
+async def _search_strategy(search_query, limit):
+    """Выполняет один поисковый запрос к YouTube"""
+    search_params = {
+        'search_query': search_query,
+        'sp': 'EgIQAQ%3D%3D'  # Фильтр только для музыки
+    }
+    search_url = f"https://www.youtube.com/results?{urllib.parse.urlencode(search_params)}"
+    
+    html = await make_request(search_url)
+    if not html:
+        logger.warning(f"Не удалось получить HTML для запроса: {search_query}")
+        return []
+    return extract_video_info_from_html(html, limit)
+
+async def _hedged_search(strategies, limit, primary=True):
     """
-    Ищет видео на YouTube по запросу и возвращает результаты поиска.
+    Выполняет стратегии поиска с подстраховкой.
+    
+    Первая стратегия (если primary) запускается одна; остальные стартуют параллельно,
+    только если она не ответила за SEARCH_HEDGE_DELAY секунд или ничего не нашла.
+    Результаты объединяются в порядке приоритета стратегий без дублей по ID видео,
+    а ненужные запросы отменяются.
     """
+    tasks = [asyncio.create_task(_search_strategy(q, limit)) for q in strategies[:1 if primary else None]]
+    completed = {}
+    
+    def merged_results():
+        results, seen_ids = [], set()
+        for index in sorted(completed):
+            for result in completed[index]:
+                if result['id'] not in seen_ids:
+                    seen_ids.add(result['id'])
+                    results.append(result)
+        return results[:limit]
+    
     try:
-        # Установим таймаут для запросов
-        socket.setdefaulttimeout(10)
+        if primary:
+            done, _ = await asyncio.wait(tasks, timeout=SEARCH_HEDGE_DELAY)
+            if done and tasks[0].result():
+                return tasks[0].result()[:limit]
+            if not done:
+                logger.info(f"Основной поиск '{strategies[0]}' не ответил за {SEARCH_HEDGE_DELAY} с, запускаем запасные стратегии")
+            tasks += [asyncio.create_task(_search_strategy(q, limit)) for q in strategies[1:]]
         
+        pending = {task for task in tasks if not task.done()}
+        completed.update({tasks.index(task): task.result() for task in tasks if task.done()})
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                completed[tasks.index(task)] = task.result()
+            # Основная стратегия нашла результаты или набралось достаточно - остальное не ждем
+            if (primary and completed.get(0)) or len(merged_results()) >= limit:
+                break
+        return merged_results()
+    finally:
+        for task in tasks:
+            if not task.done():
+                task.cancel()
+
+async def search_youtube(query, limit=5):
+    """
+    Ищет видео на YouTube по запросу и возвращает результаты поиска.
+    """
+    try:
         # Логирование запроса
         logger.info(f"Начинаем поиск YouTube: {query}")
         
@@ -70,12 +128,13 @@ def search_youtube(query, limit=5):
             video_id = extract_video_id(query)
             if video_id:
                 try:
-                    # Получаем информацию о видео
+                    # Получаем информацию о видео одним запросом
+                    info = await video_info.resolve(video_id)
                     result = [{
                         'id': video_id,
-                        'title': get_video_title(video_id),
-                        'uploader': get_video_uploader(video_id),
-                        'duration': get_video_duration(video_id),
+                        'title': info['title'],
+                        'uploader': info['uploader'],
+                        'duration': info['duration'],
                         'url': f'https://www.youtube.com/watch?v={video_id}'
                     }]
                     return result
@@ -86,107 +145,32 @@ def search_youtube(query, limit=5):
         query = query.strip()
         
         # Проверяем, похож ли запрос на формат "артист - трек"
-        artist_track_match = re.search(r'^(.+?)\s*[-–]\s*(.+)$', query)
-        
-        # Для хранения результатов поиска
-        results = []
+        artist_track_match = split_artist_title(query)
         
-        # Определяем стратегии поиска и запускаем только одну наиболее подходящую
-        # для ускорения работы с инлайн-запросами
+        # Стратегии поиска в порядке приоритета
+        strategies = []
         
         # Стратегия 1: Прямой поиск (для коротких запросов)
         if len(query) < 50:
-            search_params = {
-                'search_query': query,
-                'sp': 'EgIQAQ%3D%3D'  # Фильтр только для музыки
-            }
-            
-            search_url = f"https://www.youtube.com/results?{urllib.parse.urlencode(search_params)}"
-            
-            # Выполняем запрос
-            html = make_request(search_url)
-            if not html:
-                logger.warning(f"Не удалось получить HTML для запроса: {query}")
-                return []
-                
-            # Извлекаем результаты
-            results = extract_video_info_from_html(html, limit)
-            
-            # Если нашли достаточно результатов, возвращаем их
-            if results and len(results) > 0:
-                return results[:limit]
+            strategies.append(query)
         
-        # Если у нас формат "артист - трек", используем специальный поиск
+        # Стратегия 2: Для формата "артист - трек" запрос с явным указанием на музыку
         if artist_track_match:
-            artist = artist_track_match.group(1).strip()
-            track = artist_track_match.group(2).strip()
-            
-            # Формируем запрос с explicit указанием на музыку
-            music_query = f"{artist} {track} music audio"
-            search_params = {
-                'search_query': music_query,
-                'sp': 'EgIQAQ%3D%3D'  # Фильтр только для музыки
-            }
-            
-            search_url = f"https://www.youtube.com/results?{urllib.parse.urlencode(search_params)}"
-            
-            # Выполняем запрос
-            html = make_request(search_url)
-            if html:
-                artist_track_results = extract_video_info_from_html(html, limit)
-                
-                # Добавляем только уникальные результаты
-                for result in artist_track_results:
-                    if result not in results:
-                        results.append(result)
-                        if len(results) >= limit:
-                            break
+            artist, track = artist_track_match
+            strategies.append(f"{artist} {track} music audio")
         
-        # Если до сих пор ничего не нашли, пробуем запасной вариант
-        if not results:
-            # Формируем запрос с добавлением "audio"
-            backup_query = f"{query} audio"
-            search_params = {
-                'search_query': backup_query,
-                'sp': 'EgIQAQ%3D%3D'  # Фильтр только для музыки
-            }
-            
-            search_url = f"https://www.youtube.com/results?{urllib.parse.urlencode(search_params)}"
-            
-            # Выполняем запрос
-            html = make_request(search_url)
-            if html:
-                backup_results = extract_video_info_from_html(html, limit)
-                results.extend(backup_results)
+        # Стратегия 3: Запасной вариант с добавлением "audio"
+        strategies.append(f"{query} audio")
         
-        # Возвращаем результаты
-        return results[:limit]
+        return await _hedged_search(strategies, limit, primary=len(query) < 50)
         
     except Exception as e:
         logger.error(f"Ошибка при поиске на YouTube: {e}")
         return []
 
 def get_spotify_track_info(track_url):
-    if not SPOTIFY_CLIENT_ID or not SPOTIFY_CLIENT_SECRET:
-        raise SpotifyError("Не настроены ключи Spotify API. Проверьте .env файл.")
-        
-    try:
-        sp = spotipy.Spotify(auth_manager=SpotifyClientCredentials(
-            client_id=SPOTIFY_CLIENT_ID,
-            client_secret=SPOTIFY_CLIENT_SECRET
-        ))
-        
-        track_id = track_url.split('/')[-1].split('?')[0]
-        track = sp.track(track_id)
-        
-        artists = ", ".join([artist['name'] for artist in track['artists']])
-        track_name = track['name']
-        search_query = f"{artists} - {track_name}"
-        
-        return search_query
-    except Exception as e:
-        print(f"Ошибка при получении информации из Spotify: {e}")
-        raise SpotifyError(f"Ошибка при получении данных из Spotify: {str(e)}")
+    """Возвращает поисковый запрос "артисты - название" для ссылки на трек Spotify"""
+    return spotify.track_query(track_url)
 
 def get_lyrics_for_track(artist_name, track_name):
     """
@@ -209,7 +193,7 @@ def get_lyrics_for_track(artist_name, track_name):
 
     try:
         # Очистка названия трека от дополнительной информации в скобках
-        cleaned_track_name = re.sub(r'\([^)]*\)', '', track_name).strip()
+        cleaned_track_name = clean_track_name(track_name)
         cleaned_artist_name = artist_name.strip()
         
         logger.info(f"Поиск текста песни на Genius для: '{cleaned_track_name}' - '{cleaned_artist_name}'")
@@ -233,85 +217,8 @@ def get_lyrics_for_track(artist_name, track_name):
                 if match_embed_number:
                     lyrics_text = lyrics_text[:match_embed_number.start()].strip()
 
-            raw_artist_string = song.artist
             raw_title_string = song.title 
-            
-            main_artist = raw_artist_string # По умолчанию основной исполнитель - это все из song.artist
-            featured_artists_list = []
-
-            # Паттерн для извлечения фитов: 
-            # Ищет (feat. ...), (ft. ...), (featuring ...)
-            # Также пытается захватить артистов, перечисленных через & или запятую внутри скобок
-            feat_patterns = [
-                r'(?:\(|\[)?(?:feat|ft|featuring)\.?\s+([^)\]]+)(?:\)|\])?',
-                r'(?:\s+with\s+)([^)\]]+)' # для конструкций "Artist1 with Artist2"
-            ]
-            
-            processed_artist_string = raw_artist_string
-            processed_title_string = raw_title_string
-
-            # Сначала ищем фиты в строке исполнителя
-            for pattern in feat_patterns:
-                match = re.search(pattern, processed_artist_string, re.IGNORECASE)
-                if match:
-                    main_artist = processed_artist_string[:match.start()].strip() # Все до "feat."
-                    featured_artists_str = match.group(1).strip()
-                    # Разделяем фиты, если их несколько (например, "Artist1, Artist2 & Artist3")
-                    # Убираем повторное добавление, если они уже есть
-                    current_feats = [artist.strip() for artist in re.split(r',\s*|\s+&\s+', featured_artists_str) if artist.strip()]
-                    for ft_artist in current_feats:
-                        if ft_artist not in featured_artists_list:
-                             featured_artists_list.append(ft_artist)
-                    # Удаляем часть с фитами из строки исполнителя для дальнейшей обработки
-                    processed_artist_string = main_artist 
-                    break 
-            
-            # Затем ищем фиты в названии трека, если они не были найдены в исполнителе
-            if not featured_artists_list:
-                for pattern in feat_patterns:
-                    match = re.search(pattern, processed_title_string, re.IGNORECASE)
-                    if match:
-                        # Если нашли фит в названии, предполагаем, что processed_artist_string - это основной исполнитель
-                        main_artist = processed_artist_string.strip()
-                        featured_artists_str = match.group(1).strip()
-                        current_feats = [artist.strip() for artist in re.split(r',\s*|\s+&\s+', featured_artists_str) if artist.strip()]
-                        for ft_artist in current_feats:
-                            if ft_artist not in featured_artists_list:
-                                featured_artists_list.append(ft_artist)
-                        # Можно также попробовать очистить название трека от информации о фитах
-                        # processed_title_string = processed_title_string[:match.start()].strip()
-                        break
-            
-            # Если основной артист содержит "(Artist Name)", извлекаем только имя
-            # Например, "МУККА (MUKKA)" -> "МУККА"
-            # Стараемся не затронуть случаи типа "Artist (from band)" или "Artist (Official Video)" - это больше для title
-            artist_name_match = re.match(r'^([^(]+)\s*\([^)]*\)$', main_artist)
-            if artist_name_match and not any(kw in main_artist.lower() for kw in ['band', 'official', 'feat', 'ft']):
-                 # Проверяем, что в скобках нечто похожее на дублирование или уточнение основного имени,
-                 # а не что-то совершенно другое.
-                 # Это очень грубая эвристика.
-                 part_in_parentheses = main_artist[artist_name_match.end(1):].strip()
-                 ifLevenshtein = True # Заглушка, нужна реальная функция Левенштейна или другая проверка
-                 try:
-                     from Levenshtein import distance as levenshtein_distance
-                     # Сравниваем то, что до скобок, с тем, что в скобках, если они достаточно похожи
-                     if levenshtein_distance(artist_name_match.group(1).strip().lower(), part_in_parentheses.lower().strip('()')) < len(artist_name_match.group(1).strip()) * 0.5:
-                        main_artist = artist_name_match.group(1).strip()
-                 except ImportError:
-                     # Если нет Levenshtein, используем более простую проверку
-                     if artist_name_match.group(1).strip().lower() in part_in_parentheses.lower():
-                        main_artist = artist_name_match.group(1).strip()
-
-            # Удаляем дубликаты из featured_artists_list, если основной артист попал туда
-            if main_artist in featured_artists_list:
-                featured_artists_list.remove(main_artist)
-
-            # Проверяем, не попал ли основной артист (или его часть) снова в фиты после всех манипуляций
-            # Это актуально, если, например, song.artist был "ArtistA feat. ArtistA & ArtistB"
-            final_featured_artists = []
-            for fa in featured_artists_list:
-                if fa.lower() != main_artist.lower() and main_artist.lower() not in fa.lower() and fa.lower() not in main_artist.lower() :
-                    final_featured_artists.append(fa)
+            main_artist, final_featured_artists = split_featured(song.artist, raw_title_string)
 
             return {
                 "success": True,
@@ -320,12 +227,13 @@ def get_lyrics_for_track(artist_name, track_name):
                 "source_url": song.url if hasattr(song, 'url') else None,
                 "track_name": raw_title_string, # Возвращаем оригинальное название трека из Genius
                 "artist_name": main_artist.strip(),
-                "featured_artists": final_featured_artists
+                "featured_artists": list(final_featured_artists)
             }
         else:
             logger.warning(f"Текст песни не найден на Genius для: '{cleaned_track_name}' - '{cleaned_artist_name}'")
             return {
                 "success": False,
+                "not_found": True, # Genius ответил, но песни нет - такой результат можно кэшировать
                 "error": "Текст песни не найден на Genius.com",
                 "track_name": track_name,
                 "artist_name": artist_name
@@ -340,84 +248,147 @@ def get_lyrics_for_track(artist_name, track_name):
             "artist_name": artist_name
         }
 
-def download_audio(video_url):
+# Профили выдачи аудио. Название профиля входит в ключ дискового кэша
+AUDIO_PROFILES = {
+    # Исходная AAC-дорожка без перекодирования: поток копируется в контейнер m4a
+    'm4a': {'format': 'bestaudio[ext=m4a]/bestaudio[acodec^=mp4a]/bestaudio/best', 'codec': 'm4a'},
+    # Прежний режим: MP3 192 кбит/с
+    'mp3-192': {'format': 'bestaudio/best', 'codec': 'mp3', 'quality': '192'},
+    # MP3 192 кбит/с с самым быстрым алгоритмом кодирования LAME
+    'mp3-fast': {'format': 'bestaudio/best', 'codec': 'mp3', 'quality': '192', 'ffmpeg_args': ['-compression_level', '9']},
+    # MP3 с битрейтом, подобранным по длительности так, чтобы файл уложился в лимит Telegram
+    'mp3-fit': {'format': 'bestaudio/best', 'codec': 'mp3', 'quality': None},
+}
+FIT_PROFILE = 'mp3-fit'
+FIT_BITRATES = (320, 256, 192, 160, 128, 96, 64)
+
+def _fit_bitrate(duration):
+    """Подбирает максимальный битрейт MP3 (кбит/с), при котором трек уложится в лимит Telegram"""
+    if not duration:
+        return 192
+    for bitrate in FIT_BITRATES:
+        # 125 = 1000 / 8: перевод кбит/с в байты в секунду, 5% запаса на контейнер
+        if duration * bitrate * 125 <= TELEGRAM_MAX_AUDIO_BYTES * 0.95:
+            return bitrate
+    return FIT_BITRATES[-1]
+
+def _estimate_size(info_dict, profile_name):
+    """Оценивает размер итогового файла в байтах по информации о выбранном формате"""
+    profile = AUDIO_PROFILES[profile_name]
+    duration = info_dict.get('duration') or 0
+    if profile.get('quality'):
+        return duration * int(profile['quality']) * 125
+    size = info_dict.get('filesize') or info_dict.get('filesize_approx')
+    if size:
+        return size
+    return duration * (info_dict.get('abr') or info_dict.get('tbr') or 0) * 125
+
+# Долгоживущие экземпляры YoutubeDL: по одному на поток или процесс движка скачивания и профиль
+_ydl_local = threading.local()
+
+def _get_youtube_dl(profile_name, tmp_dir, quality=None):
     """
-    Скачивает аудио с YouTube
+    Возвращает YoutubeDL текущего потока для профиля и рабочую папку потока внутри tmp_dir,
+    создавая их при первом вызове. Экземпляр переиспользуется между скачиваниями,
+    чтобы не инициализировать yt-dlp заново.
+    """
+    instances = getattr(_ydl_local, 'instances', None)
+    if instances is None or _ydl_local.tmp_dir != tmp_dir:
+        os.makedirs(tmp_dir, exist_ok=True)
+        instances = _ydl_local.instances = {}
+        _ydl_local.tmp_dir = tmp_dir
+        _ydl_local.work_dir = tempfile.mkdtemp(prefix="worker-", dir=tmp_dir)
+    profile = AUDIO_PROFILES[profile_name]
+    quality = quality or profile.get('quality')
+    ydl = instances.get((profile_name, quality))
+    if ydl is None:
+        postprocessor = {'key': 'FFmpegExtractAudio', 'preferredcodec': profile['codec']}
+        if quality:
+            postprocessor['preferredquality'] = quality
+        ydl_opts = {
+            'format': profile['format'],
+            'outtmpl': os.path.join(_ydl_local.work_dir, '%(id)s.%(ext)s'),
+            'noplaylist': True,
+            'quiet': True,
+            'no_warnings': True,
+            'postprocessors': [postprocessor],
+        }
+        if profile.get('ffmpeg_args'):
+            ydl_opts['postprocessor_args'] = {'extractaudio+ffmpeg_o': profile['ffmpeg_args']}
+        ydl = instances[(profile_name, quality)] = yt_dlp.YoutubeDL(ydl_opts)
+    # Папка могла быть удалена очисткой кэша
+    os.makedirs(_ydl_local.work_dir, exist_ok=True)
+    return ydl, _ydl_local.work_dir
+
+def fetch_audio(video_url, profile_name=AUDIO_PROFILE, tmp_dir=None):
+    """
+    Скачивает аудио с YouTube во временную папку кэша в указанном профиле.
+    Выполняется в потоке или дочернем процессе движка скачивания, поэтому
+    не обращается к индексу кэша: публикацией файла занимается вызывающая сторона.
     
     Args:
         video_url: URL видео на YouTube
+        profile_name: Профиль из AUDIO_PROFILES. Если файл в этом профиле не уложится
+            в лимит Telegram, используется профиль FIT_PROFILE
+        tmp_dir: Временная папка кэша вызывающего процесса. Дочерний процесс заново
+            импортирует audio_cache с папкой по умолчанию и не знает о use_directory()
         
     Returns:
-        tuple: (путь к файлу, название трека)
+        tuple: (путь к файлу во временной папке кэша, ID видео, название трека, использованный профиль)
     
     Raises:
         DownloadError: если произошла ошибка при скачивании
     """
-    # Создаем директорию для загрузок, если её нет
-    if not os.path.exists(DOWNLOADS_DIR):
-        os.makedirs(DOWNLOADS_DIR)
+    video_id = extract_video_id(video_url)
+    tmp_dir = tmp_dir or audio_cache.tmp_dir
+    ydl, work_dir = _get_youtube_dl(profile_name, tmp_dir)
     
     try:
-        # Получаем информацию о видео без скачивания
-        with yt_dlp.YoutubeDL({'quiet': True}) as ydl:
-            info_dict = ydl.extract_info(video_url, download=False)
-            
-            if not info_dict:
-                raise DownloadError("Не удалось получить информацию о видео")
-            
-            title = info_dict.get('title', 'Unknown Title')
-            duration = info_dict.get('duration')
-            
-            if duration is not None and duration < 1:
-                raise DownloadError(f"Видео имеет нулевую длительность: {duration} секунд")
-            
-            print(f"Найдено видео: {title}, длительность: {duration} сек")
+        # Получаем информацию о видео один раз, этот же info_dict используется для скачивания
+        info_dict = ydl.extract_info(video_url, download=False)
         
-        # Используем временную директорию для скачивания
-        with tempfile.TemporaryDirectory() as temp_dir:
-            ydl_opts = {
-                'format': 'bestaudio/best',
-                'extractaudio': True,
-                'audioformat': 'mp3',
-                'outtmpl': os.path.join(temp_dir, '%(title)s.%(ext)s'),
-                'noplaylist': True,
-                'quiet': True,
-                'no_warnings': True,
-                'postprocessors': [{
-                    'key': 'FFmpegExtractAudio',
-                    'preferredcodec': 'mp3',
-                    'preferredquality': '192',
-                }],
-            }
-            
-            # Скачиваем видео
-            with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-                ydl.download([video_url])
-            
-            # Ищем скачанный файл в временной директории
-            for file in os.listdir(temp_dir):
-                if file.endswith('.mp3'):
-                    # Копируем файл в папку downloads с уникальным именем
-                    unique_id = uuid.uuid4().hex
-                    output_file = os.path.join(DOWNLOADS_DIR, f"{unique_id}.mp3")
-                    
-                    # Копируем файл
-                    with open(os.path.join(temp_dir, file), 'rb') as source:
-                        with open(output_file, 'wb') as dest:
-                            dest.write(source.read())
-                    
-                    # Проверяем размер файла
-                    file_size = os.path.getsize(output_file)
-                    if file_size < 1024:  # Меньше 1KB
-                        raise DownloadError(f"Скачанный файл слишком маленький: {file_size} байт")
-                    
-                    return output_file, title
-            
-            # Если файл не найден
+        if not info_dict:
+            raise DownloadError("Не удалось получить информацию о видео")
+        
+        title = info_dict.get('title', 'Unknown Title')
+        duration = info_dict.get('duration')
+        video_id = video_id or info_dict.get('id')
+        
+        if duration is not None and duration < 1:
+            raise DownloadError(f"Видео имеет нулевую длительность: {duration} секунд")
+        
+        print(f"Найдено видео: {title}, длительность: {duration} сек")
+        
+        if profile_name != FIT_PROFILE and _estimate_size(info_dict, profile_name) > TELEGRAM_MAX_AUDIO_BYTES:
+            logger.info(f"Трек {video_id} в профиле {profile_name} превысит лимит Telegram, используем {FIT_PROFILE}")
+            profile_name = FIT_PROFILE
+        if profile_name == FIT_PROFILE:
+            ydl, work_dir = _get_youtube_dl(profile_name, tmp_dir, str(_fit_bitrate(duration)))
+        
+        # Скачиваем и конвертируем по уже полученной информации, без повторного запроса к YouTube
+        info_dict = ydl.process_ie_result(info_dict, download=True)
+        
+        requested = info_dict.get('requested_downloads') or [{}]
+        downloaded_file = requested[0].get('filepath') or os.path.join(work_dir, f"{info_dict.get('id')}.{AUDIO_PROFILES[profile_name]['codec']}")
+        if not os.path.exists(downloaded_file):
             raise DownloadError("Не удалось найти скачанный файл")
         
+        # Проверяем размер файла
+        file_size = os.path.getsize(downloaded_file)
+        if file_size < 1024:  # Меньше 1KB
+            raise DownloadError(f"Скачанный файл слишком маленький: {file_size} байт")
+        
+        return downloaded_file, video_id, title, profile_name
+        
     except Exception as e:
         print(f"Ошибка при скачивании: {e}")
+        # Удаляем недокачанные и промежуточные файлы этого видео из рабочей папки
+        for file in os.listdir(work_dir):
+            if video_id and file.startswith(video_id):
+                try:
+                    os.remove(os.path.join(work_dir, file))
+                except OSError as remove_err:
+                    logger.error(f"Ошибка при удалении временного файла {file}: {remove_err}")
         raise DownloadError(f"Не удалось скачать аудио: {str(e)}")
 
 def extract_video_id(url):
@@ -440,14 +411,31 @@ def extract_video_id(url):
         logger.error(f"Ошибка при извлечении ID видео: {e}")
         return None
 
-def make_request(url):
-    """Выполняет HTTP запрос и возвращает HTML страницу"""
+def extract_playlist_id(url):
+    """Извлекает ID плейлиста из ссылки youtube.com/playlist?list=... или None"""
+    match = re.search(r'youtube\.com/playlist\?(?:.*&)?list=([0-9A-Za-z_-]+)', url)
+    return match.group(1) if match else None
+
+async def get_youtube_playlist(playlist_id, limit=50):
+    """
+    Получает название и видео плейлиста YouTube одним запросом страницы.
+
+    Returns:
+        (str, list): Название плейлиста и словари с ключами id, title, uploader, url
+    """
+    html = await make_request(f"https://www.youtube.com/playlist?list={playlist_id}")
+    if not html:
+        return None, []
     try:
-        headers = {
-            'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36',
-            'Accept-Language': 'en-US,en;q=0.9',
-        }
-        response = requests.get(url, headers=headers, timeout=10)
+        return parse_playlist(html, limit)
+    except Exception as e:
+        logger.error(f"Ошибка при разборе плейлиста {playlist_id}: {e}")
+        return None, []
+
+async def make_request(url, timeout=10.0):
+    """Выполняет HTTP запрос через общий клиент с пулом соединений и возвращает HTML страницу"""
+    try:
+        response = await get_client().get(url, timeout=timeout)
         response.raise_for_status()  # Проверяем на ошибки HTTP
         return response.text
     except Exception as e:
@@ -457,121 +445,7 @@ def make_request(url):
 def extract_video_info_from_html(html, limit=5):
     """Извлекает информацию о видео из HTML страницы YouTube"""
     try:
-        results = []
-        
-        # Ищем JSON-данные в скрипте
-        start_marker = 'var ytInitialData = '
-        if start_marker in html:
-            json_start = html.index(start_marker) + len(start_marker)
-            json_text = html[json_start:]
-            json_end = json_text.find(';</script>')
-            if json_end > 0:
-                json_text = json_text[:json_end]
-                
-                try:
-                    data = json.loads(json_text)
-                    
-                    # Ищем результаты в структуре данных
-                    contents = data.get('contents', {}).get('twoColumnSearchResultsRenderer', {}).get('primaryContents', {})
-                    
-                    if not contents:
-                        return results
-                        
-                    # Извлекаем секцию с результатами
-                    items = contents.get('sectionListRenderer', {}).get('contents', [])
-                    
-                    if not items:
-                        return results
-                        
-                    # Извлекаем результаты
-                    for item in items:
-                        if 'itemSectionRenderer' in item:
-                            videos = item.get('itemSectionRenderer', {}).get('contents', [])
-                            
-                            for video in videos:
-                                if 'videoRenderer' in video:
-                                    video_data = video.get('videoRenderer', {})
-                                    
-                                    # Проверяем, что это видео, а не плейлист или канал
-                                    if 'videoId' in video_data:
-                                        video_id = video_data.get('videoId')
-                                        title = extract_text(video_data.get('title', {}))
-                                        uploader = extract_text(video_data.get('ownerText', {}))
-                                        
-                                        # Добавляем информацию в результаты
-                                        results.append({
-                                            'id': video_id,
-                                            'title': title or 'Неизвестно',
-                                            'uploader': uploader or 'Неизвестно',
-                                            'duration': 0,  # Не извлекаем длительность для ускорения
-                                            'url': f'https://www.youtube.com/watch?v={video_id}'
-                                        })
-                                        
-                                        # Проверяем, достаточно ли результатов
-                                        if len(results) >= limit:
-                                            return results
-                except json.JSONDecodeError as e:
-                    logger.error(f"Ошибка декодирования JSON: {e}")
-        
-        return results
+        return parse_search_results(html, limit)
     except Exception as e:
         logger.error(f"Ошибка при извлечении информации из HTML: {e}")
         return []
-
-def extract_text(obj):
-    """Извлекает текст из объекта YouTube API"""
-    if not obj:
-        return None
-        
-    if 'runs' in obj:
-        text_parts = []
-        for run in obj.get('runs', []):
-            if 'text' in run:
-                text_parts.append(run['text'])
-        return ' '.join(text_parts)
-    elif 'simpleText' in obj:
-        return obj['simpleText']
-    return None
-
-def get_video_title(video_id):
-    """Получает название видео по его ID"""
-    try:
-        url = f"https://www.youtube.com/watch?v={video_id}"
-        html = make_request(url)
-        if html:
-            title_match = re.search(r'<meta name="title" content="(.*?)"',
-                                  html, re.IGNORECASE)
-            if title_match:
-                return title_match.group(1)
-            
-            # Альтернативный поиск
-            title_match = re.search(r'<title>(.*?) - YouTube</title>', html, re.IGNORECASE)
-            if title_match:
-                return title_match.group(1)
-        return "Неизвестное видео"
-    except Exception as e:
-        logger.error(f"Ошибка при получении названия видео {video_id}: {e}")
-        return "Неизвестное видео"
-
-def get_video_uploader(video_id):
-    """Получает имя загрузчика видео по его ID"""
-    try:
-        url = f"https://www.youtube.com/watch?v={video_id}"
-        html = make_request(url)
-        if html:
-            channel_match = re.search(r'<link itemprop="name" content="(.*?)"',
-                                   html, re.IGNORECASE)
-            if channel_match:
-                return channel_match.group(1)
-        return "Неизвестный канал"
-    except Exception as e:
-        logger.error(f"Ошибка при получении автора видео {video_id}: {e}")
-        return "Неизвестный канал"
-
-def get_video_duration(video_id):
-    """Получает длительность видео по его ID (в секундах)"""
-    try:
-        return 0  # Для ускорения не получаем реальную длительность
-    except Exception as e:
-        logger.error(f"Ошибка при получении длительности видео {video_id}: {e}")
-        return 0 
\ No newline at end of file
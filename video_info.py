@@ -0,0 +1,94 @@
+import logging
+from cachetools import TTLCache
+
+from config import VIDEO_INFO_CACHE_SIZE, VIDEO_INFO_CACHE_TTL
+from http_client import get_client
+from singleflight import SingleFlight
+from yt_parser import parse_player_details, parse_video_details
+
+logger = logging.getLogger(__name__)
+
+OEMBED_URL = "https://www.youtube.com/oembed"
+PLAYER_URL = "https://www.youtube.com/youtubei/v1/player"
+# Клиент, от имени которого запрашивается JSON плеера (как у веб-версии YouTube)
+PLAYER_CLIENT = {'clientName': 'WEB', 'clientVersion': '2.20240101.00.00', 'hl': 'en'}
+
+class VideoInfoResolver:
+    """
+    Метаданные видео по ID: название, автор, длительность и обложка.
+
+    Сначала запрашивается JSON плеера (/youtubei/v1/player): один ответ без разметки
+    страницы, в котором есть и длительность. Если он недоступен, загружается страница
+    просмотра, а в последнюю очередь oEmbed, который не сообщает длительность. Метаданные
+    с известной длительностью хранятся в TTLCache, одновременные запросы одного видео
+    объединяются в один.
+    """
+
+    def __init__(self, maxsize: int, ttl: float):
+        self._memory = TTLCache(maxsize=maxsize, ttl=ttl)
+        self._flights = SingleFlight("video_info")
+
+    async def resolve(self, video_id: str) -> dict:
+        info = self._memory.get(video_id)
+        if info is None:
+            info = await self._flights.run(video_id, self._fetch, video_id)
+        return info
+
+    async def _fetch(self, video_id: str) -> dict:
+        url = f"https://www.youtube.com/watch?v={video_id}"
+        info = await self._fetch_player(video_id) or await self._fetch_watch_page(url) or await self._fetch_oembed(url)
+        if info is None:
+            # Не кэшируем, чтобы следующий запрос попробовал еще раз
+            logger.warning(f"Не удалось получить метаданные видео {video_id}")
+            return {
+                'title': 'Неизвестное видео',
+                'uploader': 'Неизвестный канал',
+                'duration': 0,
+                'thumbnail': f"https://img.youtube.com/vi/{video_id}/mqdefault.jpg",
+            }
+        # Без длительности не кэшируем: следующий запрос попробует получить ее снова
+        if info['duration']:
+            self._memory[video_id] = info
+        return info
+
+    async def _fetch_player(self, video_id: str):
+        try:
+            response = await get_client().post(
+                PLAYER_URL,
+                json={'context': {'client': PLAYER_CLIENT}, 'videoId': video_id},
+                timeout=5.0,
+            )
+            response.raise_for_status()
+            info = parse_video_details(response.json())
+        except Exception as e:
+            logger.info(f"JSON плеера недоступен для {video_id}: {e}")
+            return None
+        if info is None:
+            logger.info(f"JSON плеера для {video_id} не содержит videoDetails")
+        return info
+
+    async def _fetch_oembed(self, url: str):
+        try:
+            response = await get_client().get(OEMBED_URL, params={'url': url, 'format': 'json'}, timeout=5.0)
+            response.raise_for_status()
+            data = response.json()
+        except Exception as e:
+            logger.info(f"oEmbed недоступен для {url}: {e}")
+            return None
+        return {
+            'title': data.get('title') or 'Неизвестное видео',
+            'uploader': data.get('author_name') or 'Неизвестный канал',
+            'duration': 0, # oEmbed не сообщает длительность, такой результат не кэшируется
+            'thumbnail': data.get('thumbnail_url'),
+        }
+
+    async def _fetch_watch_page(self, url: str):
+        try:
+            response = await get_client().get(url)
+            response.raise_for_status()
+            return parse_player_details(response.text)
+        except Exception as e:
+            logger.error(f"Ошибка при запросе {url}: {e}")
+            return None
+
+video_info = VideoInfoResolver(VIDEO_INFO_CACHE_SIZE, VIDEO_INFO_CACHE_TTL)
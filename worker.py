@@ -0,0 +1,184 @@
+import os
+import time
+import socket
+import asyncio
+import logging
+import argparse
+from aiogram import Bot
+from aiogram.client.bot import DefaultBotProperties
+from aiogram.enums import ParseMode
+
+from config import (
+    BOT_TOKEN, AUDIO_CACHE_DIR, DOWNLOAD_WORKERS, JOB_QUEUE_PATH, JOB_LEASE_SECONDS,
+    JOB_HEARTBEAT_INTERVAL, JOB_POLL_INTERVAL, TRACK_PIPELINE, PIPELINE_STATS_INTERVAL,
+)
+from audio_cache import audio_cache
+from autoscaler import WorkerSlot
+from bulk import run_bulk_job
+from database import init_db, close_db
+import download_engine
+from http_client import close_client
+from job_queue import JobStore, LeaseLost, decode_job
+from pipeline import Pipeline, TrackJob, create_track_pipeline
+from quota import PrepaidQuota
+from singleflight import SingleFlight
+
+logger = logging.getLogger(__name__)
+
+async def _heartbeat_loop(store: JobStore, job_id: int, name: str):
+    """Продлевает аренду задания; завершается, когда аренду забрал другой воркер"""
+    while True:
+        await asyncio.sleep(JOB_HEARTBEAT_INTERVAL)
+        try:
+            if not await store.heartbeat(job_id, name):
+                return
+            await store.register_worker(name)
+        except Exception as e:
+            # Аренда еще может быть действительна: пробуем продлить ее на следующем шаге
+            logger.error(f"Воркер {name}: не удалось продлить аренду задания {job_id}: {e}")
+
+async def _execute_job(row, name: str, bot: Bot, flights: SingleFlight, pipeline: Pipeline = None) -> int:
+    """Выполняет задание и возвращает, сколько зарезервированных за него скачиваний не состоялось"""
+    from handlers import download_and_send_audio
+
+    job_id, kind, user_id, video_id, payload, attempts, slots = row
+    item = decode_job(kind, user_id, video_id, payload, bot)
+    if kind == 'bulk':
+        prepaid = PrepaidQuota(slots)
+        try:
+            await run_bulk_job(item, flights, quota=prepaid)
+        except Exception as e:
+            # Повтор отправил бы уже отправленные треки еще раз
+            if not item.sent:
+                raise
+            logger.error(f"Воркер {name}: задание {job_id} прервано после {item.sent} отправленных треков: {e}")
+        return prepaid.slots
+
+    if pipeline is not None:
+        success = await pipeline.run(TrackJob(*item, flights=flights))
+    else:
+        success = await download_and_send_audio(*item, flights=flights)
+    logger.info(f"Воркер {name}: задание {job_id} (user_id={user_id}, video_id={video_id}) - {'успех' if success else 'ошибка, резерв возвращается'}")
+    # Засчитываем только успешно отправленные треки
+    return 0 if success else slots
+
+async def process_job(store: JobStore, row, name: str, bot: Bot, flights: SingleFlight, pipeline: Pipeline = None):
+    """
+    Выполняет одно задание из общей очереди; лимит за него уже зарезервирован процессом бота.
+
+    Raises:
+        LeaseLost: Если аренду забрал другой воркер. Выполнение прерывается, иначе
+            трек или пакет был бы отправлен пользователю дважды
+    """
+    job_id = row[0]
+    work = asyncio.create_task(_execute_job(row, name, bot, flights, pipeline))
+    heartbeat = asyncio.create_task(_heartbeat_loop(store, job_id, name))
+    try:
+        await asyncio.wait((work, heartbeat), return_when=asyncio.FIRST_COMPLETED)
+    finally:
+        heartbeat.cancel()
+        # Аренда потеряна или воркер останавливается: задание не должно выполняться дальше
+        if not work.done():
+            work.cancel()
+            await asyncio.gather(work, return_exceptions=True)
+    if work.cancelled():
+        raise LeaseLost(job_id)
+    await store.complete(job_id, name, refund=work.result())
+
+async def run_worker(name: str, store: JobStore, bot: Bot, flights: SingleFlight, slot: WorkerSlot = None,
+                     pipeline: Pipeline = None):
+    """Забирает задания из общей очереди и выполняет их до отмены или до slot.retiring"""
+    await store.register_worker(name)
+    logger.info(f"Воркер {name} запущен")
+    seen_at = time.monotonic()
+    try:
+        while True:
+            if slot is not None:
+                if slot.retiring:
+                    break
+                # Отмена во время claim оставила бы задание занятым до истечения аренды
+                slot.busy = True
+            row = await store.claim(name)
+            if row is None:
+                if slot is not None:
+                    slot.busy = False
+                # Пока очередь пуста, воркер продолжает отмечаться живым
+                if time.monotonic() - seen_at >= JOB_HEARTBEAT_INTERVAL:
+                    await store.register_worker(name)
+                    seen_at = time.monotonic()
+                await asyncio.sleep(JOB_POLL_INTERVAL)
+                continue
+            job_id, attempts = row[0], row[5]
+            logger.info(f"Воркер {name} взял задание {job_id} (попытка {attempts})")
+            try:
+                await process_job(store, row, name, bot, flights, pipeline)
+            except asyncio.CancelledError:
+                if await store.release(job_id, name):
+                    logger.info(f"Воркер {name}: задание {job_id} возвращено в очередь")
+                raise
+            except LeaseLost:
+                # Задание выполняет другой воркер, он и запишет результат
+                logger.warning(f"Воркер {name}: аренда задания {job_id} потеряна, выполнение прервано")
+            except Exception as e:
+                logger.error(f"Ошибка в воркере {name} при выполнении задания {job_id}: {e}", exc_info=True)
+                await store.fail(job_id, name, attempts, str(e)[:500])
+    finally:
+        await store.unregister_worker(name)
+        logger.info(f"Воркер {name} остановлен")
+
+async def main(workers: int, name: str):
+    if not BOT_TOKEN:
+        print("Ошибка: Токен бота не найден. Проверьте .env файл.")
+        return
+
+    # Отдельная папка кэша: sweep() не должен трогать файлы бота и других воркеров
+    audio_cache.use_directory(os.path.join(AUDIO_CACHE_DIR, f"worker-{name}"))
+    audio_cache.sweep()
+    await init_db()
+    store = JobStore(JOB_QUEUE_PATH, JOB_LEASE_SECONDS)
+    await store.open()
+
+    bot = Bot(token=BOT_TOKEN, default_bot_properties=DefaultBotProperties(parse_mode=ParseMode.HTML))
+    flights = SingleFlight("download")
+    pipeline = None
+    if TRACK_PIPELINE:
+        from handlers import TRACK_STAGES
+        pipeline = create_track_pipeline(TRACK_STAGES)
+        pipeline.start(PIPELINE_STATS_INTERVAL)
+    tasks = [asyncio.create_task(run_worker(f"{name}/{i + 1}", store, bot, flights, pipeline=pipeline)) for i in range(workers)]
+    logger.info(f"Процесс скачивания {name}: {workers} воркеров, очередь {JOB_QUEUE_PATH}")
+    try:
+        await asyncio.gather(*tasks)
+    finally:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        if pipeline is not None:
+            await pipeline.stop()
+        download_engine.shutdown()
+        await close_client()
+        await store.close()
+        await close_db()
+        await bot.session.close()
+        logger.info(f"Процесс скачивания {name} остановлен")
+
+if __name__ == "__main__":
+    # Отдельный процесс скачивания для JOB_QUEUE_BACKEND = "sqlite":
+    # python worker.py [--workers N] [--name NAME]
+    parser = argparse.ArgumentParser(description="Процесс скачивания, выполняющий задания из общей очереди")
+    parser.add_argument("--workers", type=int, default=DOWNLOAD_WORKERS, help="Сколько заданий выполняется одновременно")
+    parser.add_argument("--name", default=f"{socket.gethostname()}-{os.getpid()}", help="Имя процесса в очереди; постоянное имя сохраняет его папку кэша между перезапусками")
+    args = parser.parse_args()
+
+    logging.basicConfig(
+        level=logging.INFO,
+        format="%(asctime)s - %(levelname)s - %(name)s - %(message)s",
+        handlers=[
+            logging.FileHandler("worker.log"),
+            logging.StreamHandler()
+        ]
+    )
+    try:
+        asyncio.run(main(args.workers, args.name))
+    except KeyboardInterrupt:
+        logger.info("Процесс скачивания остановлен пользователем")
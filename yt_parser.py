@@ -0,0 +1,254 @@
+import os
+import re
+import json
+import logging
+from itertools import islice
+
+logger = logging.getLogger(__name__)
+
+# orjson разбирает большие JSON в несколько раз быстрее стандартного модуля
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+START_MARKERS = ('var ytInitialData = ', 'window["ytInitialData"] = ')
+PLAYER_MARKERS = ('var ytInitialPlayerResponse = ', 'window["ytInitialPlayerResponse"] = ')
+END_MARKER = ';</script>'
+
+_decoder = json.JSONDecoder()
+
+def parse_initial_data(html, markers=START_MARKERS):
+    """
+    Находит и разбирает объект ytInitialData (или другой, заданный markers) на странице YouTube.
+
+    Хвост страницы не копируется: стандартный декодер разбирает JSON прямо
+    с найденной позиции (raw_decode), а для orjson вырезается только сам JSON.
+
+    Returns:
+        dict или None, если данные не найдены или повреждены
+    """
+    for marker in markers:
+        marker_pos = html.find(marker)
+        if marker_pos != -1:
+            break
+    else:
+        return None
+    start = marker_pos + len(marker)
+
+    if orjson is not None:
+        end = html.find(END_MARKER, start)
+        if end != -1:
+            try:
+                return orjson.loads(html[start:end])
+            except ValueError:
+                pass # За объектом в том же <script> идет другой код - разбираем стандартным декодером
+    try:
+        data, _ = _decoder.raw_decode(html, start)
+        return data
+    except ValueError as e: # orjson.JSONDecodeError и json.JSONDecodeError наследуются от ValueError
+        logger.error(f"Ошибка декодирования JSON: {e}")
+        return None
+
+def extract_text(obj):
+    """Извлекает текст из объекта YouTube API"""
+    if not obj:
+        return None
+
+    if 'runs' in obj:
+        text_parts = []
+        for run in obj.get('runs', []):
+            if 'text' in run:
+                text_parts.append(run['text'])
+        return ' '.join(text_parts)
+    elif 'simpleText' in obj:
+        return obj['simpleText']
+    return None
+
+def iter_video_renderers(data):
+    """Лениво перебирает videoRenderer из результатов поиска в порядке выдачи"""
+    contents = data.get('contents', {}).get('twoColumnSearchResultsRenderer', {}).get('primaryContents', {})
+    for item in contents.get('sectionListRenderer', {}).get('contents', []):
+        for video in item.get('itemSectionRenderer', {}).get('contents', ()):
+            video_data = video.get('videoRenderer')
+            # Проверяем, что это видео, а не плейлист или канал
+            if video_data and 'videoId' in video_data:
+                yield video_data
+
+def parse_search_results(html, limit=5):
+    """
+    Извлекает до limit результатов поиска из HTML страницы YouTube.
+
+    Returns:
+        list: Словари с ключами id, title, uploader, duration, url
+    """
+    data = parse_initial_data(html)
+    if not data:
+        return []
+
+    results = []
+    for video_data in islice(iter_video_renderers(data), limit):
+        video_id = video_data['videoId']
+        results.append({
+            'id': video_id,
+            'title': extract_text(video_data.get('title')) or 'Неизвестно',
+            'uploader': extract_text(video_data.get('ownerText')) or 'Неизвестно',
+            'duration': 0,  # Не извлекаем длительность для ускорения
+            'url': f'https://www.youtube.com/watch?v={video_id}'
+        })
+    return results
+
+def parse_playlist(html, limit=50):
+    """
+    Извлекает название и до limit видео со страницы плейлиста YouTube.
+    Разбирается только первая страница плейлиста (около 100 видео).
+
+    Returns:
+        (str, list): Название плейлиста и словари с ключами id, title, uploader, url
+    """
+    data = parse_initial_data(html)
+    if not data:
+        return None, []
+
+    title = data.get('metadata', {}).get('playlistMetadataRenderer', {}).get('title')
+    results = []
+    for tab in data.get('contents', {}).get('twoColumnBrowseResultsRenderer', {}).get('tabs', []):
+        sections = tab.get('tabRenderer', {}).get('content', {}).get('sectionListRenderer', {}).get('contents', [])
+        for section in sections:
+            for item in section.get('itemSectionRenderer', {}).get('contents', []):
+                for video in item.get('playlistVideoListRenderer', {}).get('contents', []):
+                    video_data = video.get('playlistVideoRenderer')
+                    # Удаленные и приватные видео не содержат videoId или кнопки воспроизведения
+                    if not video_data or 'videoId' not in video_data or not video_data.get('isPlayable', True):
+                        continue
+                    video_id = video_data['videoId']
+                    results.append({
+                        'id': video_id,
+                        'title': extract_text(video_data.get('title')) or 'Неизвестно',
+                        'uploader': extract_text(video_data.get('shortBylineText')) or 'Неизвестно',
+                        'url': f'https://www.youtube.com/watch?v={video_id}'
+                    })
+                    if len(results) >= limit:
+                        return title, results
+    return title, results
+
+def parse_player_details(html):
+    """
+    Извлекает метаданные видео из ytInitialPlayerResponse страницы просмотра.
+
+    Returns:
+        dict с ключами title, uploader, duration, thumbnail или None
+    """
+    data = parse_initial_data(html, PLAYER_MARKERS)
+    return parse_video_details(data) if data else None
+
+def parse_video_details(player_response):
+    """
+    Извлекает метаданные видео из ответа плеера (ytInitialPlayerResponse или /youtubei/v1/player).
+
+    Returns:
+        dict с ключами title, uploader, duration, thumbnail или None
+    """
+    details = player_response.get('videoDetails')
+    if not details:
+        return None
+
+    thumbnails = details.get('thumbnail', {}).get('thumbnails') or [{}]
+    try:
+        duration = int(details.get('lengthSeconds') or 0)
+    except ValueError:
+        duration = 0
+    return {
+        'title': details.get('title') or 'Неизвестное видео',
+        'uploader': details.get('author') or 'Неизвестный канал',
+        'duration': duration,
+        'thumbnail': thumbnails[-1].get('url'),
+    }
+
+# Значения, привязанные к сессии или клиенту, которые нельзя коммитить вместе с записанной страницей
+SESSION_KEYS = (
+    'visitorData', 'VISITOR_DATA', 'INNERTUBE_API_KEY', 'ID_TOKEN', 'DELEGATED_SESSION_ID',
+    'DATASYNC_ID', 'SESSION_INDEX', 'remoteHost', 'GOOGLE_FEEDBACK_PRODUCT_DATA', 'XSRF_TOKEN',
+    'EVENT_ID', 'serializedEventId', 'trackingParams', 'clickTrackingParams', 'rolloutToken',
+    'coldConfigData', 'coldHashData', 'hotHashData', 'appInstallData',
+)
+
+def scrub_page(html):
+    """
+    Заменяет сессионные значения и nonce страницы YouTube на заглушки той же длины,
+    чтобы записанная страница сохранила размер и структуру для замеров.
+    """
+    def mask(match):
+        return match.group(1) + 'x' * len(match.group(2)) + match.group(3)
+
+    keys = '|'.join(re.escape(key) for key in SESSION_KEYS)
+    html = re.sub(r'("(?:%s)"\s*:\s*")((?:[^"\\]|\\.)*)(")' % keys, mask, html)
+    html = re.sub(r'(\\"(?:%s)\\"\s*:\s*\\")(.*?)(\\")' % keys, mask, html)
+    return re.sub(r'(nonce=")([^"]*)(")', mask, html)
+
+def record_search_page(query, path):
+    """Скачивает страницу поиска YouTube без cookies, очищает ее и сохраняет вместе с ожидаемыми результатами"""
+    import httpx
+
+    response = httpx.get(
+        'https://www.youtube.com/results',
+        params={'search_query': query},
+        headers={'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64)', 'Accept-Language': 'en-US,en;q=0.9'},
+        follow_redirects=True,
+        timeout=20.0,
+    )
+    response.raise_for_status()
+    page = scrub_page(response.text)
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write(page)
+    expected = parse_search_results(page, limit=20)
+    with open(os.path.splitext(path)[0] + '.json', 'w', encoding='utf-8') as f:
+        json.dump(expected, f, ensure_ascii=False, indent=1)
+    print(f"{path}: записано {len(page) // 1024} КБ, {len(expected)} результатов")
+
+if __name__ == "__main__":
+    # Скорость и результат разбора сохраненных страниц поиска:
+    # python yt_parser.py [страница.html ...]
+    # python yt_parser.py --record "запрос" [fixtures/search_page_recorded.html] - записать настоящую страницу
+    # Если рядом со страницей лежит .json с ожидаемыми результатами, они сверяются.
+    # fixtures/search_page.html собрана вручную и в несколько раз меньше настоящей страницы:
+    # она годится только для сверки, время разбора показательно для записанных страниц
+    import sys
+    import glob
+    import time
+
+    fixtures_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures')
+    synthetic_path = os.path.join(fixtures_dir, 'search_page.html')
+    if sys.argv[1:2] == ['--record']:
+        if len(sys.argv) < 3:
+            sys.exit('Использование: python yt_parser.py --record "запрос" [путь.html]')
+        record_search_page(sys.argv[2], sys.argv[3] if len(sys.argv) > 3 else os.path.join(fixtures_dir, 'search_page_recorded.html'))
+        sys.exit(0)
+
+    paths = sys.argv[1:] or sorted(glob.glob(os.path.join(fixtures_dir, 'search_page_recorded*.html'))) + [synthetic_path]
+    if not sys.argv[1:] and len(paths) == 1:
+        print("Записанных страниц нет (python yt_parser.py --record \"запрос\"), время ниже не отражает настоящие страницы")
+    for path in paths:
+        with open(path, encoding='utf-8') as f:
+            page = f.read()
+        runs = 50
+        started = time.perf_counter()
+        for _ in range(runs):
+            parsed = parse_search_results(page, limit=20)
+        elapsed_ms = (time.perf_counter() - started) / runs * 1000
+        decoder_name = 'orjson' if orjson is not None else 'json'
+        note = ' [синтетическая, только сверка]' if os.path.abspath(path) == synthetic_path else ''
+        print(f"{path}: {len(page) // 1024} КБ, {len(parsed)} результатов, {elapsed_ms:.2f} мс/страница ({decoder_name}){note}")
+        for result in parsed[:5]:
+            print(f"  {result['id']}  {result['uploader']} - {result['title']}")
+
+        expected_path = os.path.splitext(path)[0] + '.json'
+        if os.path.exists(expected_path):
+            with open(expected_path, encoding='utf-8') as f:
+                expected = json.load(f)
+            mismatches = [(want, got) for want, got in zip(expected, parsed) if want != got]
+            if len(expected) != len(parsed):
+                print(f"  ОШИБКА: ожидалось {len(expected)} результатов, получено {len(parsed)}")
+            for want, got in mismatches:
+                print(f"  ОШИБКА:\n    ожидалось {want}\n    получено  {got}")
+            print(f"  Сверка с {expected_path}: {'совпадает' if not mismatches and len(expected) == len(parsed) else 'есть расхождения'}")